@@ -0,0 +1,57 @@
+'''
+Compares the bulk write (sync) and random read throughput of the
+FileDict storage backends.
+
+    python benchmarks/backend_benchmark.py [--keys N] [--value-size N]
+'''
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from datawrap.filedbwrap import FileDict, STORAGE_BACKENDS
+
+def bench_backend(backend, num_keys, value_size, data_dir):
+    db_name = os.path.join(data_dir, backend)
+    value = u'x' * value_size
+    fdict = FileDict(db_name, clear=True, cache_size=num_keys + 1, immutable_vals=True,
+                     backend=backend)
+    fdict.set_many((str(i), value) for i in range(num_keys))
+    start = time.time()
+    fdict.sync_cache()
+    write_time = time.time() - start
+    fdict.close()
+
+    keys = [str(i) for i in range(num_keys)]
+    random.Random(0).shuffle(keys)
+    fdict = FileDict(db_name, read_only=True, cache_size=1024, immutable_vals=True,
+                     backend=backend)
+    start = time.time()
+    for key in keys:
+        fdict[key]
+    read_time = time.time() - start
+    fdict.close()
+    return num_keys / write_time, num_keys / read_time
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--keys', type=int, default=50000)
+    parser.add_argument('--value-size', type=int, default=200)
+    args = parser.parse_args()
+
+    data_dir = tempfile.mkdtemp(prefix='backend_bench')
+    try:
+        print('{:>10} {:>14} {:>14}'.format('backend', 'sync writes/s', 'reads/s'))
+        for backend in sorted(STORAGE_BACKENDS):
+            write_rate, read_rate = bench_backend(backend, args.keys, args.value_size, data_dir)
+            print('{:>10} {:>14.0f} {:>14.0f}'.format(backend, write_rate, read_rate))
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+if __name__ == '__main__':
+    main()
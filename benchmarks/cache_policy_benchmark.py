@@ -0,0 +1,106 @@
+'''
+Compares the hit ratio and throughput of the UnorderedCachedDict
+eviction policies against the default block rejection on a skewed
+(Zipfian) key stream.
+
+    python benchmarks/cache_policy_benchmark.py [--keys N] [--ops N] [--skew S]
+'''
+import argparse
+import bisect
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from datawrap.basewrap import UnorderedCachedDict
+from datawrap.filedbwrap import FileDict
+
+POLICIES = (None, 'lru', 'clock', 'slru')
+
+class CountingDatabase(dict):
+    '''
+    In memory database which counts the reads falling through the cache.
+    '''
+    def __init__(self, *args, **kwargs):
+        dict.__init__(self, *args, **kwargs)
+        self.reads = 0
+
+    def __getitem__(self, key):
+        self.reads += 1
+        return dict.__getitem__(self, key)
+
+    def sync(self):
+        pass
+
+def zipf_stream(num_keys, num_ops, skew, seed=0):
+    '''
+    Generates num_ops keys drawn from num_keys with a Zipfian skew.
+    '''
+    rand = random.Random(seed)
+    cumulative = []
+    total = 0.0
+    for rank in range(1, num_keys + 1):
+        total += 1.0 / (rank ** skew)
+        cumulative.append(total)
+    # Shuffle so that hot keys aren't clustered by insertion order
+    keys = [str(i) for i in range(num_keys)]
+    rand.shuffle(keys)
+    return [keys[bisect.bisect_left(cumulative, rand.random() * total)]
+            for _ in range(num_ops)]
+
+def run_workload(cached, stream, write_ratio=0.1):
+    start = time.time()
+    for i, key in enumerate(stream):
+        if i % int(1 / write_ratio) == 0:
+            cached[key] = i
+        else:
+            cached[key]
+    return time.time() - start
+
+def bench_memory(policy, stream, num_keys, cache_size):
+    database = CountingDatabase((str(i), i) for i in range(num_keys))
+    cached = UnorderedCachedDict(database, cache_size, immutable_vals=True,
+                                 eviction_policy=policy)
+    elapsed = run_workload(cached, stream)
+    reads = [key for i, key in enumerate(stream) if i % 10]
+    hit_ratio = 1.0 - float(database.reads) / len(reads)
+    return hit_ratio, len(stream) / elapsed
+
+def bench_file(policy, stream, num_keys, cache_size, data_dir):
+    fdict = FileDict(os.path.join(data_dir, str(policy)), clear=True,
+                     cache_size=cache_size, immutable_vals=True,
+                     eviction_policy=policy)
+    for i in range(num_keys):
+        fdict[str(i)] = i
+    fdict.sync_cache()
+    elapsed = run_workload(fdict, stream)
+    fdict.close(delete_file=True)
+    return len(stream) / elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--keys', type=int, default=50000)
+    parser.add_argument('--ops', type=int, default=200000)
+    parser.add_argument('--skew', type=float, default=1.0)
+    parser.add_argument('--cache-size', type=int, default=2000)
+    args = parser.parse_args()
+
+    stream = zipf_stream(args.keys, args.ops, args.skew)
+    data_dir = tempfile.mkdtemp(prefix='cache_policy_bench')
+    try:
+        print('{:>8} {:>10} {:>14} {:>14}'.format(
+            'policy', 'hit ratio', 'mem ops/s', 'file ops/s'))
+        for policy in POLICIES:
+            hit_ratio, mem_rate = bench_memory(policy, stream, args.keys, args.cache_size)
+            file_rate = bench_file(policy, stream, args.keys, args.cache_size, data_dir)
+            print('{:>8} {:>10.3f} {:>14.0f} {:>14.0f}'.format(
+                policy or 'block', hit_ratio, mem_rate, file_rate))
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+'''
+Compares the file size and read/write throughput of FileDict with each
+of the named value codecs on text heavy values.
+
+    python benchmarks/codec_benchmark.py [--keys N] [--value-words N]
+'''
+import argparse
+import glob
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from datawrap.filedbwrap import FileDict
+from datawrap.valuecodec import NAMED_CODECS, lzma
+
+WORDS = ('lorem', 'ipsum', 'dolor', 'sit', 'amet', 'consectetur', 'adipiscing',
+         'elit', 'sed', 'do', 'eiusmod', 'tempor', 'incididunt', 'ut', 'labore')
+
+def make_values(num_keys, value_words, seed=0):
+    rand = random.Random(seed)
+    return [(str(i), {'id': i, 'body': u' '.join(rand.choice(WORDS) for _ in range(value_words))})
+            for i in range(num_keys)]
+
+def file_size(db_path):
+    # dbm implementations may spread a database over several files
+    return sum(os.path.getsize(path) for path in glob.glob(db_path + '*'))
+
+def bench_codec(codec, items, data_dir):
+    db_name = os.path.join(data_dir, codec)
+    fdict = FileDict(db_name, clear=True, cache_size=1024, immutable_vals=True, codec=codec)
+    start = time.time()
+    fdict.set_many(items)
+    fdict.sync_cache()
+    write_time = time.time() - start
+    fdict.close()
+
+    fdict = FileDict(db_name, read_only=True, cache_size=1024, immutable_vals=True, codec=codec)
+    start = time.time()
+    for key, _ in items:
+        fdict[key]
+    read_time = time.time() - start
+    size = file_size(fdict._db_full_path)
+    fdict.close()
+    return size, len(items) / write_time, len(items) / read_time
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--keys', type=int, default=20000)
+    parser.add_argument('--value-words', type=int, default=200)
+    args = parser.parse_args()
+
+    items = make_values(args.keys, args.value_words)
+    data_dir = tempfile.mkdtemp(prefix='codec_bench')
+    try:
+        print('{:>16} {:>12} {:>12} {:>12}'.format('codec', 'file KB', 'writes/s', 'reads/s'))
+        for codec in sorted(NAMED_CODECS):
+            if codec == 'lzma' and lzma is None:
+                continue
+            size, write_rate, read_rate = bench_codec(codec, items, data_dir)
+            print('{:>16} {:>12.0f} {:>12.0f} {:>12.0f}'.format(
+                codec, size / 1024.0, write_rate, read_rate))
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+if __name__ == '__main__':
+    main()
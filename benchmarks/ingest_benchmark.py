@@ -0,0 +1,53 @@
+'''
+Compares the throughput of loading a SplitFileDict with bulk_load in one
+process against parallel_ingest with an increasing number of workers.
+
+    python benchmarks/ingest_benchmark.py [--keys N] [--shards N] [--workers N ...]
+'''
+import argparse
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from datawrap.filedbwrap import SplitFileDict
+
+def records(num_keys, value_size):
+    value = u'x' * value_size
+    return ((str(i), {'id': i, 'value': value}) for i in range(num_keys))
+
+def bench(data_dir, num_shards, num_keys, value_size, workers):
+    split = SplitFileDict(os.path.join(data_dir, str(workers)), num_shards=num_shards,
+                          clear=True, immutable_vals=True)
+    if workers:
+        report = split.parallel_ingest(records(num_keys, value_size), workers=workers)
+    else:
+        report = split.bulk_load(records(num_keys, value_size))
+    split.close(delete_file=True)
+    return report['items_per_second']
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--keys', type=int, default=200000)
+    parser.add_argument('--shards', type=int, default=16)
+    parser.add_argument('--value-size', type=int, default=100)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8])
+    args = parser.parse_args()
+
+    data_dir = tempfile.mkdtemp(prefix='ingest_bench')
+    try:
+        print('{} cpus'.format(multiprocessing.cpu_count()))
+        print('{:>10} {:>14} {:>10}'.format('workers', 'items/s', 'speedup'))
+        base = bench(data_dir, args.shards, args.keys, args.value_size, 0)
+        print('{:>10} {:>14.0f} {:>10.2f}'.format('bulk_load', base, 1.0))
+        for workers in args.workers:
+            rate = bench(data_dir, args.shards, args.keys, args.value_size, workers)
+            print('{:>10} {:>14.0f} {:>10.2f}'.format(workers, rate, rate / base))
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+if __name__ == '__main__':
+    main()
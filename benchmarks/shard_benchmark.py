@@ -0,0 +1,78 @@
+'''
+Compares the startup time and steady-state throughput of a SplitFileDict
+with many shards when every shard is opened up front, opened lazily and
+opened lazily with a bounded number kept open.
+
+    python benchmarks/shard_benchmark.py [--shards N] [--keys N] [--ops N] [--max-open N]
+'''
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from datawrap.filedbwrap import SplitFileDict
+
+def open_split(data_dir, num_shards, **kwargs):
+    split_keys = [str(i) for i in range(num_shards)]
+    return SplitFileDict(os.path.join(data_dir, 'shards'), split_keys,
+                         lambda key: str(int(key) % num_shards),
+                         immutable_vals=True, cache_size=num_shards * 4, **kwargs)
+
+def populate(data_dir, num_shards, num_keys):
+    split = open_split(data_dir, num_shards, clear=True, max_open=256)
+    split.bulk_load((str(i), i) for i in range(num_keys))
+    split.close()
+
+def run_workload(split, stream, write_ratio=0.1):
+    start = time.time()
+    for i, key in enumerate(stream):
+        if i % int(1 / write_ratio) == 0:
+            split[key] = i
+        else:
+            split[key]
+    split.sync_cache()
+    return time.time() - start
+
+def bench_mode(data_dir, num_shards, stream, **kwargs):
+    start = time.time()
+    split = open_split(data_dir, num_shards, **kwargs)
+    startup = time.time() - start
+    elapsed = run_workload(split, stream)
+    start = time.time()
+    split.close()
+    return startup, len(stream) / elapsed, time.time() - start
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--shards', type=int, default=10000)
+    parser.add_argument('--keys', type=int, default=200000)
+    parser.add_argument('--ops', type=int, default=200000)
+    parser.add_argument('--max-open', type=int, default=256)
+    parser.add_argument('--hot-shards', type=int, default=200,
+                        help='shards receiving 90%% of the operations')
+    args = parser.parse_args()
+
+    rand = random.Random(0)
+    hot_keys = [i for i in range(args.keys) if i % args.shards < args.hot_shards]
+    stream = [str(rand.choice(hot_keys) if rand.random() < 0.9 else rand.randrange(args.keys))
+              for _ in range(args.ops)]
+    modes = (('eager', {}),
+             ('lazy', {'lazy_open': True}),
+             ('max_open={}'.format(args.max_open), {'max_open': args.max_open}))
+    data_dir = tempfile.mkdtemp(prefix='shard_bench')
+    try:
+        populate(data_dir, args.shards, args.keys)
+        print('{:>14} {:>12} {:>12} {:>12}'.format('mode', 'startup s', 'ops/s', 'close s'))
+        for name, kwargs in modes:
+            startup, rate, close = bench_mode(data_dir, args.shards, stream, **kwargs)
+            print('{:>14} {:>12.3f} {:>12.0f} {:>12.3f}'.format(name, startup, rate, close))
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,34 @@
 import collections
+import itertools
+import multiprocessing
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+try:
+    from queue import Empty, Full
+except ImportError:
+    from Queue import Empty, Full
+from .cachepolicy import get_eviction_policy, estimate_size, value_fingerprint, allocate_budgets
+from .cachestats import make_cache_stats, aggregate_stats
+from .writebehind import WriteBehindWriter, NULL_LOCK, weak_method
+from .setalgebra import StreamingSetOps
+from .sharding import JumpHashSplitter, read_shard_count, write_shard_count, remove_shard_count
+
+# Number of entries handled between cache size checks in bulk operations
+DEFAULT_BATCH_SIZE = 1024
+# Number of entries written to the database at a time by bulk_load
+DEFAULT_BULK_BATCH_SIZE = 16*1024
+# Batches waiting for each parallel_ingest worker before the reader blocks
+INGEST_QUEUE_SIZE = 4
+# Seconds between checks that parallel_ingest workers are still running
+INGEST_POLL_SECONDS = 1
+
+def bulk_load_report(count, seconds):
+    return {
+        'items': count,
+        'seconds': seconds,
+        'items_per_second': count / seconds if seconds > 0 else float(count)
+    }
 
 class UnorderedCachedDict(collections.MutableMapping):
     '''
@@ -11,11 +41,62 @@ class UnorderedCachedDict(collections.MutableMapping):
     wraps the full database as a cached database.
 
     The database must implement __getitem__, __setitem__, __iter__,
-    __len__, __contains__, __delitem__ and (optional) close.
+    __len__, __contains__, __delitem__ and (optional) close. Databases
+    can also implement set_many and delete_many to take batches of writes.
+
+    Unless immutable_vals is set, any value read might be modified in
+    place, so every read is queued to be written back. Passing
+    fingerprint_vals instead stores a digest of each value's pickle when
+    it is read and only writes it back if the digest differs at sync or
+    eviction time. That trades some CPU for skipping the writes of values
+    which were only read.
+
+    A bloom_filter (anything with add and __contains__, such as a
+    bloomfilter.BloomFilter holding every key in the database) can be
+    given to answer most misses without touching the database. Misses
+    it rejects aren't cached, and every key written is added to it.
 
     Cache Size is defined as number of elements, not size of elements,
     so caches with many large elements might take more memory than
-    expected.
+    expected. To bound memory instead, pass cache_bytes as well. Each
+    entry's size is then estimated once when it enters the cache with
+    size_estimator(key, val) (cachepolicy.estimate_size by default) and
+    the cache overflows on whichever budget is exceeded first. Values
+    mutated in place keep the estimate from when they were cached.
+
+    An eviction_policy ('lru', 'clock', 'slru' or a CachePolicy class)
+    can be given to replace the block rejection. On overflow the policy
+    then picks a small batch of victims (eviction_batch, defaulting to
+    ~3% of the cache) and only the dirty victims are written back, so
+    the rest of the working set stays cached.
+
+    With keep_clean, sync_cache only writes back the dirty entries and
+    leaves the cache populated, so checkpoints don't force the working
+    set to be read again. An overflow without an eviction_policy then
+    also stops evicting everything, and evicts just enough arbitrary
+    entries (dict iteration order) the same way the policies do.
+
+    Batches of keys can be loaded with prefetch or get_many, and written
+    with set_many, update_many or delete_many. These probe the cache in
+    one pass and only check the cache size once per DEFAULT_BATCH_SIZE
+    entries. When read_pool_size is set, the database reads for the cache
+    misses of a batch are spread over a pool of that many threads. The
+    database must tolerate concurrent __getitem__ calls unless it sets a
+    false concurrent_reads attribute, in which case reads are serialized.
+
+    With write_behind, dirty entries are written by a background thread
+    (see WriteBehindWriter) instead of inside whichever call overflowed
+    the cache. Dirty entries are handed off on overflow and at least
+    every write_behind_interval seconds, with at most write_behind_queue
+    batches in flight before callers block. Explicit syncs, iteration,
+    len and close still wait for all writes to land. Values are pickled
+    on the writer thread, so avoid mutating values in place after they
+    are set when using write_behind.
+
+    Counters for hits, misses, evictions, written back entries and syncs
+    are returned by stats when collect_stats is set (see CacheStats). The
+    on_miss, on_evict, on_sync_start and on_sync_end hooks are called as
+    those events happen, and also turn on the counters.
 
     NOTE: Pushing None values into the dictionary will cause an exception
     and getting an item with None value is considered to be an entry for
@@ -24,26 +105,70 @@ class UnorderedCachedDict(collections.MutableMapping):
     def __init__(self, database, cache_size, read_only=False,
                  immutable_vals=False, stringify_keys=False,
                  cache_misses=True, database_default_func=None,
-                 read_pool_size=0, value_converter=None, **kwargs):
+                 read_pool_size=0, value_converter=None, eviction_policy=None,
+                 eviction_batch=None, cache_bytes=None, size_estimator=None,
+                 write_behind=False, write_behind_interval=1.0, write_behind_queue=4,
+                 fingerprint_vals=False, bloom_filter=None, keep_clean=False, collect_stats=False,
+                 on_miss=None, on_evict=None, on_sync_start=None, on_sync_end=None,
+                 **kwargs):
         self.cache_size = cache_size
+        self.cache_bytes = cache_bytes
         self.read_only = read_only
         self.stringify_keys = stringify_keys
         self.value_converter = value_converter
         self.closed = False
 
         self._immutable_vals = immutable_vals
+        self._fingerprint_vals = fingerprint_vals
+        self._fingerprints = {}
         self._cache_misses = cache_misses
         self._cache = {}
         self._cur_size = 0
+        self._cur_bytes = 0
+        self._entry_sizes = {}
+        self._size_estimator = size_estimator
+        self._estimate_size = size_estimator if size_estimator else estimate_size
         self._read_pool_size = read_pool_size
+        self._read_pool = None
         self._wqueue = set()
         self._database = database
         self._database_default_func = database_default_func
+        self._bloom = bloom_filter
+        self._eviction_policy = eviction_policy
+        self._eviction_batch = eviction_batch
+        self._keep_clean = keep_clean
+        self._policy = get_eviction_policy(eviction_policy, cache_size)
+        self._write_behind = write_behind
+        self._write_behind_interval = write_behind_interval
+        self._write_behind_queue = write_behind_queue
+        self._collect_stats = collect_stats
+        self._stats = make_cache_stats(collect_stats, on_miss, on_evict,
+                                       on_sync_start, on_sync_end)
+
+        # The locks are only real when other threads touch the cache or database
+        self._writer = None
+        self._lock = NULL_LOCK
+        self._db_lock = NULL_LOCK
+        if write_behind and not read_only:
+            self._writer = WriteBehindWriter(database, write_behind_interval,
+                                             write_behind_queue,
+                                             weak_method(self, '_stage_dirty'))
+            self._lock = self._writer.lock
+            self._db_lock = self._writer.database_lock
+        elif read_pool_size and not self._database_supports_concurrent_reads():
+            self._db_lock = threading.RLock()
+
+    def _database_supports_concurrent_reads(self):
+        return getattr(self._database, 'concurrent_reads', True)
 
     def _add_init_kwargs(self, kwargs):
         # These can be changed by caller
         if 'cache_size' not in kwargs:
             kwargs['cache_size'] = self.cache_size
+        if 'cache_bytes' not in kwargs:
+            kwargs['cache_bytes'] = self.cache_bytes
+        if 'size_estimator' not in kwargs:
+            kwargs['size_estimator'] = self._size_estimator
         if 'read_only' not in kwargs:
             kwargs['read_only'] = self.read_only
         if 'cache_misses' not in kwargs:
@@ -54,10 +179,32 @@ class UnorderedCachedDict(collections.MutableMapping):
             kwargs['read_pool_size'] = self._read_pool_size
         if 'immutable_vals' not in kwargs:
             kwargs['immutable_vals'] = self._immutable_vals
+        if 'fingerprint_vals' not in kwargs:
+            kwargs['fingerprint_vals'] = self._fingerprint_vals
+        if 'bloom_filter' not in kwargs:
+            kwargs['bloom_filter'] = self._bloom
         if 'stringify_keys' not in kwargs:
             kwargs['stringify_keys'] = self.stringify_keys
         if 'value_converter' not in kwargs:
             kwargs['value_converter'] = self.value_converter
+        if 'eviction_policy' not in kwargs:
+            kwargs['eviction_policy'] = self._eviction_policy
+        if 'eviction_batch' not in kwargs:
+            kwargs['eviction_batch'] = self._eviction_batch
+        if 'keep_clean' not in kwargs:
+            kwargs['keep_clean'] = self._keep_clean
+        if 'write_behind' not in kwargs:
+            kwargs['write_behind'] = self._write_behind
+        if 'write_behind_interval' not in kwargs:
+            kwargs['write_behind_interval'] = self._write_behind_interval
+        if 'write_behind_queue' not in kwargs:
+            kwargs['write_behind_queue'] = self._write_behind_queue
+        if 'collect_stats' not in kwargs:
+            kwargs['collect_stats'] = self._collect_stats
+        if self._stats is not None:
+            for hook in ('on_miss', 'on_evict', 'on_sync_start', 'on_sync_end'):
+                if hook not in kwargs:
+                    kwargs[hook] = getattr(self._stats, hook)
 
     def _reinit(self, **kwargs):
         self._add_init_kwargs(kwargs)
@@ -75,13 +222,122 @@ class UnorderedCachedDict(collections.MutableMapping):
     def __exit__(self, etype, value, traceback):
         self.close()
 
+    def _over_budget(self):
+        return (self._cur_size > self.cache_size or
+                (self.cache_bytes is not None and self._cur_bytes > self.cache_bytes))
+
     def _check_cache_size(self):
-        if self._cur_size > self.cache_size:
+        if self._over_budget():
+            if self._policy is not None or self._keep_clean:
+                self._evict_overflow()
+                return
+            if self._stats is not None:
+                self._stats.evict(self._cache)
             if self.read_only:
                 self.drop_cache()
+            elif self._writer is not None:
+                # Don't wait on the writer, just hand it everything dirty
+                self._write_back(self._take_dirty())
+                self.drop_cache()
             else:
                 self.sync_cache()
 
+    def _evict_overflow(self):
+        '''
+        Evicts enough entries to get back under the cache size, plus
+        a batch of extras so we don't evict on every single insert.
+        '''
+        batch = self._eviction_batch or max(1, int(self.cache_size) // 32)
+        overflow = self._cur_size - int(self.cache_size)
+        if overflow > 0:
+            self._evict(overflow + batch - 1)
+        if self.cache_bytes is not None:
+            while self._cur_bytes > self.cache_bytes and self._evict(batch):
+                pass
+
+    def _evict(self, count):
+        '''
+        Removes up to count entries chosen by the eviction policy, or
+        arbitrary entries (in dict iteration order) without one. Only the
+        victims with queued writes touch the database. Returns the number
+        of entries evicted.
+        '''
+        if self._policy is not None:
+            victims = self._policy.victims(count)
+        else:
+            victims = list(itertools.islice(self._cache, count))
+        if self._stats is not None:
+            self._stats.evict(victims)
+        dirty = []
+        with self._lock:
+            for key in victims:
+                if key in self._wqueue or self._changed_since_read(key):
+                    dirty.append((key, self._cache[key]))
+                    self._wqueue.discard(key)
+                self._fingerprints.pop(key, None)
+                del self._cache[key]
+                if self.cache_bytes is not None:
+                    self._cur_bytes -= self._entry_sizes.pop(key, 0)
+            self._cur_size -= len(victims)
+        self._write_back(dirty)
+        return len(victims)
+
+    def _take_dirty(self):
+        '''
+        Empties the write queue, returning the (key, value) pairs to write.
+        '''
+        with self._lock:
+            if self._fingerprints:
+                self._wqueue.update(key for key in self._fingerprints
+                                    if self._changed_since_read(key, update=True))
+            dirty = [(key, self._cache[key]) for key in self._wqueue]
+            self._wqueue = set()
+        return dirty
+
+    def _changed_since_read(self, key, update=False):
+        '''
+        Checks if a value read with fingerprint_vals on has changed,
+        optionally storing its new fingerprint.
+        '''
+        if key not in self._fingerprints:
+            return False
+        fingerprint = value_fingerprint(self._cache[key])
+        changed = fingerprint is None or fingerprint != self._fingerprints[key]
+        if changed and update:
+            self._fingerprints[key] = fingerprint
+        return changed
+
+    def _write_back(self, items):
+        '''
+        Writes (key, value) pairs to the database, or hands them to the
+        background writer when write_behind is on. Databases with a
+        set_many get the whole batch at once.
+        '''
+        if self._stats is not None:
+            self._stats.flush(items, self._estimate_size)
+        if self._writer is not None:
+            self._writer.hand_off(items)
+        elif items and hasattr(self._database, 'set_many'):
+            self._database.set_many(items)
+        else:
+            for key, val in items:
+                self._database[key] = val
+
+    def _stage_dirty(self):
+        '''
+        Called from the background writer to move the write queue into
+        its pending entries, returning the keys to write.
+        '''
+        writer = self._writer
+        if writer is None:
+            return None
+        with self._lock:
+            dirty = self._take_dirty()
+            writer.pending.update(dirty)
+        if self._stats is not None:
+            self._stats.flush(dirty, self._estimate_size)
+        return [key for key, _ in dirty]
+
     def get_cache(self):
         '''
         Gets the cache as a stand-alone object -- updates
@@ -93,9 +349,104 @@ class UnorderedCachedDict(collections.MutableMapping):
     def _get_item_from_database(self, key):
         return self._database.__getitem__(key)
 
+    def _read_database(self, key):
+        '''
+        Reads a key from the database, checking the entries still
+        pending in the background writer first.
+        '''
+        if self._writer is not None:
+            val = self._writer.pending.get(key)
+            if val is not None:
+                return val
+        with self._db_lock:
+            return self._get_item_from_database(key)
+
     def _get_item_from_cache(self, key):
         return self._cache.__getitem__(key)
 
+    def _bloom_rejects(self, key):
+        '''
+        True if the bloom filter guarantees the key isn't in the database.
+        '''
+        return self._bloom is not None and key not in self._bloom
+
+    def _fetch_from_database(self, key):
+        '''
+        Database read used by the read pool, which gives None for a
+        missing key instead of raising.
+        '''
+        try:
+            return self._read_database(key)
+        except KeyError:
+            return None
+
+    def _get_read_pool(self):
+        if self._read_pool is None:
+            self._read_pool = ThreadPool(self._read_pool_size)
+        return self._read_pool
+
+    def _load_many(self, keys):
+        '''
+        Loads every key into the cache, reading all the misses from the
+        database in one batch. Returns a dictionary of the values found,
+        with None for missing keys, as the cache might overflow after the
+        batch is loaded.
+        '''
+        found = {}
+        misses = []
+        for key in keys:
+            if key != None and self.stringify_keys:
+                key = str(key)
+            if key in found:
+                continue
+            try:
+                found[key] = self._get_item_from_cache(key)
+                if self._policy is not None:
+                    self._policy.access(key)
+                if self._stats is not None:
+                    self._stats.hits += 1
+            except KeyError:
+                found[key] = None
+                if self._stats is not None:
+                    self._stats.miss(key)
+                if not self._bloom_rejects(key):
+                    misses.append(key)
+        if self._read_pool_size and len(misses) > 1:
+            vals = self._get_read_pool().map(self._fetch_from_database, misses)
+        else:
+            vals = [self._fetch_from_database(key) for key in misses]
+        for key, val in zip(misses, vals):
+            found[key] = val
+            if val != None or self._cache_misses:
+                self._insert_cache(key, val, True)
+        self._check_cache_size()
+        return found
+
+    def prefetch(self, keys):
+        '''
+        Loads all of the given keys into the cache ahead of use.
+        '''
+        self._load_many(keys)
+
+    def get_many(self, keys, default=None):
+        '''
+        Gets the values for all keys as a list in the same order. Missing
+        keys give the database_default_func value if there is one and
+        otherwise the default argument.
+        '''
+        if self.stringify_keys:
+            keys = [str(key) if key != None else key for key in keys]
+        else:
+            keys = list(keys)
+        found = self._load_many(keys)
+        vals = []
+        for key in keys:
+            val = found[key]
+            if val == None:
+                val = self._database_default_func() if self._database_default_func else default
+            vals.append(val)
+        return vals
+
     def __getitem__(self, key):
         '''
         Checks cache for entry, then database for entry.
@@ -105,13 +456,20 @@ class UnorderedCachedDict(collections.MutableMapping):
             key = str(key)
         try:
             val = self._get_item_from_cache(key)
+            if self._policy is not None:
+                self._policy.access(key)
+            if self._stats is not None:
+                self._stats.hits += 1
         except KeyError:
-            try:
-                val = self._get_item_from_database(key)
-            except KeyError: pass
-            if val != None or self._cache_misses:
-                self._insert_cache(key, val, True)
-                self._check_cache_size()
+            if self._stats is not None:
+                self._stats.miss(key)
+            if not self._bloom_rejects(key):
+                try:
+                    val = self._read_database(key)
+                except KeyError: pass
+                if val != None or self._cache_misses:
+                    self._insert_cache(key, val, True)
+                    self._check_cache_size()
         if val == None:
             if self._database_default_func:
                 val = self._database_default_func()
@@ -121,6 +479,10 @@ class UnorderedCachedDict(collections.MutableMapping):
 
     def __iter__(self):
         self._sync_writes()
+        if self._writer is not None:
+            # Later hand offs can write while the caller iterates
+            with self._db_lock:
+                return iter(list(self._database))
         return self._database.__iter__()
 
     def _insert_cache(self, key, val, read):
@@ -133,15 +495,36 @@ class UnorderedCachedDict(collections.MutableMapping):
         '''
         if key != None and self.stringify_keys:
             key = str(key)
-        cval = self._cache.get(key)
-        if cval == None:
+        if key in self._cache:
+            cval = self._cache[key]
+            if self._policy is not None:
+                self._policy.access(key)
+        else:
+            cval = None
             self._cur_size += 1
+            if self._policy is not None:
+                self._policy.insert(key)
         if cval == None or val != cval:
-            self._cache[key] = val
-            # Force a write if it's a write or if it's
-            # unclear that the item was modified
-            if not self.read_only and (not self._immutable_vals or not read):
-                self._wqueue.add(key)
+            if self.cache_bytes is not None:
+                # Cached misses only cost their cache slot
+                size = self._estimate_size(key, val) if val != None else 0
+                self._cur_bytes += size - self._entry_sizes.get(key, 0)
+                self._entry_sizes[key] = size
+            with self._lock:
+                self._cache[key] = val
+                # Force a write if it's a write or if it's
+                # unclear that the item was modified. Cached
+                # misses (None) are never written.
+                if val == None or self.read_only or (read and self._immutable_vals):
+                    self._fingerprints.pop(key, None)
+                elif read and self._fingerprint_vals:
+                    # Reads are only written back if their fingerprint changes
+                    self._fingerprints[key] = value_fingerprint(val)
+                else:
+                    self._fingerprints.pop(key, None)
+                    self._wqueue.add(key)
+                    if not read and self._bloom is not None:
+                        self._bloom.add(key)
 
     def __len__(self):
         '''
@@ -150,7 +533,8 @@ class UnorderedCachedDict(collections.MutableMapping):
         '''
         # Need to sync before we know our true size
         self._sync_writes()
-        return len(self._database)
+        with self._db_lock:
+            return len(self._database)
 
     def __contains__(self, key):
         '''
@@ -160,9 +544,17 @@ class UnorderedCachedDict(collections.MutableMapping):
             key = str(key)
         try:
             cont = (self._cache.__getitem__(key) != None)
+            if self._policy is not None:
+                self._policy.access(key)
+            if self._stats is not None:
+                self._stats.hits += 1
         except KeyError:
+            if self._stats is not None:
+                self._stats.miss(key)
+            if self._bloom_rejects(key):
+                return False
             try:
-                val = self._database.__getitem__(key)
+                val = self._read_database(key)
                 cont = True
             except KeyError:
                 val = None
@@ -191,64 +583,253 @@ class UnorderedCachedDict(collections.MutableMapping):
             raise AttributeError("Attempted to delete in read_only mode")
         if key != None and self.stringify_keys:
             key = str(key)
+        self._uncache_deleted(key)
+        # We don't know if the database has this item or not
+        with self._db_lock:
+            if key in self._database:
+                self._database.__delitem__(key)
 
-        if self._cache_misses:
-            self._insert_cache(key, None, True)
-        elif key in self._cache:
-            del self._cache[key]
-        if key in self._wqueue:
+    def _uncache_deleted(self, key):
+        '''
+        Clears a deleted key out of the cache and the write queue.
+        '''
+        with self._lock:
+            if self._cache_misses:
+                self._insert_cache(key, None, True)
+            elif key in self._cache:
+                del self._cache[key]
+                self._cur_size -= 1
+                if self.cache_bytes is not None:
+                    self._cur_bytes -= self._entry_sizes.pop(key, 0)
+                if self._policy is not None:
+                    self._policy.remove(key)
             self._wqueue.discard(key)
-        # We don't know if the database has this item or not
-        if key in self._database:
-            self._database.__delitem__(key)
+            self._fingerprints.pop(key, None)
+            if self._writer is not None:
+                self._writer.pending.pop(key, None)
+
+    def set_many(self, items):
+        '''
+        Sets every (key, value) pair of items, which can also be a mapping.
+        '''
+        if self.read_only:
+            raise AttributeError("Attempted to set in read_only mode")
+        if isinstance(items, collections.Mapping):
+            items = items.items()
+        for count, (key, val) in enumerate(items, 1):
+            if val == None:
+                raise AttributeError("Attempted to set a key value to None")
+            # Stringify is handled by the insert
+            self._insert_cache(key, val, False)
+            if count % DEFAULT_BATCH_SIZE == 0:
+                self._check_cache_size()
+        self._check_cache_size()
+
+    def update_many(self, other=(), **kwargs):
+        '''
+        Batched equivalent of update, taking the same arguments.
+        '''
+        self.set_many(other)
+        if kwargs:
+            self.set_many(kwargs)
+
+    def delete_many(self, keys):
+        '''
+        Deletes all keys from the cache and the database. Keys which
+        aren't present are ignored.
+        '''
+        if self.read_only:
+            raise AttributeError("Attempted to delete in read_only mode")
+        if self.stringify_keys:
+            keys = [str(key) if key != None else key for key in keys]
+        else:
+            keys = list(keys)
+        for key in keys:
+            self._uncache_deleted(key)
+        with self._db_lock:
+            if hasattr(self._database, 'delete_many'):
+                self._database.delete_many(keys)
+            else:
+                for key in keys:
+                    if key in self._database:
+                        self._database.__delitem__(key)
+        self._check_cache_size()
+
+    def bulk_load(self, items, clear=True, batch_size=DEFAULT_BULK_BATCH_SIZE):
+        '''
+        Loads (key, value) pairs straight into the database in batches of
+        batch_size, using set_many where the database has it, instead of
+        passing them through the cache. The database is cleared first
+        unless clear is False, in which case loaded values replace
+        existing ones.
+
+        Returns a dictionary with the items loaded, the seconds taken and
+        the items per second.
+        '''
+        start = time.time()
+        self._prepare_bulk_load(clear)
+        if isinstance(items, collections.Mapping):
+            items = items.items()
+        items = iter(items)
+        count = 0
+        while True:
+            batch = list(itertools.islice(items, batch_size))
+            if not batch:
+                break
+            self._bulk_write(batch)
+            count += len(batch)
+        self._finish_bulk_load()
+        return bulk_load_report(count, time.time() - start)
+
+    def _prepare_bulk_load(self, clear):
+        if self.read_only:
+            raise AttributeError("Attempted to set in read_only mode")
+        if clear:
+            self.clear()
+        else:
+            # Loaded values replace anything cached or waiting to be written
+            self._sync_writes()
+            self.drop_cache()
+
+    def _bulk_write(self, items):
+        '''
+        Writes a batch of a bulk load to the database.
+        '''
+        if self.stringify_keys:
+            items = [(str(key) if key != None else key, val) for key, val in items]
+        for _, val in items:
+            if val == None:
+                raise AttributeError("Attempted to set a key value to None")
+        if self._bloom is not None:
+            self._bloom.update(key for key, _ in items)
+        if self._stats is not None:
+            self._stats.flush(items, self._estimate_size)
+        with self._db_lock:
+            if hasattr(self._database, 'set_many'):
+                self._database.set_many(items)
+            else:
+                for key, val in items:
+                    self._database[key] = val
+
+    def _finish_bulk_load(self):
+        with self._db_lock:
+            self._database.sync()
 
     def _sync_writes(self):
         '''
         Flushes the write queue
         '''
-        for key in self._wqueue:
-            val = self._cache[key]
-            self._database[key] = val
-        del self._wqueue
-        self._wqueue = set()
-        self._database.sync()
+        if self._stats is not None:
+            start = self._stats.sync_started()
+        self._write_back(self._take_dirty())
+        if self._writer is not None:
+            self._writer.flush()
+        else:
+            self._database.sync()
+        if self._stats is not None:
+            self._stats.sync_ended(start)
+
+    def stats(self):
+        '''
+        Gets a dictionary of the counters kept with collect_stats (see
+        CacheStats), plus the number of cached entries and, with a
+        cache_bytes budget, their estimated bytes.
+        '''
+        stats = self._stats.as_dict() if self._stats is not None else {}
+        stats['cached_entries'] = self._cur_size
+        if self.cache_bytes is not None:
+            stats['cached_bytes'] = self._cur_bytes
+        return stats
 
-    def sync_cache(self):
+    def set_cache_size(self, cache_size=None, cache_bytes=None):
         '''
-        Flushes the write queue to the database.
+        Changes the cache budget in place, evicting (or syncing the block
+        cache) straight away if the cache is over the new budget.
+        '''
+        if cache_size is not None:
+            self.cache_size = cache_size
+            if self._policy is not None:
+                self._policy.resize(cache_size)
+        if cache_bytes is not None:
+            self.cache_bytes = cache_bytes
+        self._check_cache_size()
+
+    def sync_cache(self, keep_clean=None):
+        '''
+        Flushes the write queue to the database, then drops the cache
+        unless keep_clean (defaulting to the keep_clean option) is set.
         '''
         self._sync_writes()
-        self.drop_cache()
+        if not (self._keep_clean if keep_clean is None else keep_clean):
+            self.drop_cache()
 
     def drop_cache(self):
         '''
         Drops all changes in the cache.
         '''
-        del self._cache
-        self._cache  = {}
-        del self._wqueue
-        self._wqueue = set()
+        with self._lock:
+            del self._cache
+            self._cache  = {}
+            del self._wqueue
+            self._wqueue = set()
+            self._fingerprints = {}
         self._cur_size = 0
+        self._cur_bytes = 0
+        self._entry_sizes = {}
+        if self._policy is not None:
+            self._policy.clear()
+
+    def _stop_workers(self):
+        '''
+        Shuts down the read pool and the background writer, leaving
+        the writes the writer had queued in the database.
+        '''
+        # Either may be missing if __init__ failed
+        read_pool = getattr(self, '_read_pool', None)
+        if read_pool is not None:
+            self._read_pool = None
+            read_pool.close()
+            read_pool.join()
+        if getattr(self, '_writer', None) is not None:
+            writer = self._writer
+            self._writer = None
+            self._lock = NULL_LOCK
+            self._db_lock = NULL_LOCK
+            try:
+                writer.stop()
+            finally:
+                # Retry anything the writer failed to write
+                self._write_back(list(writer.pending.items()))
 
     def close(self, **kwargs):
-        if not self.closed:
-            self.sync_cache()
-            # This will barf if the database doesn't have a close operator,
-            # so check for close first
-            if hasattr(self._database, 'close'):
-                self._database.close(**kwargs)
-        self.closed = True
+        # The database is closed even if the last writes fail
+        try:
+            self._stop_workers()
+        finally:
+            try:
+                if not self.closed:
+                    self.sync_cache()
+            finally:
+                # This will barf if the database doesn't have a close operator,
+                # so check for close first
+                if not self.closed and hasattr(self._database, 'close'):
+                    self._database.close(**kwargs)
+                self.closed = True
 
     def __del__(self):
         # Close if we're being collected
         self.close()
 
-class UnorderedCachedSet(collections.MutableSet, UnorderedCachedDict):
+class UnorderedCachedSet(collections.MutableSet, UnorderedCachedDict, StreamingSetOps):
     '''
     Acts much like an UnorderedCachedDict except it stores key existence
     instead of key value pairs. Thus the data is still stored in the
     database as a dictionary, but treated as a set on the external
     interface.
+
+    Set operations too large for memory can instead be streamed into
+    another set with union_into, intersection_into and difference_into
+    (see setalgebra).
     '''
     def __init__(self, database, cache_size, read_only=False, cache_misses=True,
                  immutable_vals=False, stringify_keys=False, read_pool_size=0, **kwargs):
@@ -284,6 +865,15 @@ class UnorderedCachedSet(collections.MutableSet, UnorderedCachedDict):
     def __setitem__(self, key, val):
         raise AttributeError( "'Set' object has no attribute '__setitem__'" )
 
+    def get_many(self, elems, default=None):
+        raise AttributeError( "'Set' object has no attribute 'get_many'" )
+
+    def set_many(self, items):
+        raise AttributeError( "'Set' object has no attribute 'set_many'" )
+
+    def update_many(self, other=(), **kwargs):
+        raise AttributeError( "'Set' object has no attribute 'update_many'" )
+
     def update(self, *args, **kwargs):
         '''
         Updates the set to include all arguments passed in. If the keyword
@@ -292,8 +882,17 @@ class UnorderedCachedSet(collections.MutableSet, UnorderedCachedDict):
         '''
         preprocess = kwargs.get('preprocess')
         for s in args:
-            for e in s:
-                self._dict_set(preprocess(e) if preprocess else e, True)
+            # Call UnorderedCachedDict's version since we've disabled it
+            UnorderedCachedDict.set_many(self, ((preprocess(e) if preprocess else e, True)
+                                                for e in s))
+
+    def bulk_load(self, elems, clear=True, batch_size=DEFAULT_BULK_BATCH_SIZE):
+        '''
+        Loads elements straight into the database (see
+        UnorderedCachedDict.bulk_load).
+        '''
+        return UnorderedCachedDict.bulk_load(self, ((e, True) for e in elems), clear=clear,
+                                             batch_size=batch_size)
 
 class MemDict(collections.MutableMapping):
     '''
@@ -380,10 +979,47 @@ class MemDict(collections.MutableMapping):
             key = str(key)
         self._database.__delitem__(key)
 
+    def prefetch(self, keys):
+        pass # No-op
+
+    def get_many(self, keys, default=None):
+        vals = []
+        for key in keys:
+            if key != None and self.stringify_keys:
+                key = str(key)
+            try:
+                vals.append(self._database[key])
+            except KeyError:
+                vals.append(self._database_default_func() if self._database_default_func
+                            else default)
+        return vals
+
+    def set_many(self, items):
+        if self.read_only:
+            raise AttributeError("Attempted to set in read_only mode")
+        if isinstance(items, collections.Mapping):
+            items = items.items()
+        if self.stringify_keys:
+            items = ((str(key) if key != None else key, val) for key, val in items)
+        self._database.update(items)
+
+    def update_many(self, other=(), **kwargs):
+        self.set_many(other)
+        if kwargs:
+            self.set_many(kwargs)
+
+    def delete_many(self, keys):
+        if self.read_only:
+            raise AttributeError("Attempted to delete in read_only mode")
+        for key in keys:
+            if key != None and self.stringify_keys:
+                key = str(key)
+            self._database.pop(key, None)
+
     def _sync_writes(self):
         pass # No-op
 
-    def sync_cache(self):
+    def sync_cache(self, keep_clean=None):
         pass # No-op
 
     def drop_cache(self):
@@ -410,6 +1046,161 @@ class MemDict(collections.MutableMapping):
         # Close if we're being collected
         self.close()
 
+class ShardError(Exception):
+    '''
+    Raised once an operation has run on every database of a split
+    database when any of them failed, with each failure by split key
+    in errors.
+    '''
+    def __init__(self, operation, errors):
+        Exception.__init__(self, "{} failed on {} shard(s): {}".format(
+            operation, len(errors), ', '.join('{}: {!r}'.format(skey, error)
+                                             for skey, error in sorted(errors.items(),
+                                                                       key=lambda e: str(e[0])))))
+        self.operation = operation
+        self.errors = errors
+
+def _ingest_worker(shards, kwargs, batches, results):
+    '''
+    Runs in a parallel_ingest worker process, bulk writing the batches
+    for the shards it owns. shards maps each split key to its database
+    class, name and whether to clear it first. Reports the count written
+    to each shard and any error on results.
+    '''
+    dbs = {}
+    counts = dict((skey, 0) for skey in shards)
+    skey = None
+    try:
+        for skey, items in iter(batches.get, None):
+            db = dbs.get(skey)
+            if db is None:
+                db_class, db_name, clear = shards[skey]
+                db = dbs[skey] = db_class(db_name, **kwargs)
+                db._prepare_bulk_load(clear)
+            db._bulk_write(items)
+            counts[skey] += len(items)
+        for skey, (db_class, db_name, clear) in shards.items():
+            if skey not in dbs and clear:
+                dbs[skey] = db_class(db_name, clear=True, **kwargs)
+        for skey, db in dbs.items():
+            db._finish_bulk_load()
+            db.close()
+        results.put((counts, None))
+    except Exception as e:
+        # Exceptions may not pickle, so only their description is sent
+        batches.cancel_join_thread()
+        results.put((counts, (skey, '{!r}'.format(e))))
+
+def _put_checked(queue, item, process):
+    while True:
+        try:
+            queue.put(item, timeout=INGEST_POLL_SECONDS)
+            return True
+        except Full:
+            if not process.is_alive():
+                return False
+
+def _get_checked(queue, processes):
+    while True:
+        try:
+            return queue.get(timeout=INGEST_POLL_SECONDS)
+        except Empty:
+            if not any(process.is_alive() for process in processes):
+                # The result may have arrived as the last worker exited
+                try:
+                    return queue.get(timeout=INGEST_POLL_SECONDS)
+                except Empty:
+                    return None
+
+class ShardPool(collections.Mapping):
+    '''
+    The databases of a split database by split key, each opened by
+    open_func(skey, clear) the first time it's looked up. With max_open,
+    opening one more than max_open databases closes the least recently
+    used one first, which syncs its cache, and it's opened again the
+    next time it's needed. Databases in pending_clear are cleared when
+    they're next opened.
+    '''
+    def __init__(self, split_keys, open_func, max_open=None, clear=False):
+        self._split_keys = list(split_keys)
+        self._key_set = set(self._split_keys)
+        self._open_func = open_func
+        self.max_open = max_open
+        self.pending_clear = set(self._split_keys) if clear else set()
+        self._open = collections.OrderedDict()
+        self._lock = threading.RLock()
+
+    def __getitem__(self, skey):
+        if not self.max_open:
+            # Unbounded pools never close databases, so order doesn't matter
+            db = self._open.get(skey)
+            if db is not None:
+                return db
+        with self._lock:
+            db = self._open.pop(skey, None)
+            if db is None:
+                if skey not in self._key_set:
+                    raise KeyError(skey)
+                if self.max_open:
+                    while len(self._open) >= self.max_open:
+                        _, lru_db = self._open.popitem(last=False)
+                        lru_db.close()
+                db = self._open_func(skey, skey in self.pending_clear)
+                self.pending_clear.discard(skey)
+            self._open[skey] = db
+            return db
+
+    def __iter__(self):
+        return iter(self._split_keys)
+
+    def __len__(self):
+        return len(self._split_keys)
+
+    def __contains__(self, skey):
+        return skey in self._key_set
+
+    def add(self, skey, clear=False):
+        with self._lock:
+            if skey not in self._key_set:
+                self._split_keys.append(skey)
+                self._key_set.add(skey)
+                if clear:
+                    self.pending_clear.add(skey)
+
+    def remove(self, skey):
+        '''
+        Forgets a split key, leaving its database to the caller to close.
+        '''
+        with self._lock:
+            self._split_keys.remove(skey)
+            self._key_set.discard(skey)
+            self.pending_clear.discard(skey)
+            self._open.pop(skey, None)
+
+    def open_items(self):
+        '''
+        Gets the (split key, database) pairs of the open databases.
+        '''
+        with self._lock:
+            return list(self._open.items())
+
+    def release(self, **kwargs):
+        '''
+        Forgets the open databases, which the caller has closed, and
+        closes any others with kwargs when deleting their files or when
+        they're waiting to be cleared.
+        '''
+        with self._lock:
+            opened = set(self._open)
+            self._open.clear()
+            if kwargs.get('delete_file'):
+                skeys = [skey for skey in self._split_keys if skey not in opened]
+            else:
+                skeys = [skey for skey in self._split_keys if skey in self.pending_clear]
+            for skey in skeys:
+                self._open_func(skey, skey in self.pending_clear).close(**kwargs)
+            self.pending_clear = set()
+
 class SplitDbDict(collections.MutableMapping):
     '''
     Defines a way to split data among any number of arbitrary databases.
@@ -422,50 +1213,376 @@ class SplitDbDict(collections.MutableMapping):
     If the split_func gives an invalid key name, a KeyError will be raised,
     so make sure updates to split_keys also updates split_func.
 
-    If a cache_size if passed through kwargs, it is evenly divided among all
-    databases.
+    Without a split_func, num_shards databases named 0 to num_shards - 1
+    are used with a JumpHashSplitter, and their number can be changed
+    with reshard. The count is stored next to the databases, so later
+    opens can leave out num_shards, and opening with a different count
+    raises a ValueError unless clearing.
+
+    If a cache_size or cache_bytes is passed through kwargs, it is evenly
+    divided among all databases.
+
+    Syncs, closes, reopens, compactions and len run on the databases in
+    parallel on a pool of shard_workers threads, when given, as their
+    file work mostly releases the GIL. Failures are collected from every
+    database and raised together as a ShardError, and the seconds each
+    database took are kept by operation name in shard_timings.
+
+    With adaptive_cache, every rebalance_every operations the cache
+    budget is moved towards the databases missing the most (see
+    rebalance_cache), keeping the total cache_size and cache_bytes.
+
+    With lazy_open each database is only opened when first used, so
+    configurations with many databases start instantly, and max_open
+    bounds how many are open at once (see ShardPool). The cache budget is
+    then split among max_open databases rather than all of them.
     '''
-    def __init__(self, db_name, base_db_class, split_keys, split_func,
-                 keyed_classes=None, stringify_keys=False, **kwargs):
+    def __init__(self, db_name, base_db_class, split_keys=None, split_func=None,
+                 keyed_classes=None, stringify_keys=False, shard_workers=0,
+                 adaptive_cache=False, rebalance_every=10*1024, lazy_open=False,
+                 max_open=None, num_shards=None, **kwargs):
         self.stringify_keys = stringify_keys
+        self._db_name = db_name
+        self._init_shard_options(shard_workers, adaptive_cache, rebalance_every, kwargs)
+        self._init_split(split_keys, split_func, num_shards, kwargs)
+
+        self._base_db_class = base_db_class
+        self._keyed_classes = keyed_classes if keyed_classes else {}
+        self._open_databases(lazy_open, max_open, kwargs)
+
+    def _init_split(self, split_keys, split_func, num_shards, kwargs):
+        if split_func is None:
+            # The shard count is kept next to the databases, as opening
+            # them with another count would look keys up in the wrong ones
+            stored = read_shard_count(self._db_name)
+            if num_shards is None:
+                num_shards = stored
+            elif stored is not None and stored != num_shards and not kwargs.get('clear'):
+                raise ValueError("{} is split into {} shards, not {}".format(
+                    self._db_name, stored, num_shards))
+            if num_shards is None:
+                raise ValueError("Either a split_func or num_shards is required")
+            split_func = JumpHashSplitter(num_shards)
+            if stored != num_shards and not kwargs.get('read_only'):
+                write_shard_count(self._db_name, num_shards)
+                # Cleared with fewer shards, so the rest are deleted once opening
+                self._stale_shards = list(range(num_shards, stored or 0))
+            split_keys = split_func.split_keys
         self.split_keys = split_keys
         self.split_func = split_func
 
-        self._db_name = db_name
+    def _init_shard_options(self, shard_workers, adaptive_cache, rebalance_every, kwargs):
+        # Set before anything which can fail, so close works from __del__
+        self._lazy = False
         self._keyed_db = {}
-        self._base_db_class = base_db_class
-        self._keyed_classes = keyed_classes if keyed_classes else {}
+        self.max_open = None
+        self._stale_shards = []
+        self.shard_workers = shard_workers
+        self.shard_timings = {}
+        self._shard_pool = None
+        self.adaptive_cache = adaptive_cache
+        self.rebalance_every = rebalance_every
+        # Totals across all databases, set by check_update_cache_set
+        self.cache_size = None
+        self.cache_bytes = None
+        self._ops_since_rebalance = 0
+        self._last_misses = {}
+        if adaptive_cache:
+            # Rebalancing works from each database's miss counts
+            kwargs['collect_stats'] = True
+
+    def _open_databases(self, lazy_open, max_open, kwargs):
+        self.max_open = max_open
+        self._lazy = lazy_open or max_open is not None
         # Force caches to be split evenly among all databases
-        self.check_update_cache_set(len(self.split_keys), kwargs)
-        for skey in self.split_keys:
-            if self._keyed_classes and skey in self._keyed_classes:
-                db_class = self._keyed_classes[skey]
-            else:
-                db_class = self._base_db_class
-            self._keyed_db[skey] = db_class(self._db_name+'_'+str(skey), **kwargs)
+        self.check_update_cache_set(self._cache_shares(), kwargs)
+        # Kept for databases opened later, which are cleared on request
+        self._db_kwargs = dict(kwargs)
+        clear = self._db_kwargs.pop('clear', False)
+        if self._lazy:
+            self._keyed_db = ShardPool(self.split_keys, self._open_db, max_open, clear)
+        else:
+            self._keyed_db = {}
+            for skey in self.split_keys:
+                self._keyed_db[skey] = self._open_db(skey, clear)
+        for skey in self._stale_shards:
+            self._open_db(skey).close(delete_file=True)
+        self._stale_shards = []
+
+    def _db_spec(self, skey):
+        if self._keyed_classes and skey in self._keyed_classes:
+            db_class = self._keyed_classes[skey]
+        else:
+            db_class = self._base_db_class
+        return db_class, self._db_name+'_'+str(skey)
+
+    def _open_db(self, skey, clear=False):
+        db_class, db_name = self._db_spec(skey)
+        kwargs = dict(self._db_kwargs)
+        if clear:
+            kwargs['clear'] = True
+        return db_class(db_name, **kwargs)
+
+    def _cache_shares(self):
+        if self.max_open:
+            return min(len(self.split_keys), self.max_open)
+        return len(self.split_keys)
+
+    def _open_db_items(self):
+        if self._lazy:
+            return self._keyed_db.open_items()
+        return list(self._keyed_db.items())
 
     def check_update_cache_set(self, numKeys, kwargs):
         if "cache_size" in kwargs:
+            self.cache_size = kwargs["cache_size"]
             kwargs["cache_size"] /= numKeys
+        if kwargs.get("cache_bytes") is not None:
+            self.cache_bytes = kwargs["cache_bytes"]
+            kwargs["cache_bytes"] /= numKeys
+
+    def _cached_dbs(self):
+        return dict((skey, db) for skey, db in self._open_db_items()
+                    if hasattr(db, 'set_cache_size'))
+
+    def set_cache_size(self, cache_size=None, cache_bytes=None):
+        '''
+        Changes the total cache budget, split evenly among all databases
+        and applied in place.
+        '''
+        dbs = self._cached_dbs()
+        shares = self._cache_shares() if self._lazy else max(len(dbs), 1)
+        if cache_size is not None:
+            self.cache_size = cache_size
+            cache_size //= shares
+        if cache_bytes is not None:
+            self.cache_bytes = cache_bytes
+            cache_bytes //= shares
+        # Databases opened later use the new sizes too
+        for name, size in (('cache_size', cache_size), ('cache_bytes', cache_bytes)):
+            if size is not None:
+                self._db_kwargs[name] = size
+        for db in dbs.values():
+            db.set_cache_size(cache_size=cache_size, cache_bytes=cache_bytes)
+
+    def rebalance_cache(self):
+        '''
+        Moves cache budget between the databases based on their misses
+        since the last rebalance and how full their caches are (see
+        allocate_budgets), resizing them in place.
+        '''
+        self._ops_since_rebalance = 0
+        dbs = self._cached_dbs()
+        if not dbs or self.cache_size is None:
+            return
+        misses = {}
+        occupancy = {}
+        byte_occupancy = {}
+        for skey, db in dbs.items():
+            stats = db.stats()
+            total_misses = stats.get('misses', 0)
+            last_misses = self._last_misses.get(skey, 0)
+            # Counters start over when a database is reopened
+            misses[skey] = total_misses - last_misses if total_misses >= last_misses else total_misses
+            self._last_misses[skey] = total_misses
+            occupancy[skey] = (float(stats['cached_entries']) / db.cache_size
+                               if db.cache_size else 1.0)
+            if db.cache_bytes:
+                byte_occupancy[skey] = float(stats.get('cached_bytes', 0)) / db.cache_bytes
+        sizes = allocate_budgets(int(self.cache_size),
+                                 dict((skey, int(db.cache_size)) for skey, db in dbs.items()),
+                                 misses, occupancy)
+        byte_sizes = {}
+        if self.cache_bytes is not None:
+            byte_sizes = allocate_budgets(int(self.cache_bytes),
+                                          dict((skey, int(db.cache_bytes or 0))
+                                               for skey, db in dbs.items()),
+                                          misses, byte_occupancy)
+        for skey, db in dbs.items():
+            db.set_cache_size(cache_size=sizes[skey], cache_bytes=byte_sizes.get(skey))
+
+    def _count_ops(self, count=1):
+        if self.adaptive_cache:
+            self._ops_since_rebalance += count
+            if self._ops_since_rebalance >= self.rebalance_every:
+                self.rebalance_cache()
+
+    def _run_on_shards(self, operation, func, open_only=False):
+        '''
+        Calls func on every database, or only those already open with
+        open_only, returning the results by split key (see _map_shards).
+        '''
+        if open_only or not self._lazy:
+            dbs = self._open_db_items()
+            get_db = dict(dbs).__getitem__
+            skeys = [skey for skey, _ in dbs]
+        else:
+            # Lazily opened databases are only opened when reached
+            get_db = self._keyed_db.__getitem__
+            skeys = list(self.split_keys)
+        return self._map_shards(operation, lambda skey: func(get_db(skey)), skeys)
+
+    def _map_shards(self, operation, func, skeys):
+        '''
+        Calls func on each split key of skeys, on the shard pool if there
+        is one, returning the results by split key. Timings go in
+        shard_timings under operation and failures are raised together
+        as a ShardError.
+        '''
+        def timed(skey):
+            start = time.time()
+            try:
+                return skey, func(skey), None, time.time() - start
+            except Exception as e:
+                return skey, None, e, time.time() - start
+
+        # Bounded pools would close databases still in use by other threads
+        if self.shard_workers and len(skeys) > 1 and not self.max_open:
+            if self._shard_pool is None:
+                self._shard_pool = ThreadPool(self.shard_workers)
+            outcomes = self._shard_pool.map(timed, skeys)
+        else:
+            outcomes = [timed(skey) for skey in skeys]
+        self.shard_timings[operation] = dict((skey, seconds) for skey, _, _, seconds in outcomes)
+        errors = dict((skey, error) for skey, _, error, _ in outcomes if error is not None)
+        if errors:
+            raise ShardError(operation, errors)
+        return dict((skey, result) for skey, result, _, _ in outcomes)
+
+    def _stop_shard_pool(self):
+        if self._shard_pool is not None:
+            self._shard_pool.close()
+            self._shard_pool.join()
+            self._shard_pool = None
+
+    def _update_db_kwargs(self, kwargs):
+        # Databases which aren't open pick changes up when next opened
+        self._db_kwargs.update((name, val) for name, val in kwargs.items()
+                               if name != 'clear')
 
     def reopen(self, **kwargs):
         # Force caches to be split evenly among all databases
-        self.check_update_cache_set(len(self.split_keys), kwargs)
-        for db in self._keyed_db.values():
-            if hasattr(db, 'reopen'):
-                db.reopen(**kwargs)
+        self.check_update_cache_set(self._cache_shares(), kwargs)
+        self._update_db_kwargs(kwargs)
+        if self._lazy and kwargs.get('clear'):
+            self._keyed_db.pending_clear.update(self.split_keys)
+        self._run_on_shards('reopen', lambda db: db.reopen(**kwargs)
+                            if hasattr(db, 'reopen') else None, open_only=True)
 
     def clear(self, **kwargs):
         # Force caches to be split evenly among all databases
-        self.check_update_cache_set(len(self.split_keys), kwargs)
-        for db in self._keyed_db.values():
-            if hasattr(db, 'clear'):
-                db.clear(**kwargs)
+        self.check_update_cache_set(self._cache_shares(), kwargs)
+        self._update_db_kwargs(kwargs)
+        if self._lazy:
+            self._keyed_db.pending_clear.update(self.split_keys)
+        self._run_on_shards('clear', lambda db: db.clear(**kwargs)
+                            if hasattr(db, 'clear') else None, open_only=True)
+        if self._lazy:
+            self._keyed_db.pending_clear.difference_update(
+                skey for skey, _ in self._keyed_db.open_items())
+
+    def compact(self):
+        self._run_on_shards('compact', lambda db: db.compact()
+                            if hasattr(db, 'compact') else None)
+
+    def freeze(self, db_ext=None, codec=None):
+        '''
+        Freezes each database which supports it next to its own file,
+        returning the frozen paths.
+        '''
+        paths = []
+        for skey in self.split_keys:
+            db = self._keyed_db[skey]
+            if hasattr(db, 'freeze'):
+                paths.append(db.freeze(db_ext=db_ext, codec=codec))
+        return paths
+
+    def _moved_values(self, db, keys):
+        return db.get_many(keys)
+
+    def reshard(self, num_shards, batch_size=DEFAULT_BULK_BATCH_SIZE):
+        '''
+        Changes the number of databases of a split database made with
+        num_shards, returning how many keys moved. Jump hashing only moves
+        the keys of shards which are added or removed: each database
+        losing keys streams them in batches straight into their new
+        databases, on the shard pool if there is one, and removed
+        databases are deleted. The new count is stored next to the
+        databases, so they're reopened with it by default.
+        '''
+        if not isinstance(self.split_func, JumpHashSplitter):
+            raise ValueError("Only split databases made with num_shards can be resharded")
+        if self._db_kwargs.get('read_only'):
+            raise AttributeError("Attempted to reshard in read_only mode")
+        splitter = JumpHashSplitter(num_shards)
+        old_keys = list(self.split_keys)
+        added = [skey for skey in splitter.split_keys if skey not in old_keys]
+        removed = [skey for skey in old_keys if skey not in splitter.split_keys]
+        if not added and not removed:
+            return 0
+        # Moved keys go straight to the databases, so nothing cached can go stale
+        self.sync_cache()
+        self.drop_cache()
+        for skey in added:
+            if self._lazy:
+                self._keyed_db.add(skey, clear=True)
+            else:
+                self._keyed_db[skey] = self._open_db(skey, clear=True)
+        dest_locks = dict((skey, threading.Lock()) for skey in splitter.split_keys)
+
+        def move_keys(skey):
+            moves = [(key, dest) for key, dest in
+                     ((key, splitter(key)) for key in self._keyed_db[skey]) if dest != skey]
+            for start in range(0, len(moves), batch_size):
+                batch = moves[start:start + batch_size]
+                keys = [key for key, _ in batch]
+                groups = {}
+                for (key, dest), val in zip(batch, self._moved_values(self._keyed_db[skey], keys)):
+                    groups.setdefault(dest, []).append((key, val))
+                for dest, items in groups.items():
+                    with dest_locks[dest]:
+                        self._keyed_db[dest]._bulk_write(items)
+            return [key for key, _ in moves]
+
+        # Growing only moves keys out of old databases, shrinking only out of removed ones
+        moves = self._map_shards('reshard', move_keys, removed or old_keys)
+        self.sync_cache()
+        # Moved keys are only deleted from their old databases once every one is
+        # stored at its destination and the new count is, so a failure in between
+        # leaves them readable under whichever count is on disk
+        write_shard_count(self._db_name, num_shards)
+        self.split_keys = splitter.split_keys
+        self.split_func = splitter
+        kept = [skey for skey in moves if skey not in removed and moves[skey]]
+
+        def delete_moved(skey):
+            keys = moves[skey]
+            for start in range(0, len(keys), batch_size):
+                self._keyed_db[skey].delete_many(keys[start:start + batch_size])
+
+        self._map_shards('reshard_delete', delete_moved, kept)
+        self.sync_cache()
+        for skey in removed:
+            self._keyed_db[skey].close(delete_file=True)
+            if self._lazy:
+                self._keyed_db.remove(skey)
+            else:
+                del self._keyed_db[skey]
+            self._last_misses.pop(skey, None)
+        if self.cache_size is not None or self.cache_bytes is not None:
+            self.set_cache_size(self.cache_size, self.cache_bytes)
+        return sum(len(keys) for keys in moves.values())
 
     def close(self, **kwargs):
-        for db in self._keyed_db.values():
-            if hasattr(db, 'close'):
-                db.close(**kwargs)
+        try:
+            self._run_on_shards('close', lambda db: db.close(**kwargs)
+                                if hasattr(db, 'close') else None, open_only=True)
+        finally:
+            if self._lazy:
+                self._keyed_db.release(**kwargs)
+            self._stop_shard_pool()
+            if kwargs.get('delete_file'):
+                remove_shard_count(self._db_name)
 
     def __enter__(self):
         return self
@@ -475,13 +1592,27 @@ class SplitDbDict(collections.MutableMapping):
 
     def get_cache(self):
         cahces = {}
-        for shortkey, db in self._keyed_db.items():
+        for shortkey, db in self._open_db_items():
             cahces[shortkey] = db.get_cache()
         return cahces
 
+    def stats(self):
+        '''
+        Gets the stats of every database summed together, with each
+        database's own stats under 'shards'.
+        '''
+        shards = {}
+        for shortkey, db in self._open_db_items():
+            if hasattr(db, 'stats'):
+                shards[shortkey] = db.stats()
+        stats = aggregate_stats(shards.values())
+        stats['shards'] = shards
+        return stats
+
     def __getitem__(self, key):
         if key != None and self.stringify_keys:
             key = str(key)
+        self._count_ops()
         db = self._keyed_db[self.split_func(key)]
         return db.__getitem__(key)
 
@@ -513,49 +1644,235 @@ class SplitDbDict(collections.MutableMapping):
                     self.cur_iter = None
                     return next(self)
 
+        if self._lazy:
+            # Each database is read in turn so it can be closed after
+            return itertools.chain.from_iterable(
+                list(self._keyed_db[skey]) for skey in self.split_keys)
         return MultiIter(self._keyed_db.values())
 
     def __len__(self):
-        totlen = 0
-        for db in self._keyed_db.values():
-            totlen += db.__len__()
-        return totlen
+        return sum(self._run_on_shards('len', len).values())
 
     def __contains__(self, key):
         if key != None and self.stringify_keys:
             key = str(key)
+        self._count_ops()
         db = self._keyed_db[self.split_func(key)]
         return db.__contains__(key)
 
     def __setitem__(self, key, val):
         if key != None and self.stringify_keys:
             key = str(key)
+        self._count_ops()
         db = self._keyed_db[self.split_func(key)]
         db.__setitem__(key, val)
 
     def __delitem__(self, key):
         if key != None and self.stringify_keys:
             key = str(key)
+        self._count_ops()
         db = self._keyed_db[self.split_func(key)]
         db.__delitem__(key)
 
+    def _group_by_split(self, keys):
+        '''
+        Groups the (stringified) keys by the split key of their database.
+        '''
+        groups = {}
+        for key in keys:
+            if key != None and self.stringify_keys:
+                key = str(key)
+            groups.setdefault(self.split_func(key), []).append(key)
+        return groups
+
+    def prefetch(self, keys):
+        for skey, skeys in self._group_by_split(keys).items():
+            self._keyed_db[skey].prefetch(skeys)
+
+    def get_many(self, keys, default=None):
+        '''
+        Gets the values for all keys as a list in the same order, with
+        one get_many call per database.
+        '''
+        if self.stringify_keys:
+            keys = [str(key) if key != None else key for key in keys]
+        else:
+            keys = list(keys)
+        self._count_ops(len(keys))
+        found = {}
+        for skey, skeys in self._group_by_split(keys).items():
+            svals = self._keyed_db[skey].get_many(skeys, default=default)
+            found.update(zip(skeys, svals))
+        return [found[key] for key in keys]
+
+    def set_many(self, items):
+        '''
+        Sets every (key, value) pair of items, with one set_many call
+        per database.
+        '''
+        if isinstance(items, collections.Mapping):
+            items = items.items()
+        groups = {}
+        for key, val in items:
+            if key != None and self.stringify_keys:
+                key = str(key)
+            groups.setdefault(self.split_func(key), []).append((key, val))
+        for skey, sitems in groups.items():
+            self._keyed_db[skey].set_many(sitems)
+            self._count_ops(len(sitems))
+
+    def update_many(self, other=(), **kwargs):
+        self.set_many(other)
+        if kwargs:
+            self.set_many(kwargs)
+
+    def delete_many(self, keys):
+        for skey, skeys in self._group_by_split(keys).items():
+            self._keyed_db[skey].delete_many(skeys)
+            self._count_ops(len(skeys))
+
+    def bulk_load(self, items, clear=True, batch_size=DEFAULT_BULK_BATCH_SIZE):
+        '''
+        Loads (key, value) pairs straight into each database (see
+        UnorderedCachedDict.bulk_load), routing them with split_func and
+        writing each database's batch as it fills.
+        '''
+        start = time.time()
+        if isinstance(items, collections.Mapping):
+            items = items.items()
+        if self._lazy:
+            if self._db_kwargs.get('read_only'):
+                raise AttributeError("Attempted to set in read_only mode")
+            # Databases which aren't open are cleared once they're reached
+            if clear:
+                self._keyed_db.pending_clear.update(self.split_keys)
+            for skey, db in self._keyed_db.open_items():
+                db._prepare_bulk_load(clear)
+                self._keyed_db.pending_clear.discard(skey)
+        else:
+            for db in self._keyed_db.values():
+                db._prepare_bulk_load(clear)
+        batches = dict((skey, []) for skey in self._keyed_db)
+        count = 0
+        for key, val in items:
+            if key != None and self.stringify_keys:
+                key = str(key)
+            skey = self.split_func(key)
+            batch = batches[skey]
+            batch.append((key, val))
+            if len(batch) >= batch_size:
+                self._keyed_db[skey]._bulk_write(batch)
+                batches[skey] = []
+            count += 1
+        for skey, batch in batches.items():
+            if batch:
+                self._keyed_db[skey]._bulk_write(batch)
+        self._run_on_shards('bulk_load', lambda db: db._finish_bulk_load(), open_only=True)
+        return bulk_load_report(count, time.time() - start)
+
+    def parallel_ingest(self, items, workers=None, clear=True, batch_size=DEFAULT_BULK_BATCH_SIZE):
+        '''
+        Loads (key, value) pairs like bulk_load, but with the database
+        writes spread over workers processes (by default one per cpu).
+        Each worker owns some of the databases outright and opens them
+        itself, while this process routes batches to them with
+        split_func, so the databases are closed for the duration and
+        need to be stored in files. Failed databases are raised together
+        as a ShardError once every worker has finished.
+        '''
+        start = time.time()
+        if self._db_kwargs.get('read_only'):
+            raise AttributeError("Attempted to set in read_only mode")
+        if isinstance(items, collections.Mapping):
+            items = items.items()
+        skeys = list(self.split_keys)
+        workers = max(min(workers or multiprocessing.cpu_count(), len(skeys)), 1)
+        pending_clear = self._keyed_db.pending_clear if self._lazy else set()
+        owners = dict((skey, i % workers) for i, skey in enumerate(skeys))
+        shards = [{} for _ in range(workers)]
+        for skey in skeys:
+            db_class, db_name = self._db_spec(skey)
+            shards[owners[skey]][skey] = (db_class, db_name, clear or skey in pending_clear)
+        # Workers open the database files themselves
+        self._run_on_shards('close', lambda db: db.close(), open_only=True)
+
+        results = multiprocessing.Queue()
+        queues = [multiprocessing.Queue(INGEST_QUEUE_SIZE) for _ in range(workers)]
+        processes = [multiprocessing.Process(target=_ingest_worker,
+                                             args=(shards[i], self._db_kwargs, queues[i], results))
+                     for i in range(workers)]
+        errors = {}
+        counts = {}
+        try:
+            for process in processes:
+                process.start()
+            failed = set()
+            def send(owner, item):
+                # The rest of a failed worker's data is dropped, its error raised below
+                if owner not in failed and not _put_checked(queues[owner], item,
+                                                            processes[owner]):
+                    failed.add(owner)
+
+            batches = dict((skey, []) for skey in skeys)
+            for key, val in items:
+                if key != None and self.stringify_keys:
+                    key = str(key)
+                skey = self.split_func(key)
+                batch = batches[skey]
+                batch.append((key, val))
+                if len(batch) >= batch_size:
+                    send(owners[skey], (skey, batch))
+                    batches[skey] = []
+            for skey, batch in batches.items():
+                if batch:
+                    send(owners[skey], (skey, batch))
+            for owner in range(workers):
+                send(owner, None)
+            for _ in processes:
+                result = _get_checked(results, processes)
+                if result is None:
+                    break
+                worker_counts, error = result
+                counts.update(worker_counts)
+                if error is not None:
+                    errors[error[0]] = Exception(error[1])
+        finally:
+            for queue in queues:
+                queue.cancel_join_thread()
+            for process in processes:
+                process.join(INGEST_POLL_SECONDS)
+                if process.is_alive():
+                    process.terminate()
+            if self._lazy:
+                if not errors:
+                    self._keyed_db.pending_clear = set()
+                self._keyed_db.release()
+            else:
+                for skey in skeys:
+                    self._keyed_db[skey] = self._open_db(skey)
+        for i, process in enumerate(processes):
+            if process.exitcode and not any(owners[skey] == i for skey in errors):
+                for skey in shards[i]:
+                    errors[skey] = Exception("Worker exited with code {}".format(process.exitcode))
+        if errors:
+            raise ShardError('parallel_ingest', errors)
+        return bulk_load_report(sum(counts.values()), time.time() - start)
+
     def _sync_writes(self):
-        for db in self._keyed_db.values():
-            db._sync_writes()
+        self._run_on_shards('sync_writes', lambda db: db._sync_writes(), open_only=True)
 
-    def sync_cache(self):
-        for db in self._keyed_db.values():
-            db.sync_cache()
+    def sync_cache(self, **kwargs):
+        self._run_on_shards('sync_cache', lambda db: db.sync_cache(**kwargs), open_only=True)
 
     def drop_cache(self):
-        for db in self._keyed_db.values():
+        for _, db in self._open_db_items():
             db.drop_cache()
 
     def __del__(self):
         # Close if we're being collected
         self.close()
 
-class SplitDbSet(collections.MutableSet, SplitDbDict):
+class SplitDbSet(collections.MutableSet, SplitDbDict, StreamingSetOps):
     '''
     Defines a way to split data among any number of arbitrary databases.
     All arguments in kwargs are applied to each database constructor.
@@ -567,28 +1884,24 @@ class SplitDbSet(collections.MutableSet, SplitDbDict):
     If the split_func gives an invalid key name, a KeyError will be raised,
     so make sure updates to split_keys also updates split_func.
 
-    If a cache_size if passed through kwargs, it is evenly divided among all
-    databases.
+    If a cache_size or cache_bytes is passed through kwargs, it is evenly
+    divided among all databases.
     '''
-    def __init__(self, db_name, base_db_class, split_keys, split_func,
-                 keyed_classes=None, stringify_keys=False, **kwargs):
+    def __init__(self, db_name, base_db_class, split_keys=None, split_func=None,
+                 keyed_classes=None, stringify_keys=False, shard_workers=0,
+                 adaptive_cache=False, rebalance_every=10*1024, lazy_open=False,
+                 max_open=None, num_shards=None, **kwargs):
         self.stringify_keys = stringify_keys
-        self.split_keys = split_keys
-        self.split_func = split_func
-
         self._db_name = db_name
-        self._keyed_db = {}
+        self._init_shard_options(shard_workers, adaptive_cache, rebalance_every, kwargs)
+        self._init_split(split_keys, split_func, num_shards, kwargs)
+
         self._base_db_class = base_db_class
         self._keyed_classes = keyed_classes if keyed_classes else {}
-        # Force caches to be split evenly among all databases
-        if "cache_size" in kwargs:
-            kwargs["cache_size"] /= len(self.split_keys)
-        for skey in self.split_keys:
-            if self._keyed_classes and skey in self._keyed_classes:
-                db_class = self._keyed_classes[skey]
-            else:
-                db_class = self._base_db_class
-            self._keyed_db[skey] = db_class(self._db_name+'_'+str(skey), **kwargs)
+        self._open_databases(lazy_open, max_open, kwargs)
+
+    def _moved_values(self, db, keys):
+        return [True] * len(keys)
 
     def _dict_set(self, key, val):
         '''
@@ -598,12 +1911,14 @@ class SplitDbSet(collections.MutableSet, SplitDbDict):
         '''
         if key != None and self.stringify_keys:
             key = str(key)
+        self._count_ops()
         db = self._keyed_db[self.split_func(key)]
         db._dict_set(key, val)
 
     def _dict_get(self, key):
         if key != None and self.stringify_keys:
             key = str(key)
+        self._count_ops()
         db = self._keyed_db[self.split_func(key)]
         return db._dict_get(key)
 
@@ -627,5 +1942,23 @@ class SplitDbSet(collections.MutableSet, SplitDbDict):
         '''
         preprocess = kwargs.get('preprocess')
         for s in args:
-            for e in s:
-                self._dict_set(preprocess(e) if preprocess else e, True)
+            elems = (preprocess(e) for e in s) if preprocess else s
+            for skey, selems in self._group_by_split(elems).items():
+                self._keyed_db[skey].update(selems)
+
+    def bulk_load(self, elems, clear=True, batch_size=DEFAULT_BULK_BATCH_SIZE):
+        '''
+        Loads elements straight into each database (see
+        SplitDbDict.bulk_load).
+        '''
+        return SplitDbDict.bulk_load(self, ((e, True) for e in elems), clear=clear,
+                                     batch_size=batch_size)
+
+    def parallel_ingest(self, elems, workers=None, clear=True,
+                        batch_size=DEFAULT_BULK_BATCH_SIZE):
+        '''
+        Loads elements with several worker processes (see
+        SplitDbDict.parallel_ingest).
+        '''
+        return SplitDbDict.parallel_ingest(self, ((e, True) for e in elems), workers=workers,
+                                           clear=clear, batch_size=batch_size)
@@ -0,0 +1,469 @@
+import binascii
+import bisect
+import collections
+import itertools
+import mmap
+import operator
+import os
+import struct
+import sys
+from array import array
+from past.builtins import basestring
+
+# Containers switch between a sorted array and a bitmap at this size
+ARRAY_MAX = 4096
+BITMAP_BYTES = 8192
+ARRAY_KIND = 0
+BITMAP_KIND = 1
+
+BITMAP_MAGIC = b'DWROAR01'
+# Header: magic and container count
+BITMAP_HEADER = struct.Struct('<8sQ')
+# Container entry: high bits, kind, cardinality and data offset
+CONTAINER_ENTRY = struct.Struct('<QIIQ')
+# Values grouped by container at a time by update
+UPDATE_CHUNK_SIZE = 64*1024
+
+if hasattr(int, 'from_bytes'):
+    def bytes_to_int(data):
+        return int.from_bytes(bytes(data), 'little')
+
+    def int_to_bytes(bits):
+        return bits.to_bytes(BITMAP_BYTES, 'little')
+else:
+    def bytes_to_int(data):
+        return int(binascii.hexlify(bytes(bytearray(reversed(bytearray(data))))) or b'0', 16)
+
+    def int_to_bytes(bits):
+        data = binascii.unhexlify(('%x' % bits).zfill(BITMAP_BYTES * 2))
+        return bytes(bytearray(reversed(bytearray(data))))
+
+def array_bytes(values):
+    values = array('H', values)
+    if sys.byteorder != 'little':
+        values.byteswap()
+    return values.tobytes() if hasattr(values, 'tobytes') else values.tostring()
+
+def member_int(elem):
+    '''
+    Maps a member to its integer: integers as they are, strings by
+    parsing them and other numbers only when they're integral.
+    '''
+    try:
+        return operator.index(elem)
+    except TypeError:
+        pass
+    value = int(elem)
+    if not isinstance(elem, basestring) and value != elem:
+        raise ValueError("Bitmaps only hold integers: {!r}".format(elem))
+    return value
+
+class ArrayContainer(object):
+    '''
+    Sorted array of the low 16 bits of up to ARRAY_MAX members. The
+    values may be a read only view of a mapped file until first changed.
+    '''
+    __slots__ = ('values',)
+    kind = ARRAY_KIND
+
+    def __init__(self, values=None):
+        self.values = values if values is not None else array('H')
+
+    def __len__(self):
+        return len(self.values)
+
+    def __contains__(self, low):
+        values = self.values
+        index = bisect.bisect_left(values, low)
+        return index < len(values) and values[index] == low
+
+    def __iter__(self):
+        return iter(self.values)
+
+    def _writable(self):
+        if not isinstance(self.values, array):
+            self.values = array('H', self.values)
+        return self.values
+
+    def add(self, low):
+        '''
+        Adds low, returning the container now holding the members
+        (which is a new bitmap once the array would overflow).
+        '''
+        values = self.values
+        index = bisect.bisect_left(values, low)
+        if index < len(values) and values[index] == low:
+            return self
+        if len(values) >= ARRAY_MAX:
+            return BitmapContainer.from_lows(values).add(low)
+        self._writable().insert(index, low)
+        return self
+
+    def add_many(self, lows):
+        return container_from_sorted(sorted(set(self.values).union(lows)))
+
+    def discard(self, low):
+        values = self.values
+        index = bisect.bisect_left(values, low)
+        if index < len(values) and values[index] == low:
+            del self._writable()[index]
+        return self
+
+    def to_int(self):
+        return BitmapContainer.from_lows(self.values).to_int()
+
+    def to_bytes(self):
+        return array_bytes(self.values)
+
+    def copy(self):
+        return ArrayContainer(array('H', self.values))
+
+class BitmapContainer(object):
+    '''
+    Bitmap of the low 16 bits of more than ARRAY_MAX members. The bits
+    may be a read only view of a mapped file until first changed.
+    '''
+    __slots__ = ('bits', 'count')
+    kind = BITMAP_KIND
+
+    def __init__(self, bits=None, count=0):
+        self.bits = bits if bits is not None else bytearray(BITMAP_BYTES)
+        self.count = count
+
+    @classmethod
+    def from_lows(cls, lows):
+        return cls().add_many(lows)
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, low):
+        return bool(self.bits[low >> 3] >> (low & 7) & 1)
+
+    def __iter__(self):
+        for index, byte in enumerate(bytearray(self.bits)):
+            if byte:
+                base = index << 3
+                for bit in range(8):
+                    if byte >> bit & 1:
+                        yield base | bit
+
+    def _writable(self):
+        if not isinstance(self.bits, bytearray):
+            self.bits = bytearray(self.bits)
+        return self.bits
+
+    def add(self, low):
+        index, mask = low >> 3, 1 << (low & 7)
+        if not self.bits[index] & mask:
+            self._writable()[index] |= mask
+            self.count += 1
+        return self
+
+    def add_many(self, lows):
+        bits = self._writable()
+        for low in lows:
+            bits[low >> 3] |= 1 << (low & 7)
+        self.count = bin(bytes_to_int(bits)).count('1')
+        return self
+
+    def discard(self, low):
+        index, mask = low >> 3, 1 << (low & 7)
+        if self.bits[index] & mask:
+            self._writable()[index] &= ~mask & 0xFF
+            self.count -= 1
+            if self.count <= ARRAY_MAX:
+                return ArrayContainer(array('H', self))
+        return self
+
+    def to_int(self):
+        return bytes_to_int(self.bits)
+
+    def to_bytes(self):
+        return bytes(self.bits)
+
+    def copy(self):
+        return BitmapContainer(bytearray(self.bits), self.count)
+
+def container_from_sorted(lows):
+    if len(lows) > ARRAY_MAX:
+        return BitmapContainer.from_lows(lows)
+    return ArrayContainer(array('H', lows))
+
+def container_from_int(bits):
+    count = bin(bits).count('1')
+    container = BitmapContainer(bytearray(int_to_bytes(bits)), count)
+    return container if count > ARRAY_MAX else ArrayContainer(array('H', container))
+
+def difference_op(first, second):
+    # Works for sets and for ints used as bitmaps, unlike operator.sub
+    return first ^ (first & second)
+
+def combine_containers(first, second, op):
+    '''
+    Applies a set operator to two containers, either of which may be
+    None for an empty one. Arrays are combined as sets and anything with
+    a bitmap as whole integers, so the work stays in C.
+    '''
+    first = first if first is not None else ArrayContainer()
+    second = second if second is not None else ArrayContainer()
+    if first.kind == ARRAY_KIND and second.kind == ARRAY_KIND:
+        return container_from_sorted(sorted(op(set(first), set(second))))
+    return container_from_int(op(first.to_int(), second.to_int()))
+
+class RoaringBitmap(collections.MutableSet):
+    '''
+    A compressed set of non-negative integers in the style of roaring
+    bitmaps. Members are grouped by their high bits into containers of
+    at most 65536 values, each held as a sorted array of 16 bit values
+    while sparse or as an 8KB bitmap once dense, so dense id ranges cost
+    about a bit per member and sparse ones two bytes.
+
+    Set algebra works container by container. Bitmaps can be saved to a
+    file and loaded back through mmap, in which case containers read the
+    mapped file directly and are only copied into memory when changed.
+    '''
+    def __init__(self, values=()):
+        self._containers = {}
+        self._mmap = None
+        self._view = None
+        self.update(values)
+
+    @classmethod
+    def _from_iterable(cls, values):
+        return cls(values)
+
+    @staticmethod
+    def _split(value):
+        value = operator.index(value)
+        if value < 0:
+            raise ValueError("Bitmaps only hold non-negative integers: {}".format(value))
+        return value >> 16, value & 0xFFFF
+
+    def __contains__(self, value):
+        try:
+            high, low = self._split(value)
+        except (TypeError, ValueError):
+            return False
+        container = self._containers.get(high)
+        return container is not None and low in container
+
+    def __len__(self):
+        return sum(len(container) for container in self._containers.values())
+
+    def __iter__(self):
+        for high in sorted(self._containers):
+            base = high << 16
+            for low in self._containers[high]:
+                yield base | low
+
+    def add(self, value):
+        high, low = self._split(value)
+        container = self._containers.get(high)
+        if container is None:
+            container = ArrayContainer()
+        self._containers[high] = container.add(low)
+
+    def discard(self, value):
+        try:
+            high, low = self._split(value)
+        except (TypeError, ValueError):
+            return
+        container = self._containers.get(high)
+        if container is not None:
+            container = container.discard(low)
+            if len(container):
+                self._containers[high] = container
+            else:
+                del self._containers[high]
+
+    def update(self, *iterables):
+        '''
+        Adds every value, grouping them by container first a chunk of
+        UPDATE_CHUNK_SIZE values at a time.
+        '''
+        index = operator.index
+        for values in iterables:
+            values = iter(values)
+            while True:
+                chunk = list(itertools.islice(values, UPDATE_CHUNK_SIZE))
+                if not chunk:
+                    break
+                groups = {}
+                for value in chunk:
+                    value = index(value)
+                    if value < 0:
+                        raise ValueError(
+                            "Bitmaps only hold non-negative integers: {}".format(value))
+                    groups.setdefault(value >> 16, []).append(value & 0xFFFF)
+                for high, lows in groups.items():
+                    container = self._containers.get(high)
+                    if container is None:
+                        container = ArrayContainer()
+                    self._containers[high] = container.add_many(lows)
+
+    def copy(self):
+        result = RoaringBitmap()
+        result._containers = dict((high, container.copy())
+                                  for high, container in self._containers.items())
+        return result
+
+    def _combine(self, other, op, keys):
+        if not isinstance(other, RoaringBitmap):
+            other = RoaringBitmap(other)
+        result = RoaringBitmap()
+        for high in keys(set(self._containers), set(other._containers)):
+            container = combine_containers(self._containers.get(high),
+                                           other._containers.get(high), op)
+            if len(container):
+                result._containers[high] = container
+        return result
+
+    def __and__(self, other):
+        return self._combine(other, operator.and_, operator.and_)
+
+    def __or__(self, other):
+        return self._combine(other, operator.or_, operator.or_)
+
+    def __sub__(self, other):
+        return self._combine(other, difference_op, lambda mine, theirs: mine)
+
+    def __xor__(self, other):
+        return self._combine(other, operator.xor, operator.or_)
+
+    __rand__ = __and__
+    __ror__ = __or__
+    __rxor__ = __xor__
+
+    def __rsub__(self, other):
+        return RoaringBitmap(other) - self
+
+    def _replace(self, result):
+        self._containers = result._containers
+        return self
+
+    def __iand__(self, other):
+        return self._replace(self & other)
+
+    def __ior__(self, other):
+        return self._replace(self | other)
+
+    def __isub__(self, other):
+        return self._replace(self - other)
+
+    def __ixor__(self, other):
+        return self._replace(self ^ other)
+
+    def union(self, *others):
+        result = self.copy()
+        for other in others:
+            result |= other
+        return result
+
+    def intersection(self, *others):
+        result = self.copy()
+        for other in others:
+            result &= other
+        return result
+
+    def difference(self, *others):
+        result = self.copy()
+        for other in others:
+            result -= other
+        return result
+
+    def save(self, path):
+        '''
+        Writes the bitmap to path, replacing it in one rename.
+        '''
+        highs = sorted(self._containers)
+        offset = BITMAP_HEADER.size + len(highs) * CONTAINER_ENTRY.size
+        entries = [BITMAP_HEADER.pack(BITMAP_MAGIC, len(highs))]
+        for high in highs:
+            container = self._containers[high]
+            entries.append(CONTAINER_ENTRY.pack(high, container.kind, len(container), offset))
+            offset += BITMAP_BYTES if container.kind == BITMAP_KIND else 2 * len(container)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as fhandle:
+            fhandle.write(b''.join(entries))
+            for high in highs:
+                fhandle.write(self._containers[high].to_bytes())
+        if os.name == 'nt':
+            # Mapped files can't be replaced on windows
+            self.close()
+            if os.path.exists(path):
+                os.remove(path)
+        os.rename(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        '''
+        Maps a file written by save. Raises ValueError if the file isn't
+        a valid bitmap.
+        '''
+        bitmap = cls()
+        with open(path, 'rb') as fhandle:
+            mapped = mmap.mmap(fhandle.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            magic, count = BITMAP_HEADER.unpack_from(mapped)
+            if magic != BITMAP_MAGIC:
+                raise ValueError("Invalid bitmap file: {}".format(path))
+            try:
+                view = memoryview(mapped)
+            except TypeError:
+                view = None
+            for position in range(count):
+                high, kind, cardinality, offset = CONTAINER_ENTRY.unpack_from(
+                    mapped, BITMAP_HEADER.size + position * CONTAINER_ENTRY.size)
+                size = BITMAP_BYTES if kind == BITMAP_KIND else 2 * cardinality
+                if offset + size > len(mapped):
+                    raise ValueError("Truncated bitmap file: {}".format(path))
+                bitmap._containers[high] = bitmap._mapped_container(
+                    mapped, view, kind, cardinality, offset, size)
+        except struct.error:
+            mapped.close()
+            raise ValueError("Invalid bitmap file: {}".format(path))
+        except ValueError:
+            bitmap._containers = {}
+            mapped.close()
+            raise
+        bitmap._mmap = mapped
+        bitmap._view = view
+        return bitmap
+
+    @staticmethod
+    def _mapped_container(mapped, view, kind, cardinality, offset, size):
+        if kind == BITMAP_KIND:
+            bits = view[offset:offset + size] if view is not None else bytearray(
+                mapped[offset:offset + size])
+            return BitmapContainer(bits, cardinality)
+        if view is not None and sys.byteorder == 'little':
+            return ArrayContainer(view[offset:offset + size].cast('H'))
+        values = array('H')
+        data = mapped[offset:offset + size]
+        if hasattr(values, 'frombytes'):
+            values.frombytes(data)
+        else:
+            values.fromstring(data)
+        if sys.byteorder != 'little':
+            values.byteswap()
+        return ArrayContainer(values)
+
+    def close(self):
+        '''
+        Copies any containers still reading a mapped file into memory and
+        unmaps the file.
+        '''
+        if self._mmap is None:
+            return
+        for high, container in self._containers.items():
+            self._containers[high] = container.copy()
+        if self._view is not None:
+            self._view.release()
+            self._view = None
+        try:
+            self._mmap.close()
+        except BufferError:
+            # A caller still holds a view, so leave it to be collected
+            pass
+        self._mmap = None
@@ -0,0 +1,109 @@
+import hashlib
+import math
+import os
+import struct
+
+def key_bytes(key):
+    '''
+    Gets a stable byte representation of a key for hashing.
+    '''
+    if isinstance(key, bytes):
+        return key
+    if not isinstance(key, type(u'')):
+        key = u'{}'.format(key)
+    return key.encode('utf-8')
+
+class BloomFilter(object):
+    '''
+    A Bloom filter answering whether a key might have been added. There
+    are no false negatives, and false positives happen at roughly
+    error_rate until more than capacity keys have been added. Keys can't
+    be removed, so deleted keys stay (harmless) false positives.
+
+    The filter is sized from capacity and error_rate, and can be saved to
+    and loaded from a file with a small header followed by the bit array.
+    '''
+    MAGIC = b'DWBLOOM1'
+    HEADER = struct.Struct('<8sQQQQ')
+
+    def __init__(self, capacity, error_rate=0.01, num_bits=None, num_hashes=None, bits=None):
+        self.capacity = max(int(capacity), 1)
+        self.error_rate = error_rate
+        if num_bits is None:
+            num_bits = int(math.ceil(-self.capacity * math.log(error_rate) / math.log(2) ** 2))
+        if num_hashes is None:
+            num_hashes = int(round(float(num_bits) / self.capacity * math.log(2)))
+        self.num_bits = max(num_bits, 8)
+        self.num_hashes = max(num_hashes, 1)
+        self.bits = bits if bits is not None else bytearray((self.num_bits + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key):
+        # Double hashing on the two halves of one digest
+        first, second = struct.unpack('<QQ', hashlib.md5(key_bytes(key)).digest())
+        return [(first + i * second) % self.num_bits for i in range(self.num_hashes)]
+
+    def add(self, key):
+        bits = self.bits
+        changed = False
+        for pos in self._positions(key):
+            mask = 1 << (pos & 7)
+            if not bits[pos >> 3] & mask:
+                bits[pos >> 3] |= mask
+                changed = True
+        # Keys already in the filter don't count towards its capacity again
+        if changed:
+            self.count += 1
+
+    def update(self, keys):
+        for key in keys:
+            self.add(key)
+
+    def __contains__(self, key):
+        bits = self.bits
+        for pos in self._positions(key):
+            if not bits[pos >> 3] & (1 << (pos & 7)):
+                return False
+        return True
+
+    def __len__(self):
+        '''
+        Number of keys added which set a new bit, so repeated keys count
+        once and the odd new key which was a false positive not at all.
+        '''
+        return self.count
+
+    @property
+    def saturated(self):
+        return self.count > self.capacity
+
+    def save(self, path):
+        '''
+        Writes the filter to path, replacing it in one rename.
+        '''
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as fhandle:
+            fhandle.write(self.HEADER.pack(self.MAGIC, self.capacity, self.num_bits,
+                                           self.num_hashes, self.count))
+            fhandle.write(self.bits)
+        if os.name == 'nt' and os.path.exists(path):
+            os.remove(path)
+        os.rename(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, error_rate=0.01):
+        '''
+        Reads a filter written by save. Raises ValueError if the file
+        isn't a valid filter.
+        '''
+        with open(path, 'rb') as fhandle:
+            header = fhandle.read(cls.HEADER.size)
+            bits = bytearray(fhandle.read())
+        if len(header) != cls.HEADER.size:
+            raise ValueError("Truncated bloom filter file: {}".format(path))
+        magic, capacity, num_bits, num_hashes, count = cls.HEADER.unpack(header)
+        if magic != cls.MAGIC or len(bits) != (num_bits + 7) // 8:
+            raise ValueError("Invalid bloom filter file: {}".format(path))
+        bloom = cls(capacity, error_rate, num_bits=num_bits, num_hashes=num_hashes, bits=bits)
+        bloom.count = count
+        return bloom
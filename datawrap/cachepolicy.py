@@ -0,0 +1,247 @@
+import collections
+import hashlib
+import numbers
+import sys
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+# Values whose sys.getsizeof already covers their payload
+FLAT_TYPES = (bytes, type(u''), numbers.Number, type(None))
+
+class CachePolicy(object):
+    '''
+    Tracks the keys held in a cache and chooses which of them to evict
+    when the cache overflows. Policies only track keys -- the owning
+    cache is responsible for the values and for writing back dirty
+    entries that get evicted.
+    '''
+    def __init__(self, capacity):
+        self.capacity = int(capacity)
+
+    def insert(self, key):
+        '''
+        Registers a key which was just added to the cache.
+        '''
+        raise NotImplementedError()
+
+    def access(self, key):
+        '''
+        Registers a hit on a key already present in the cache.
+        '''
+        raise NotImplementedError()
+
+    def remove(self, key):
+        '''
+        Stops tracking a key which was removed from the cache.
+        '''
+        raise NotImplementedError()
+
+    def victims(self, count):
+        '''
+        Chooses up to count keys to evict and stops tracking them.
+        '''
+        raise NotImplementedError()
+
+    def clear(self):
+        raise NotImplementedError()
+
+    def resize(self, capacity):
+        self.capacity = int(capacity)
+
+class LRUPolicy(CachePolicy):
+    '''
+    Classic least recently used eviction. Every hit reorders the
+    key, so this has the most bookkeeping of the policies.
+    '''
+    def __init__(self, capacity):
+        CachePolicy.__init__(self, capacity)
+        self._order = collections.OrderedDict()
+
+    def insert(self, key):
+        self._order[key] = None
+
+    def access(self, key):
+        # Pop and reinsert to move the key to the most recent end
+        self._order[key] = self._order.pop(key, None)
+
+    def remove(self, key):
+        self._order.pop(key, None)
+
+    def victims(self, count):
+        victims = []
+        while self._order and len(victims) < count:
+            victims.append(self._order.popitem(last=False)[0])
+        return victims
+
+    def clear(self):
+        self._order = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self._order)
+
+class ClockPolicy(CachePolicy):
+    '''
+    CLOCK (second chance) eviction. Hits only set a reference bit,
+    making them nearly as cheap as the block rejection cache, while
+    the hand sweeping for victims gives referenced keys another lap.
+    '''
+    def __init__(self, capacity):
+        CachePolicy.__init__(self, capacity)
+        self._ring = collections.OrderedDict()
+
+    def insert(self, key):
+        self._ring[key] = False
+
+    def access(self, key):
+        # Assignment to an existing key keeps its position on the ring
+        if key in self._ring:
+            self._ring[key] = True
+
+    def remove(self, key):
+        self._ring.pop(key, None)
+
+    def victims(self, count):
+        victims = []
+        # Two full sweeps is enough to clear every reference bit
+        sweeps = 2 * len(self._ring)
+        while self._ring and len(victims) < count and sweeps > 0:
+            key, referenced = self._ring.popitem(last=False)
+            if referenced:
+                self._ring[key] = False
+            else:
+                victims.append(key)
+            sweeps -= 1
+        return victims
+
+    def clear(self):
+        self._ring = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self._ring)
+
+class SegmentedLRUPolicy(CachePolicy):
+    '''
+    Segmented LRU eviction. New keys enter a probationary segment and
+    are only promoted to the protected segment on a second hit, so a
+    scan of one-off keys cannot flush the hot working set. Victims are
+    taken from the probationary segment first.
+    '''
+    def __init__(self, capacity, protected_ratio=0.8):
+        self.protected_ratio = protected_ratio
+        CachePolicy.__init__(self, capacity)
+        self._probation = collections.OrderedDict()
+        self._protected = collections.OrderedDict()
+
+    @property
+    def protected_capacity(self):
+        return int(self.capacity * self.protected_ratio)
+
+    def insert(self, key):
+        self._probation[key] = None
+
+    def access(self, key):
+        if key in self._protected:
+            self._protected[key] = self._protected.pop(key)
+        elif key in self._probation:
+            del self._probation[key]
+            self._protected[key] = None
+            # Demote the least recent protected key back to probation
+            if len(self._protected) > self.protected_capacity:
+                demoted = self._protected.popitem(last=False)[0]
+                self._probation[demoted] = None
+
+    def remove(self, key):
+        self._probation.pop(key, None)
+        self._protected.pop(key, None)
+
+    def victims(self, count):
+        victims = []
+        for segment in (self._probation, self._protected):
+            while segment and len(victims) < count:
+                victims.append(segment.popitem(last=False)[0])
+        return victims
+
+    def clear(self):
+        self._probation = collections.OrderedDict()
+        self._protected = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self._probation) + len(self._protected)
+
+EVICTION_POLICIES = {
+    'lru': LRUPolicy,
+    'clock': ClockPolicy,
+    'slru': SegmentedLRUPolicy
+}
+
+def get_eviction_policy(policy, capacity):
+    '''
+    Builds a cache policy from either a name in EVICTION_POLICIES or a
+    callable (such as a CachePolicy subclass) which takes a capacity.
+    A policy of None means the cache uses full block rejection.
+    '''
+    if policy is None:
+        return None
+    if callable(policy):
+        return policy(capacity)
+    try:
+        return EVICTION_POLICIES[policy.lower()](capacity)
+    except (KeyError, AttributeError):
+        raise ValueError("Unknown eviction policy: {}".format(policy))
+
+def allocate_budgets(total, budgets, misses, occupancy, min_share=0.25, damping=0.5):
+    '''
+    Splits a total cache budget between caches by name in proportion to
+    their misses, each weighted by how full that cache is (misses in a
+    cache with room to spare aren't for lack of space). Every cache
+    keeps at least min_share of an even split, and budgets only move
+    damping of the way to their target per call so noise doesn't make
+    them swing. The budgets returned never add up to more than total.
+    '''
+    if not budgets:
+        return {}
+    floor = int(total * min_share / len(budgets))
+    spare = total - floor * len(budgets)
+    weights = dict((name, misses.get(name, 0) * min(1.0, occupancy.get(name, 0.0)) + 1.0)
+                   for name in budgets)
+    total_weight = sum(weights.values())
+    allocated = {}
+    for name, budget in budgets.items():
+        target = floor + spare * weights[name] / total_weight
+        allocated[name] = max(floor, int(budget + (target - budget) * damping))
+    # Budgets set from outside may have started above the total
+    excess = sum(allocated.values()) - total
+    while excess > 0:
+        name = max(allocated, key=allocated.get)
+        cut = min(excess, allocated[name] - floor)
+        if cut <= 0:
+            break
+        allocated[name] -= cut
+        excess -= cut
+    return allocated
+
+def estimate_size(key, val):
+    '''
+    Default cache entry size estimator. Flat values use sys.getsizeof,
+    while containers and objects fall back to their pickled length as
+    getsizeof doesn't count what they reference.
+    '''
+    size = sys.getsizeof(key)
+    if isinstance(val, FLAT_TYPES):
+        return size + sys.getsizeof(val)
+    try:
+        return size + len(pickle.dumps(val, pickle.HIGHEST_PROTOCOL))
+    except Exception:
+        return size + sys.getsizeof(val)
+
+def value_fingerprint(val):
+    '''
+    Digest of a value's pickled bytes, used to tell whether a cached value
+    changed since it was read. Gives None if the value can't be pickled.
+    '''
+    try:
+        return hashlib.md5(pickle.dumps(val, pickle.HIGHEST_PROTOCOL)).digest()
+    except Exception:
+        return None
@@ -0,0 +1,103 @@
+import numbers
+import time
+
+# Counters which are summed when stats are aggregated
+COUNTERS = ('hits', 'misses', 'evictions', 'dirty_flushes', 'bytes_written',
+            'syncs', 'sync_time')
+
+class CacheStats(object):
+    '''
+    Counters for the hot paths of a cached wrapper, along with optional
+    hooks called as the events happen:
+
+        on_miss(key)           a lookup wasn't found in the cache
+        on_evict(keys)         keys were dropped to make room in the cache
+        on_sync_start()        writes are about to be flushed to the database
+        on_sync_end(seconds)   the flush finished after seconds
+
+    Wrappers only create one when stats or hooks are asked for, so the
+    cost of leaving them off is a None check. bytes_written is estimated
+    with the wrapper's size estimator rather than measured, and counts
+    updated from a background writer thread are approximate.
+    '''
+    def __init__(self, on_miss=None, on_evict=None, on_sync_start=None, on_sync_end=None):
+        self.on_miss = on_miss
+        self.on_evict = on_evict
+        self.on_sync_start = on_sync_start
+        self.on_sync_end = on_sync_end
+        self.reset()
+
+    def reset(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.dirty_flushes = 0
+        self.bytes_written = 0
+        self.syncs = 0
+        self.sync_time = 0.0
+
+    def miss(self, key):
+        self.misses += 1
+        if self.on_miss is not None:
+            self.on_miss(key)
+
+    def evict(self, keys):
+        self.evictions += len(keys)
+        if self.on_evict is not None:
+            self.on_evict(list(keys))
+
+    def flush(self, items, size_estimator):
+        '''
+        Counts (key, value) pairs being written to the database.
+        '''
+        self.dirty_flushes += len(items)
+        for key, val in items:
+            self.bytes_written += size_estimator(key, val)
+
+    def sync_started(self):
+        '''
+        Calls the sync start hook and returns the start time to pass
+        to sync_ended.
+        '''
+        if self.on_sync_start is not None:
+            self.on_sync_start()
+        return time.time()
+
+    def sync_ended(self, start):
+        elapsed = time.time() - start
+        self.syncs += 1
+        self.sync_time += elapsed
+        if self.on_sync_end is not None:
+            self.on_sync_end(elapsed)
+
+    def as_dict(self):
+        stats = dict((name, getattr(self, name)) for name in COUNTERS)
+        stats['hit_ratio'] = hit_ratio(stats)
+        return stats
+
+def make_cache_stats(collect_stats=False, on_miss=None, on_evict=None,
+                     on_sync_start=None, on_sync_end=None):
+    '''
+    Builds a CacheStats if stats or any hook were asked for, else None.
+    '''
+    if not (collect_stats or on_miss or on_evict or on_sync_start or on_sync_end):
+        return None
+    return CacheStats(on_miss, on_evict, on_sync_start, on_sync_end)
+
+def hit_ratio(stats):
+    lookups = stats.get('hits', 0) + stats.get('misses', 0)
+    return float(stats.get('hits', 0)) / lookups if lookups else None
+
+def aggregate_stats(stats_list):
+    '''
+    Sums the numeric entries of several stats dictionaries, such as
+    those of the shards of a split database, and recomputes hit_ratio.
+    '''
+    totals = {}
+    for stats in stats_list:
+        for name, val in stats.items():
+            if name != 'hit_ratio' and isinstance(val, numbers.Number):
+                totals[name] = totals.get(name, 0) + val
+    if 'hits' in totals:
+        totals['hit_ratio'] = hit_ratio(totals)
+    return totals
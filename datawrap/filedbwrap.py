@@ -1,4 +1,15 @@
-import os, shelve
+import collections
+import os
+import sys
+from builtins import chr
+from .bloomfilter import BloomFilter
+from .valuecodec import CodecShelf, get_value_codec
+from .logstore import LogStore, get_hint_path, iter_records, pack_record, encode_key
+from .sqlitestore import SqliteStore, WAL_SUFFIXES
+from .frozenstore import FrozenStore, write_frozen
+from .snapshot import SnapshotDict, write_snapshot
+from .bitmapset import RoaringBitmap, member_int
+from .cachepolicy import value_fingerprint
 from .basewrap import (
     MemDict,
     UnorderedCachedDict,
@@ -6,6 +17,9 @@ from .basewrap import (
     SplitDbDict,
     SplitDbSet)
 
+# Smallest bloom filter built for a file database
+MIN_BLOOM_CAPACITY = 64*1024
+
 def get_default_file_ext():
     '''
     Helper function for all file wrappers to identify
@@ -13,14 +27,222 @@ def get_default_file_ext():
     '''
     return 'fd'
 
+def get_frozen_file_ext():
+    return 'fdz'
+
+def get_bitmap_file_ext():
+    return 'fdbm'
+
+# Storage engines which FileDict and FileSet can be opened with
+STORAGE_BACKENDS = {
+    'dbm': CodecShelf,
+    'log': LogStore,
+    'sqlite': SqliteStore
+}
+
+def open_storage(backend, db_full_path, flag, codec=None):
+    '''
+    Opens a database file with either a backend named in STORAGE_BACKENDS
+    or a callable taking (filename, flag, codec).
+    '''
+    if not callable(backend):
+        try:
+            backend = STORAGE_BACKENDS[backend.lower()]
+        except (KeyError, AttributeError):
+            raise ValueError("Unknown storage backend: {}".format(backend))
+    return backend(db_full_path, flag=flag, codec=codec)
+
+# Files the dbm modules may create for a shelve at a path
+DBM_SUFFIXES = ('', '.db', '.dat', '.dir', '.bak', '.pag')
+# Smallest MemFromFileDict journal that is folded back into its snapshot
+MIN_JOURNAL_COMPACT_BYTES = 64*1024
+
+def get_journal_path(db_full_path):
+    return db_full_path + '.journal'
+
+def get_snapshot_path(db_full_path):
+    return db_full_path + '.snap'
+
+def get_generation_path(db_full_path):
+    return db_full_path + '.gen'
+
+def get_shelve_path(db_full_path):
+    '''
+    Gets the path of the current shelve of a MemFromFileDict: the one
+    named in its generation file once it has been compacted, otherwise
+    db_full_path itself.
+    '''
+    try:
+        with open(get_generation_path(db_full_path), 'r') as fhandle:
+            generation = fhandle.read().strip()
+    except (IOError, OSError):
+        return db_full_path
+    return db_full_path + '.' + generation if generation else db_full_path
+
+def next_shelve_path(db_full_path):
+    current = get_shelve_path(db_full_path)
+    generation = int(current[len(db_full_path) + 2:] or 0) if current != db_full_path else 0
+    return '{}.g{}'.format(db_full_path, generation + 1)
+
+def switch_shelve(db_full_path, shelve_path):
+    '''
+    Points the generation file at shelve_path. A shelve is several
+    files with dbm.dumb, so only this one rename switches to it.
+    '''
+    gen_path = get_generation_path(db_full_path)
+    tmp_path = gen_path + '.tmp'
+    with open(tmp_path, 'w') as fhandle:
+        fhandle.write(shelve_path[len(db_full_path) + 1:])
+        fhandle.flush()
+        os.fsync(fhandle.fileno())
+    if os.name == 'nt' and os.path.exists(gen_path):
+        os.remove(gen_path)
+    os.rename(tmp_path, gen_path)
+
+def remove_dbm_files(shelve_path):
+    for suffix in DBM_SUFFIXES:
+        try: os.remove(shelve_path + suffix)
+        except OSError: pass
+
+def remove_generations(db_full_path, keep=None):
+    '''
+    Removes the compacted shelves of a MemFromFileDict other than keep,
+    along with the generation file unless keep is given.
+    '''
+    dir_path, base_name = os.path.split(db_full_path)
+    prefix = base_name + '.g'
+    shelves = set([db_full_path])
+    try:
+        names = os.listdir(dir_path or '.')
+    except OSError:
+        names = []
+    for name in names:
+        generation = name[len(prefix):].split('.')[0]
+        if name.startswith(prefix) and generation.isdigit():
+            shelves.add(db_full_path + '.g' + generation)
+    for shelve_path in shelves:
+        if shelve_path != keep:
+            remove_dbm_files(shelve_path)
+    if keep is None:
+        for path in (get_generation_path(db_full_path),
+                     get_generation_path(db_full_path) + '.tmp'):
+            try: os.remove(path)
+            except OSError: pass
+
+def dbm_exists(db_full_path):
+    return any(os.path.exists(db_full_path + suffix) for suffix in DBM_SUFFIXES)
+
+def get_dbm_size(db_full_path):
+    return sum(os.path.getsize(db_full_path + suffix) for suffix in DBM_SUFFIXES
+               if os.path.exists(db_full_path + suffix))
+
+def remove_db_files(db_full_path):
+    paths = [db_full_path + suffix for suffix in DBM_SUFFIXES]
+    paths.append(get_hint_path(db_full_path))
+    paths.append(get_journal_path(db_full_path))
+    paths.append(get_snapshot_path(db_full_path))
+    paths.extend(db_full_path + suffix for suffix in WAL_SUFFIXES)
+    for path in paths:
+        try: os.remove(path)
+        except OSError: pass
+    remove_generations(db_full_path)
+
+def prefix_upper_bound(prefix):
+    '''
+    Gets the smallest string sorting after every string which starts
+    with prefix, or None if there is no such string.
+    '''
+    prefix = prefix.rstrip(chr(sys.maxunicode))
+    if not prefix:
+        return None
+    code = ord(prefix[-1]) + 1
+    if 0xD800 <= code < 0xE000:
+        # Skip the surrogates, which can't be encoded on their own
+        code = 0xE000
+    return prefix[:-1] + chr(code)
+
+def merge_sorted_keys(first, second, reverse=False):
+    '''
+    Merges two sorted iterables of unique keys, dropping duplicates.
+    '''
+    first, second = iter(first), iter(second)
+    done = object()
+    left, right = next(first, done), next(second, done)
+    while left is not done and right is not done:
+        if left == right:
+            yield left
+            left, right = next(first, done), next(second, done)
+        elif (left < right) != reverse:
+            yield left
+            left = next(first, done)
+        else:
+            yield right
+            right = next(second, done)
+    while left is not done:
+        yield left
+        left = next(first, done)
+    while right is not done:
+        yield right
+        right = next(second, done)
+
+def get_bloom_path(db_full_path):
+    return db_full_path + '.bloom'
+
+def remove_bloom_filter(db_full_path):
+    try: os.remove(get_bloom_path(db_full_path))
+    except OSError: pass
+
+def open_bloom_filter(db_full_path, database, clear=False, read_only=False, error_rate=0.01):
+    '''
+    Loads the bloom filter saved next to a file database, or builds one
+    from the database's keys if there is none (or it's overfull). The
+    saved copy of a writable database is removed until save_bloom_filter
+    is called on close, so a crash can't leave a stale filter behind.
+    '''
+    bloom = None
+    bloom_path = get_bloom_path(db_full_path)
+    if not clear and os.path.exists(bloom_path):
+        try:
+            bloom = BloomFilter.load(bloom_path, error_rate)
+        except (IOError, ValueError):
+            pass
+        if bloom is not None and bloom.saturated:
+            bloom = None
+    if bloom is None:
+        keys = [] if clear else list(database)
+        bloom = BloomFilter(max(2*len(keys), MIN_BLOOM_CAPACITY), error_rate)
+        bloom.update(keys)
+    if not read_only:
+        remove_bloom_filter(db_full_path)
+    return bloom
+
+def save_bloom_filter(db_full_path, bloom):
+    bloom.save(get_bloom_path(db_full_path))
+
 class MemFromFileDict(MemDict):
     '''
     This wraps a standard dictionary with a file persistence that
     allows the dictionary to be reloaded and/or saved upon closing.
+    Values are stored in the file with codec (see FileDict).
+
+    Syncs only append the keys changed or deleted since the last sync
+    to a journal next to the file, which is replayed on load. Once the
+    journal grows past compact_ratio of the file it is folded back in
+    by compact, which writes a new file and atomically switches to it.
+    Values which have been read or written are fingerprinted, unless
+    immutable_vals is set, and kept fingerprinted across syncs so a value
+    is journaled whenever it was modified in place since the last one.
+
+    With snapshot set, compact writes a snapshot file (see SnapshotDict)
+    in place of the shelve. Loading a snapshot only reads its index and
+    leaves each value to be unpickled when first accessed, so startup
+    doesn't pay a lookup and unpickle per key. Whichever of the two
+    files exists is loaded, and compacting converts between them.
     '''
     # Careful with changing __init__ params and forgetting them in _reinit
     def __init__(self, db_name, db_ext=None, read_only=False, database_default_func=None,
-                 clear=False, stringify_keys=False, **kwargs):
+                 clear=False, stringify_keys=False, codec=None, immutable_vals=False,
+                 compact_ratio=0.5, snapshot=False, **kwargs):
         MemDict.__init__(self, db_name, read_only=read_only,
                          stringify_keys=stringify_keys,
                          database_default_func=database_default_func,
@@ -32,22 +254,154 @@ class MemFromFileDict(MemDict):
             try: os.makedirs(abs_dir_path)
             except OSError: pass
         self._db_full_path = '.'.join((os.path.abspath(db_name), self._db_ext))
-        file_present = os.path.exists(self._db_full_path)
+        self._journal_path = get_journal_path(self._db_full_path)
+        self._snapshot_path = get_snapshot_path(self._db_full_path)
+        if clear and not read_only:
+            remove_generations(self._db_full_path)
+        self._shelve_path = get_shelve_path(self._db_full_path)
+        file_present = os.path.exists(self._shelve_path)
         self.flag = 'n' if clear else 'r' if read_only and file_present else 'c'
         self.closed = False
-        self._db_file = shelve.open(self._db_full_path, flag=self.flag)
-        if not clear:
-            # Copy all elements into memory dict
-            for key in self._db_file:
-                self._database[key] = self._db_file[key]
-        # We're done with the file for now
-        self._db_file.close()
+        self._codec = codec
+        self._value_codec = get_value_codec(codec)
+        self._immutable_vals = immutable_vals
+        self.compact_ratio = compact_ratio
+        self.snapshot = snapshot
+        self._dirty = set()
+        self._deleted = set()
+        self._read_prints = {}
+        if clear:
+            for path in (self._journal_path, self._snapshot_path):
+                try: os.remove(path)
+                except OSError: pass
+        if os.path.exists(self._snapshot_path):
+            self._database = SnapshotDict(self._snapshot_path, codec=codec)
+        elif not snapshot or dbm_exists(self._shelve_path):
+            self._db_file = CodecShelf(self._shelve_path, flag=self.flag, codec=codec)
+            if not clear:
+                # Copy all elements into memory dict
+                for key in self._db_file:
+                    self._database[key] = self._db_file[key]
+            # We're done with the file for now
+            self._db_file.close()
+        self._journal_bytes = self._replay_journal()
+        self._file_bytes = self._get_file_bytes()
 
     def _add_init_kwargs(self, kwargs):
         MemDict._add_init_kwargs(self, kwargs)
 
         kwargs['db_name'] = self._db_name
         kwargs['db_ext'] = self._db_ext
+        if 'codec' not in kwargs:
+            kwargs['codec'] = self._codec
+        if 'immutable_vals' not in kwargs:
+            kwargs['immutable_vals'] = self._immutable_vals
+        if 'compact_ratio' not in kwargs:
+            kwargs['compact_ratio'] = self.compact_ratio
+        if 'snapshot' not in kwargs:
+            kwargs['snapshot'] = self.snapshot
+
+    def _get_file_bytes(self):
+        if os.path.exists(self._snapshot_path):
+            return os.path.getsize(self._snapshot_path)
+        return get_dbm_size(self._shelve_path)
+
+    def _reset_database(self):
+        if isinstance(self._database, SnapshotDict):
+            self._database.close()
+        MemDict._reset_database(self)
+
+    def _replay_journal(self):
+        '''
+        Applies the journal to the loaded dictionary, returning its size.
+        A partial record left by an interrupted sync is dropped.
+        '''
+        if not os.path.exists(self._journal_path):
+            return 0
+        end = 0
+        with open(self._journal_path, 'rb') as fhandle:
+            for key, data, size in iter_records(fhandle):
+                if data is None:
+                    self._database.pop(key, None)
+                else:
+                    self._database[key] = self._value_codec.decode(data)
+                end += size
+        if not self.read_only and os.path.getsize(self._journal_path) > end:
+            with open(self._journal_path, 'r+b') as fhandle:
+                fhandle.truncate(end)
+        return end
+
+    def _stringify(self, key):
+        return str(key) if key != None and self.stringify_keys else key
+
+    def _mark_dirty(self, key):
+        self._deleted.discard(key)
+        self._read_prints.pop(key, None)
+        self._dirty.add(key)
+
+    def _mark_deleted(self, key):
+        self._dirty.discard(key)
+        self._read_prints.pop(key, None)
+        self._deleted.add(key)
+
+    def _mark_read(self, key):
+        # Reads are only journaled if their fingerprint changes by the sync
+        key = self._stringify(key)
+        if (key in self._database and key not in self._dirty and
+                key not in self._read_prints):
+            self._read_prints[key] = value_fingerprint(self._database[key])
+
+    def __getitem__(self, key):
+        val = MemDict.__getitem__(self, key)
+        if not self._immutable_vals and not self.read_only:
+            self._mark_read(key)
+        return val
+
+    def get_many(self, keys, default=None):
+        keys = list(keys)
+        vals = MemDict.get_many(self, keys, default=default)
+        if not self._immutable_vals and not self.read_only:
+            for key in keys:
+                self._mark_read(key)
+        return vals
+
+    def _changed_reads(self):
+        changed = []
+        for key, fingerprint in self._read_prints.items():
+            if key in self._database and (fingerprint is None or
+                                          value_fingerprint(self._database[key]) != fingerprint):
+                changed.append(key)
+        return changed
+
+    def _refresh_prints(self, keys):
+        # Stored values can still be modified in place after the sync
+        if self._immutable_vals:
+            return
+        for key in keys:
+            if key in self._database:
+                self._read_prints[key] = value_fingerprint(self._database[key])
+
+    def __setitem__(self, key, val):
+        MemDict.__setitem__(self, key, val)
+        self._mark_dirty(self._stringify(key))
+
+    def __delitem__(self, key):
+        MemDict.__delitem__(self, key)
+        self._mark_deleted(self._stringify(key))
+
+    def set_many(self, items):
+        if isinstance(items, collections.Mapping):
+            items = items.items()
+        items = list(items)
+        MemDict.set_many(self, items)
+        for key, _ in items:
+            self._mark_dirty(self._stringify(key))
+
+    def delete_many(self, keys):
+        keys = list(keys)
+        MemDict.delete_many(self, keys)
+        for key in keys:
+            self._mark_deleted(self._stringify(key))
 
     def _reinit(self, **kwargs):
         self._add_init_kwargs(kwargs)
@@ -68,23 +422,92 @@ class MemFromFileDict(MemDict):
         if delete_file:
             # Security vulnerability if file is accessible by 3rd party
             # as there is a time gap between closing and deleting
-            try: os.remove(self._db_full_path)
-            except: pass
+            remove_db_files(self._db_full_path)
         elif not self.closed:
             self.sync_cache()
         self._reset_database()
+        self._dirty = set()
+        self._deleted = set()
+        self._read_prints = {}
         self.closed = True
 
+    def compact(self):
+        '''
+        Writes the whole dictionary to a new file (a snapshot or a shelve,
+        as set by snapshot) and switches to it with a single rename, then
+        drops the journal and the old files. A snapshot is renamed over
+        the old one, while a shelve is written under a new generation name
+        and switched to by renaming the generation file (see switch_shelve),
+        so an interrupted compaction leaves either the old or new file.
+        '''
+        if self.read_only:
+            raise AttributeError("Attempted to compact in read_only mode")
+        self._dirty.update(self._changed_reads())
+        if isinstance(self._database, SnapshotDict) and os.name == 'nt':
+            # Mapped files can't be replaced on windows
+            database = self._database
+            self._database = dict(database.items())
+            database.close()
+        if self.snapshot:
+            if isinstance(self._database, SnapshotDict):
+                records = self._database.encoded_items(self._value_codec)
+            else:
+                records = ((key, self._value_codec.encode(val))
+                           for key, val in self._database.items())
+            write_snapshot(self._snapshot_path, records)
+            # The snapshot is loaded ahead of any shelve from here on
+            remove_generations(self._db_full_path)
+            self._shelve_path = self._db_full_path
+        else:
+            shelve_path = next_shelve_path(self._db_full_path)
+            remove_dbm_files(shelve_path)
+            db_file = CodecShelf(shelve_path, flag='n', codec=self._codec)
+            try:
+                for key, val in self._database.items():
+                    db_file[key] = val
+                db_file.sync()
+            finally:
+                db_file.close()
+            switch_shelve(self._db_full_path, shelve_path)
+            self._shelve_path = shelve_path
+            # The old snapshot would be loaded ahead of the new shelve
+            try: os.remove(self._snapshot_path)
+            except OSError: pass
+            remove_generations(self._db_full_path, keep=shelve_path)
+        # Replaying the old journal over the new file would be harmless,
+        # so it's only dropped once the old files are gone
+        try: os.remove(self._journal_path)
+        except OSError: pass
+        self._refresh_prints(self._dirty)
+        self._dirty = set()
+        self._deleted = set()
+        self._journal_bytes = 0
+        self._file_bytes = self._get_file_bytes()
+
     def _sync_writes(self):
-        if not self.read_only:
-            self._db_file = shelve.open(self._db_full_path, flag='n')
-            for key in self._database:
-                self._db_file[key] = self._database[key]
-            self._db_file.sync()
-            # We're done with the file for now
-            self._db_file.close()
+        if self.read_only:
+            return
+        self._dirty.update(self._changed_reads())
+        if not (self._dirty or self._deleted):
+            return
+        records = []
+        for key in self._dirty:
+            records.append(pack_record(encode_key(key),
+                                       self._value_codec.encode(self._database[key])))
+        for key in self._deleted:
+            records.append(pack_record(encode_key(key), None))
+        with open(self._journal_path, 'ab') as fhandle:
+            for record in records:
+                fhandle.write(record)
+                self._journal_bytes += len(record)
+        self._refresh_prints(self._dirty)
+        self._dirty = set()
+        self._deleted = set()
+        if (self._journal_bytes >= MIN_JOURNAL_COMPACT_BYTES and
+                self._journal_bytes > self.compact_ratio * self._file_bytes):
+            self.compact()
 
-    def sync_cache(self):
+    def sync_cache(self, keep_clean=None):
         self._sync_writes()
         self.drop_cache()
 
@@ -94,11 +517,30 @@ class FileDict(UnorderedCachedDict):
     The database is saved to file when the cache gets too large or it is
     synced. This allows for very large databases to be stored in the
     filesystem without consuming all available memory.
+
+    Values are stored with codec, either a valuecodec.ValueCodec or the
+    name of one ('pickle', 'pickle-highest', 'marshal', 'zlib', 'lzma' or
+    'marshal-zlib'). The default stores the same pickles as shelve. Each
+    compressed or marshalled record is tagged with how it was encoded, so
+    files can be reopened with any codec.
+
+    The file is stored by backend, either 'dbm' (through shelve's dbm
+    modules), 'log' for the append only logstore.LogStore, which makes
+    flushes sequential writes, or 'sqlite' for sqlitestore.SqliteStore,
+    which flushes in one transaction and allows concurrent readers.
+    compact reclaims the space held by overwritten and deleted values
+    where the backend supports it. freeze exports the database for read
+    only serving by FrozenFileDict.
+
+    With use_bloom_filter, a bloom filter of the keys (see
+    UnorderedCachedDict) is saved next to the database file on close
+    and reloaded, or rebuilt from the keys, on open.
     '''
     # Careful with changing __init__ params and forgetting them in _reinit
     def __init__(self, db_name, db_ext=None, read_only=False, clear=False, cache_size=10*1024,
                  immutable_vals=False, stringify_keys=False, cache_misses=True,
-                 database_default_func=None, read_pool_size=0, **kwargs):
+                 database_default_func=None, read_pool_size=0, use_bloom_filter=False,
+                 bloom_error_rate=0.01, codec=None, backend='dbm', **kwargs):
         self._db_name = db_name
         self._db_ext = db_ext if db_ext != None else get_default_file_ext()
         abs_dir_path = os.path.dirname(os.path.abspath(db_name))
@@ -109,8 +551,21 @@ class FileDict(UnorderedCachedDict):
         self._db_full_path = '.'.join((os.path.abspath(db_name), self._db_ext))
         file_present = os.path.exists(self._db_full_path)
         self.flag = 'n' if clear else 'r' if read_only and file_present else 'c'
-        self._database = shelve.open(self._db_full_path, flag=self.flag)
+        self._codec = codec
+        self._backend = backend
+        # Stays closed if the storage can't be opened
+        self.closed = True
+        self._database = open_storage(backend, self._db_full_path, self.flag, codec)
         self.closed = False
+        self._use_bloom_filter = use_bloom_filter
+        self._bloom_error_rate = bloom_error_rate
+        if use_bloom_filter:
+            kwargs['bloom_filter'] = open_bloom_filter(self._db_full_path, self._database,
+                                                       clear=clear, read_only=read_only,
+                                                       error_rate=bloom_error_rate)
+        elif not read_only:
+            # Writes without the filter would leave a saved one stale
+            remove_bloom_filter(self._db_full_path)
         UnorderedCachedDict.__init__(self, self._database, cache_size=cache_size,
                                      database_default_func=database_default_func, read_only=read_only,
                                      immutable_vals=immutable_vals, stringify_keys=stringify_keys,
@@ -119,7 +574,17 @@ class FileDict(UnorderedCachedDict):
     def _add_init_kwargs(self, kwargs):
         kwargs['db_name'] = self._db_name
         kwargs['db_ext'] = self._db_ext
+        if 'codec' not in kwargs:
+            kwargs['codec'] = self._codec
+        if 'backend' not in kwargs:
+            kwargs['backend'] = self._backend
+        if 'use_bloom_filter' not in kwargs:
+            kwargs['use_bloom_filter'] = self._use_bloom_filter
+        if 'bloom_error_rate' not in kwargs:
+            kwargs['bloom_error_rate'] = self._bloom_error_rate
         UnorderedCachedDict._add_init_kwargs(self, kwargs)
+        # The filter is saved on close and reloaded by __init__
+        kwargs.pop('bloom_filter', None)
 
     def _reinit(self, **kwargs):
         self._add_init_kwargs(kwargs)
@@ -142,18 +607,120 @@ class FileDict(UnorderedCachedDict):
         kwargs['clear'] = True
         self._reinit(**kwargs)
 
+    def compact(self):
+        '''
+        Writes back the cache and compacts the database file.
+        '''
+        if self.read_only:
+            raise AttributeError("Attempted to compact in read_only mode")
+        self._sync_writes()
+        with self._db_lock:
+            self._database.compact()
+
+    def freeze(self, db_name=None, db_ext=None, codec=None):
+        '''
+        Writes back the cache and exports the whole database to an
+        immutable frozen file (see FrozenFileDict), by default named
+        after this database with the frozen extension and written with
+        the same codec. Returns the path of the frozen file.
+        '''
+        self._sync_writes()
+        db_name = db_name if db_name != None else self._db_name
+        db_ext = db_ext if db_ext != None else get_frozen_file_ext()
+        frozen_path = '.'.join((os.path.abspath(db_name), db_ext))
+        with self._db_lock:
+            write_frozen(frozen_path, ((key, self._database[key]) for key in self._database),
+                         codec if codec != None else self._codec)
+        return frozen_path
+
     def close(self, delete_file=False, **kwargs):
-        if delete_file:
-            # Security vulnerability if file is accessible by 3rd party
-            # as there is a time gap between closing and deleting
-            if not self.closed:
-                self._database.close()
-            try: os.remove(self._db_full_path)
-            except: pass
-        elif not self.closed:
-            self.sync_cache()
-            self._database.close()
-        self.closed = True
+        # The database is closed even if the last writes fail
+        try:
+            self._stop_workers()
+        finally:
+            try:
+                if not delete_file and not self.closed:
+                    self.sync_cache()
+            finally:
+                if not self.closed:
+                    self._database.close()
+                    if self._bloom is not None and not self.read_only and not delete_file:
+                        save_bloom_filter(self._db_full_path, self._bloom)
+                if delete_file:
+                    # Security vulnerability if file is accessible by 3rd party
+                    # as there is a time gap between closing and deleting
+                    remove_db_files(self._db_full_path)
+                    remove_bloom_filter(self._db_full_path)
+                self.closed = True
+
+class OrderedFileDict(FileDict):
+    '''
+    A FileDict stored by a backend which keeps its keys sorted (sqlite's
+    B-tree by default), so range, prefix and reversed only scan the keys
+    asked for, and iteration is in key order. Keys which are only in the
+    cache, or still waiting on the write_behind writer, are merged into
+    every scan so nothing has to be synced first. Keys must be strings,
+    or be stringified with stringify_keys.
+    '''
+    def __init__(self, db_name, db_ext=None, backend='sqlite', **kwargs):
+        FileDict.__init__(self, db_name, db_ext=db_ext, backend=backend, **kwargs)
+        if not hasattr(self._database, 'iter_range'):
+            self.close()
+            raise ValueError("Storage backend {} doesn't keep keys in order".format(backend))
+
+    def _unsynced_keys(self, start, stop):
+        '''
+        Gets the keys between start and stop which have values that might
+        not be in the database yet, and the keys known to be missing.
+        '''
+        with self._lock:
+            cached = list(self._cache.items())
+            if self._writer is not None:
+                cached.extend(self._writer.pending.items())
+        present = set()
+        missing = set()
+        for key, val in cached:
+            if (start is None or key >= start) and (stop is None or key < stop):
+                if val == None:
+                    missing.add(key)
+                else:
+                    present.add(key)
+        return present, missing - present
+
+    def range(self, start=None, stop=None, reverse=False):
+        '''
+        Iterates the keys from start (inclusive) to stop (exclusive) in
+        sorted order, or backwards with reverse. Either bound can be None
+        to leave that end open.
+        '''
+        if self.stringify_keys:
+            start = str(start) if start != None else start
+            stop = str(stop) if stop != None else stop
+        present, missing = self._unsynced_keys(start, stop)
+        stored = (key for key in self._database.iter_range(start, stop, reverse)
+                  if key not in missing)
+        return merge_sorted_keys(stored, sorted(present, reverse=reverse), reverse)
+
+    def range_items(self, start=None, stop=None, reverse=False):
+        '''
+        Iterates the (key, value) pairs of range.
+        '''
+        for key in self.range(start, stop, reverse):
+            yield key, self[key]
+
+    def prefix(self, prefix, reverse=False):
+        '''
+        Iterates the keys starting with prefix in sorted order.
+        '''
+        if self.stringify_keys:
+            prefix = str(prefix)
+        return self.range(prefix or None, prefix_upper_bound(prefix), reverse)
+
+    def __iter__(self):
+        return self.range()
+
+    def __reversed__(self):
+        return self.range(reverse=True)
 
 class FileSet(UnorderedCachedSet):
     '''
@@ -162,7 +729,8 @@ class FileSet(UnorderedCachedSet):
     # Careful with changing __init__ params and forgetting them in reopen/clear
     def __init__(self, db_name, db_ext=None, read_only=False, clear=False, cache_size=10*1024,
                  immutable_vals=False, stringify_keys=False, cache_misses=True,
-                 read_pool_size=0, **kwargs):
+                 read_pool_size=0, use_bloom_filter=False, bloom_error_rate=0.01, codec=None,
+                 backend='dbm', **kwargs):
         self._db_name = db_name
         self._db_ext = db_ext if db_ext != None else get_default_file_ext()
         abs_dir_path = os.path.dirname(os.path.abspath(db_name))
@@ -173,8 +741,21 @@ class FileSet(UnorderedCachedSet):
         self._db_full_path = '.'.join((os.path.abspath(db_name), self._db_ext))
         file_present = os.path.exists(self._db_full_path)
         self.flag = 'n' if clear else 'r' if read_only and file_present else 'c'
-        self._database = shelve.open(self._db_full_path, flag=self.flag)
+        self._codec = codec
+        self._backend = backend
+        # Stays closed if the storage can't be opened
+        self.closed = True
+        self._database = open_storage(backend, self._db_full_path, self.flag, codec)
         self.closed = False
+        self._use_bloom_filter = use_bloom_filter
+        self._bloom_error_rate = bloom_error_rate
+        if use_bloom_filter:
+            kwargs['bloom_filter'] = open_bloom_filter(self._db_full_path, self._database,
+                                                       clear=clear, read_only=read_only,
+                                                       error_rate=bloom_error_rate)
+        elif not read_only:
+            # Writes without the filter would leave a saved one stale
+            remove_bloom_filter(self._db_full_path)
         UnorderedCachedSet.__init__(self, self._database, cache_size=cache_size,
                                     read_only=read_only, immutable_vals=immutable_vals,
                                     stringify_keys=stringify_keys,
@@ -184,7 +765,17 @@ class FileSet(UnorderedCachedSet):
     def _add_init_kwargs(self, kwargs):
         kwargs['db_name'] = self._db_name
         kwargs['db_ext'] = self._db_ext
+        if 'codec' not in kwargs:
+            kwargs['codec'] = self._codec
+        if 'backend' not in kwargs:
+            kwargs['backend'] = self._backend
+        if 'use_bloom_filter' not in kwargs:
+            kwargs['use_bloom_filter'] = self._use_bloom_filter
+        if 'bloom_error_rate' not in kwargs:
+            kwargs['bloom_error_rate'] = self._bloom_error_rate
         UnorderedCachedSet._add_init_kwargs(self, kwargs)
+        # The filter is saved on close and reloaded by __init__
+        kwargs.pop('bloom_filter', None)
 
     def _reinit(self, **kwargs):
         self._add_init_kwargs(kwargs)
@@ -207,26 +798,320 @@ class FileSet(UnorderedCachedSet):
         kwargs['clear'] = True
         self._reinit(**kwargs)
 
+    def compact(self):
+        '''
+        Writes back the cache and compacts the database file.
+        '''
+        if self.read_only:
+            raise AttributeError("Attempted to compact in read_only mode")
+        self._sync_writes()
+        with self._db_lock:
+            self._database.compact()
+
     def close(self, delete_file=False, **kwargs):
+        # The database is closed even if the last writes fail
+        try:
+            self._stop_workers()
+        finally:
+            try:
+                if not delete_file and not self.closed:
+                    self.sync_cache()
+            finally:
+                if not self.closed:
+                    self._database.close()
+                    if self._bloom is not None and not self.read_only and not delete_file:
+                        save_bloom_filter(self._db_full_path, self._bloom)
+                if delete_file:
+                    # Security vulnerability if file is accessible by 3rd party
+                    # as there is a time gap between closing and deleting
+                    remove_db_files(self._db_full_path)
+                    remove_bloom_filter(self._db_full_path)
+                self.closed = True
+
+class BitmapFileSet(collections.MutableSet):
+    '''
+    A set of non-negative integers held as a compressed bitmap (see
+    RoaringBitmap) in a single file, which is memory mapped on open and
+    rewritten on sync_cache and close. Dense id ranges take about a bit
+    per member instead of a database entry each.
+
+    Members which aren't integers are mapped to one with int_func
+    (member_int by default, which parses strings and rejects numbers
+    which aren't integral), so lookups can take string ids while
+    iteration gives back the integers. Set operators with other bitmap sets work a
+    container at a time and return a RoaringBitmap.
+    '''
+    # Careful with changing __init__ params and forgetting them in reopen/clear
+    def __init__(self, db_name, db_ext=None, read_only=False, clear=False, int_func=None,
+                 **kwargs):
+        self._db_name = db_name
+        self._db_ext = db_ext if db_ext != None else get_bitmap_file_ext()
+        abs_dir_path = os.path.dirname(os.path.abspath(db_name))
+        if not os.path.exists(abs_dir_path):
+            try: os.makedirs(abs_dir_path)
+            except OSError: pass
+        self._db_full_path = '.'.join((os.path.abspath(db_name), self._db_ext))
+        self.read_only = read_only
+        self._int_func = int_func
+        self._to_int = int_func if int_func != None else member_int
+        # Stays closed if the file can't be opened
+        self.closed = True
+        if clear or not os.path.exists(self._db_full_path):
+            self._bitmap = RoaringBitmap()
+            self._dirty = not read_only
+        else:
+            self._bitmap = RoaringBitmap.load(self._db_full_path)
+            self._dirty = False
+        self.closed = False
+
+    def _check_writable(self, action):
+        if self.read_only:
+            raise AttributeError("Attempted to {} in read_only mode".format(action))
+        self._dirty = True
+
+    def _as_bitmap(self, other):
+        if isinstance(other, BitmapFileSet):
+            return other._bitmap
+        if isinstance(other, RoaringBitmap):
+            return other
+        return RoaringBitmap(self._to_int(elem) for elem in other)
+
+    def __contains__(self, elem):
+        try:
+            return self._to_int(elem) in self._bitmap
+        except (TypeError, ValueError):
+            return False
+
+    def __iter__(self):
+        return iter(self._bitmap)
+
+    def __len__(self):
+        return len(self._bitmap)
+
+    def add(self, elem):
+        self._check_writable('set')
+        self._bitmap.add(self._to_int(elem))
+
+    def discard(self, elem):
+        self._check_writable('delete')
+        try:
+            elem = self._to_int(elem)
+        except (TypeError, ValueError):
+            return
+        self._bitmap.discard(elem)
+
+    def update(self, *args, **kwargs):
+        '''
+        Updates the set to include all arguments passed in. If the keyword
+        argument preprocess is passed, then each element is preprocessed
+        before being added.
+        '''
+        self._check_writable('set')
+        preprocess = kwargs.get('preprocess')
+        to_int = self._to_int
+        for s in args:
+            self._bitmap.update(to_int(preprocess(e) if preprocess else e) for e in s)
+
+    def get_bitmap(self):
+        return self._bitmap
+
+    def __and__(self, other):
+        return self._bitmap & self._as_bitmap(other)
+
+    def __or__(self, other):
+        return self._bitmap | self._as_bitmap(other)
+
+    def __sub__(self, other):
+        return self._bitmap - self._as_bitmap(other)
+
+    def __xor__(self, other):
+        return self._bitmap ^ self._as_bitmap(other)
+
+    __rand__ = __and__
+    __ror__ = __or__
+    __rxor__ = __xor__
+
+    def __rsub__(self, other):
+        return self._as_bitmap(other) - self._bitmap
+
+    def __iand__(self, other):
+        self._check_writable('set')
+        self._bitmap &= self._as_bitmap(other)
+        return self
+
+    def __ior__(self, other):
+        self._check_writable('set')
+        self._bitmap |= self._as_bitmap(other)
+        return self
+
+    def __isub__(self, other):
+        self._check_writable('delete')
+        self._bitmap -= self._as_bitmap(other)
+        return self
+
+    def __ixor__(self, other):
+        self._check_writable('set')
+        self._bitmap ^= self._as_bitmap(other)
+        return self
+
+    def prefetch(self, elems):
+        pass # No-op
+
+    def get_cache(self):
+        return {}
+
+    def drop_cache(self):
+        pass # No-op
+
+    def sync_cache(self, **kwargs):
+        '''
+        Writes the bitmap back to its file if it changed.
+        '''
+        if self._dirty and not self.read_only:
+            self._bitmap.save(self._db_full_path)
+            self._dirty = False
+
+    def _reinit(self, **kwargs):
+        kwargs['db_name'] = self._db_name
+        kwargs['db_ext'] = self._db_ext
+        if 'read_only' not in kwargs:
+            kwargs['read_only'] = self.read_only
+        if 'int_func' not in kwargs:
+            kwargs['int_func'] = self._int_func
+        self.close()
+        self.__init__(**kwargs)
+
+    def reopen(self, read_only=None, **kwargs):
+        if read_only != None:
+            kwargs['read_only'] = read_only
+        kwargs['clear'] = False
+        self._reinit(**kwargs)
+
+    def clear(self, read_only=None, **kwargs):
+        if read_only != None:
+            kwargs['read_only'] = read_only
+        kwargs['clear'] = True
+        self._reinit(**kwargs)
+
+    def close(self, delete_file=False, **kwargs):
+        if not self.closed:
+            if not delete_file:
+                self.sync_cache()
+            self._bitmap.close()
         if delete_file:
-            # Security vulnerability if file is accessible by 3rd party
-            # as there is a time gap between closing and deleting
-            if not self.closed:
-                self._database.close()
             try: os.remove(self._db_full_path)
-            except: pass
-        elif not self.closed:
-            self.sync_cache()
+            except OSError: pass
+        self.closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, etype, value, traceback):
+        self.close()
+
+    def __del__(self):
+        # Close if we're being collected
+        self.close()
+
+class FrozenFileDict(collections.Mapping):
+    '''
+    Read only dictionary over a frozen file written by FileDict.freeze.
+    Lookups go straight to the memory mapped file (see FrozenStore)
+    without a cache of their own, so any number of processes serving
+    the same file share one copy of it in the page cache.
+    '''
+    def __init__(self, db_name, db_ext=None, stringify_keys=False,
+                 database_default_func=None, **kwargs):
+        self._db_name = db_name
+        self._db_ext = db_ext if db_ext != None else get_frozen_file_ext()
+        self._db_full_path = '.'.join((os.path.abspath(db_name), self._db_ext))
+        self._database_default_func = database_default_func
+        self.stringify_keys = stringify_keys
+        self.read_only = True
+        # Stays closed if the file can't be opened
+        self.closed = True
+        self._database = FrozenStore(self._db_full_path)
+        self.closed = False
+
+    def __getitem__(self, key):
+        if key != None and self.stringify_keys:
+            key = str(key)
+        try:
+            return self._database[key]
+        except KeyError:
+            if self._database_default_func != None:
+                return self._database_default_func()
+            raise
+
+    def __contains__(self, key):
+        if key != None and self.stringify_keys:
+            key = str(key)
+        return key in self._database
+
+    def __iter__(self):
+        return iter(self._database)
+
+    def __len__(self):
+        return len(self._database)
+
+    def prefetch(self, keys):
+        pass # No-op
+
+    def get_many(self, keys, default=None):
+        vals = []
+        for key in keys:
+            try:
+                vals.append(self[key])
+            except KeyError:
+                vals.append(default)
+        return vals
+
+    def get_cache(self):
+        return {}
+
+    def sync_cache(self, **kwargs):
+        pass # No-op
+
+    def drop_cache(self):
+        pass # No-op
+
+    def reopen(self, **kwargs):
+        self.close()
+        if 'stringify_keys' not in kwargs:
+            kwargs['stringify_keys'] = self.stringify_keys
+        if 'database_default_func' not in kwargs:
+            kwargs['database_default_func'] = self._database_default_func
+        self.__init__(self._db_name, self._db_ext, **kwargs)
+
+    def close(self, delete_file=False, **kwargs):
+        if not self.closed:
             self._database.close()
+        if delete_file:
+            try: os.remove(self._db_full_path)
+            except OSError: pass
         self.closed = True
 
+    def __enter__(self):
+        return self
+
+    def __exit__(self, etype, value, traceback):
+        self.close()
+
+    def __del__(self):
+        # Close if we're being collected
+        self.close()
+
 class SplitFileDict(SplitDbDict):
     '''
     Defines a split DB (see SplitDbDict) based on separate files.
     This is useful if you have a large dictionary of words and want
     to store all words with the same first character together.
+
+    Instead of split_keys and split_func, num_shards spreads keys over
+    that many files by consistent hashing, which can be changed later
+    with reshard.
     '''
-    def __init__(self, db_name, split_keys, split_func, db_ext=None, read_only=False,
+    def __init__(self, db_name, split_keys=None, split_func=None, db_ext=None, read_only=False,
                  clear=False, cache_misses=True, cache_size=10*1024, immutable_vals=False,
                  stringify_keys=False, database_default_func=None, **kwargs):
         SplitDbDict.__init__(self, db_name, FileDict, split_keys, split_func, db_ext=db_ext,
@@ -235,11 +1120,21 @@ class SplitFileDict(SplitDbDict):
                              database_default_func=database_default_func,
                              cache_misses=cache_misses, **kwargs)
 
+class SplitFrozenFileDict(SplitDbDict):
+    '''
+    Reads the frozen files written by SplitFileDict.freeze.
+    '''
+    def __init__(self, db_name, split_keys=None, split_func=None, db_ext=None,
+                 stringify_keys=False, database_default_func=None, **kwargs):
+        SplitDbDict.__init__(self, db_name, FrozenFileDict, split_keys, split_func,
+                             db_ext=db_ext, stringify_keys=stringify_keys,
+                             database_default_func=database_default_func, **kwargs)
+
 class SplitFileSet(SplitDbSet):
     '''
     Much like a SplitFileDict, except treated as a Set instead.
     '''
-    def __init__(self, db_name, split_keys, split_func, db_ext=None, read_only=False,
+    def __init__(self, db_name, split_keys=None, split_func=None, db_ext=None, read_only=False,
                  clear=False, cache_misses=True, cache_size=10*1024, immutable_vals=False,
                  stringify_keys=False, **kwargs):
         SplitDbSet.__init__(self, db_name, FileSet, split_keys, split_func, db_ext=db_ext,
@@ -0,0 +1,134 @@
+import collections
+import mmap
+import os
+import struct
+from .valuecodec import get_value_codec
+
+FROZEN_MAGIC = b'DWFROZ01'
+# Header: magic, entry count, offset of the keys region and of the index
+FROZEN_HEADER = struct.Struct('<8sQQQ')
+# Index entry: key offset, key length, value offset and value length
+INDEX_ENTRY = struct.Struct('<QIQI')
+
+def encode_key(key):
+    return key if isinstance(key, bytes) else key.encode('utf-8')
+
+def write_frozen(path, items, codec=None):
+    '''
+    Writes (key, value) pairs to an immutable frozen file. Values are
+    encoded with codec (see valuecodec) and written as they come, so
+    only the keys are held in memory while the index is sorted. Later
+    duplicates of a key replace earlier ones. The file is written next
+    to path and renamed into place once complete.
+    '''
+    codec = get_value_codec(codec)
+    locations = {}
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as fhandle:
+        fhandle.write(FROZEN_HEADER.pack(FROZEN_MAGIC, 0, 0, 0))
+        offset = FROZEN_HEADER.size
+        for key, val in items:
+            data = codec.encode(val)
+            fhandle.write(data)
+            locations[encode_key(key)] = (offset, len(data))
+            offset += len(data)
+
+        keys = sorted(locations)
+        keys_offset = offset
+        entries = []
+        for key in keys:
+            fhandle.write(key)
+            val_offset, val_len = locations[key]
+            entries.append(INDEX_ENTRY.pack(offset, len(key), val_offset, val_len))
+            offset += len(key)
+        index_offset = offset
+        fhandle.write(b''.join(entries))
+
+        fhandle.seek(0)
+        fhandle.write(FROZEN_HEADER.pack(FROZEN_MAGIC, len(keys), keys_offset, index_offset))
+    if os.name == 'nt' and os.path.exists(path):
+        os.remove(path)
+    os.rename(tmp_path, path)
+
+class FrozenStore(collections.Mapping):
+    '''
+    Reads a file written by write_frozen through mmap. Lookups binary
+    search the sorted index in place and decode values straight from
+    the mapping, so nothing is loaded up front and every process reading
+    the file shares the operating system's page cache for it.
+
+    Values can be read with any codec, as each record says how it was
+    encoded (see valuecodec).
+    '''
+    concurrent_reads = True
+
+    def __init__(self, filename, flag='r', codec=None):
+        if flag != 'r':
+            raise IOError("Frozen files can only be opened read only")
+        self.path = filename
+        self.codec = get_value_codec(codec)
+        with open(filename, 'rb') as fhandle:
+            self._mmap = mmap.mmap(fhandle.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, count, keys_offset, index_offset = FROZEN_HEADER.unpack_from(self._mmap)
+        if (magic != FROZEN_MAGIC or
+                index_offset + count * INDEX_ENTRY.size != len(self._mmap)):
+            self._mmap.close()
+            raise ValueError("Invalid frozen file: {}".format(filename))
+        self._count = count
+        self._index_offset = index_offset
+        try:
+            self._view = memoryview(self._mmap)
+        except TypeError:
+            # Python 2 mmaps don't export buffers, so slices are copied
+            self._view = self._mmap
+
+    def _entry(self, position):
+        return INDEX_ENTRY.unpack_from(self._mmap, self._index_offset +
+                                       position * INDEX_ENTRY.size)
+
+    def _key_at(self, position):
+        key_offset, key_len, _, _ = self._entry(position)
+        return self._mmap[key_offset:key_offset + key_len]
+
+    def _find(self, key):
+        '''
+        Gets the position of key in the index, or None.
+        '''
+        key = encode_key(key)
+        low, high = 0, self._count
+        while low < high:
+            mid = (low + high) // 2
+            if self._key_at(mid) < key:
+                low = mid + 1
+            else:
+                high = mid
+        if low < self._count and self._key_at(low) == key:
+            return low
+        return None
+
+    def __getitem__(self, key):
+        position = self._find(key)
+        if position is None:
+            raise KeyError(key)
+        _, _, val_offset, val_len = self._entry(position)
+        return self.codec.decode(self._view[val_offset:val_offset + val_len])
+
+    def __contains__(self, key):
+        return self._find(key) is not None
+
+    def __iter__(self):
+        for position in range(self._count):
+            yield self._key_at(position).decode('utf-8')
+
+    def __len__(self):
+        return self._count
+
+    def sync(self):
+        pass # Immutable
+
+    def close(self):
+        if self._mmap is not None:
+            if self._view is not self._mmap:
+                self._view.release()
+            self._mmap.close()
+            self._mmap = None
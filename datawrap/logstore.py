@@ -0,0 +1,297 @@
+import collections
+import os
+import struct
+import threading
+import zlib
+from .valuecodec import get_value_codec
+
+# Record header: crc32 of the rest of the record, key length and value
+# length, where a value length of -1 marks a deleted key
+RECORD_HEADER = struct.Struct('<IIi')
+HINT_MAGIC = b'DWHINT01'
+# Hint header: magic, data file length covered, dead bytes and entry count
+HINT_HEADER = struct.Struct('<8sQQQ')
+# Hint entry: value offset, value length and key length, followed by the key
+HINT_ENTRY = struct.Struct('<QII')
+TOMBSTONE = -1
+
+def get_hint_path(path):
+    return path + '.hint'
+
+def encode_key(key):
+    return key if isinstance(key, bytes) else key.encode('utf-8')
+
+def decode_key(key):
+    return key.decode('utf-8')
+
+def pack_record(key, data):
+    '''
+    Builds the bytes of a record for an encoded key and value, or a
+    deletion marker when data is None.
+    '''
+    vlen = TOMBSTONE if data is None else len(data)
+    lengths = struct.pack('<Ii', len(key), vlen)
+    body = key if data is None else key + data
+    crc = zlib.crc32(body, zlib.crc32(lengths)) & 0xffffffff
+    return struct.pack('<I', crc) + lengths + body
+
+def iter_records(fhandle):
+    '''
+    Reads records from the current position of fhandle, yielding the
+    key, value data (None for a deletion marker) and size of each one up
+    to the first incomplete or corrupt record.
+    '''
+    while True:
+        header = fhandle.read(RECORD_HEADER.size)
+        if len(header) < RECORD_HEADER.size:
+            return
+        crc, klen, vlen = RECORD_HEADER.unpack(header)
+        body = fhandle.read(klen + max(vlen, 0))
+        if (len(body) < klen + max(vlen, 0) or
+                zlib.crc32(body, zlib.crc32(header[4:])) & 0xffffffff != crc):
+            return
+        data = None if vlen == TOMBSTONE else body[klen:]
+        yield decode_key(body[:klen]), data, RECORD_HEADER.size + len(body)
+
+class LogStore(collections.MutableMapping):
+    '''
+    A Bitcask style storage engine. Every write appends a record to a
+    single data file, while an in-memory index maps each key to the
+    offset of its latest value, so reads take one positioned read and
+    flushes are purely sequential writes.
+
+    Overwritten and deleted values stay in the file as dead bytes until
+    compact rewrites it with only the live records. On close (and after
+    compacting) the index is saved in a hint file next to the data file,
+    so opening only has to scan the records appended after the hint was
+    written. Records with a bad checksum at the end of the file, left by
+    a crash mid write, are dropped when opened for writing.
+
+    Values are encoded with codec (see valuecodec). sync flushes the
+    appended records, and also fsyncs them when fsync is set.
+    '''
+    def __init__(self, filename, flag='c', codec=None, fsync=False):
+        self.path = filename
+        self.read_only = flag == 'r'
+        self.codec = get_value_codec(codec)
+        self.fsync = fsync
+        self.dead_bytes = 0
+        # Positioned reads don't share a file offset, so readers can overlap
+        self.concurrent_reads = hasattr(os, 'pread')
+
+        self._index = {}
+        self._lock = threading.RLock()
+        self._writer = None
+        self._read_fd = None
+        if flag == 'n':
+            self._remove_hint()
+            open(self.path, 'wb').close()
+        elif not os.path.exists(self.path):
+            if self.read_only:
+                raise IOError("No log store at {}".format(self.path))
+            open(self.path, 'wb').close()
+        self._end = self._load_index()
+        self._flushed_end = self._end
+        self._open_handles()
+
+    def _open_handles(self):
+        if not self.read_only:
+            if os.path.getsize(self.path) > self._end:
+                # Drop the partial records of an interrupted write
+                with open(self.path, 'r+b') as fhandle:
+                    fhandle.truncate(self._end)
+            self._writer = open(self.path, 'ab')
+        self._read_fd = os.open(self.path, os.O_RDONLY | getattr(os, 'O_BINARY', 0))
+
+    def _close_handles(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        if self._read_fd is not None:
+            os.close(self._read_fd)
+            self._read_fd = None
+
+    def _remove_hint(self):
+        try: os.remove(get_hint_path(self.path))
+        except OSError: pass
+
+    def _load_index(self):
+        '''
+        Rebuilds the index from the hint file, if it's valid, and then
+        the records after it. Returns the end of the last valid record.
+        '''
+        start = self._load_hint()
+        if start is None:
+            self._index = {}
+            self.dead_bytes = 0
+            start = 0
+        return self._scan(start)
+
+    def _load_hint(self):
+        try:
+            with open(get_hint_path(self.path), 'rb') as fhandle:
+                data = fhandle.read()
+        except IOError:
+            return None
+        if len(data) < HINT_HEADER.size + 4:
+            return None
+        body, crc = data[:-4], struct.unpack('<I', data[-4:])[0]
+        magic, data_end, dead_bytes, count = HINT_HEADER.unpack_from(body)
+        if (magic != HINT_MAGIC or zlib.crc32(body) & 0xffffffff != crc or
+                data_end > os.path.getsize(self.path)):
+            return None
+        index = {}
+        pos = HINT_HEADER.size
+        for _ in range(count):
+            offset, vlen, klen = HINT_ENTRY.unpack_from(body, pos)
+            pos += HINT_ENTRY.size
+            index[decode_key(body[pos:pos + klen])] = (offset, vlen)
+            pos += klen
+        self._index = index
+        self.dead_bytes = dead_bytes
+        return data_end
+
+    def _scan(self, offset):
+        '''
+        Indexes the records from offset up to the first incomplete or
+        corrupt record, returning where that record starts.
+        '''
+        with open(self.path, 'rb') as fhandle:
+            fhandle.seek(offset)
+            for key, data, size in iter_records(fhandle):
+                self._replace(key, None if data is None else
+                              (offset + size - len(data), len(data)), size)
+                offset += size
+        return offset
+
+    def _replace(self, key, location, record_size):
+        '''
+        Points key at a new record location, or removes it for a deletion
+        marker, counting whatever it replaced as dead bytes.
+        '''
+        old = self._index.pop(key, None)
+        if old is not None:
+            self.dead_bytes += old[1] + len(encode_key(key)) + RECORD_HEADER.size
+        if location is None:
+            self.dead_bytes += record_size
+        else:
+            self._index[key] = location
+
+    def _append(self, key, data):
+        if self.read_only:
+            raise IOError("Log store {} is read only".format(self.path))
+        key_bytes = encode_key(key)
+        record = pack_record(key_bytes, data)
+        with self._lock:
+            self._writer.write(record)
+            location = None if data is None else (self._end + RECORD_HEADER.size +
+                                                  len(key_bytes), len(data))
+            self._replace(key, location, len(record))
+            self._end += len(record)
+
+    def _flush(self):
+        with self._lock:
+            if self._writer is not None and self._flushed_end < self._end:
+                self._writer.flush()
+                self._flushed_end = self._end
+
+    def _read(self, offset, length):
+        if offset + length > self._flushed_end:
+            self._flush()
+        if self.concurrent_reads:
+            return os.pread(self._read_fd, length, offset)
+        with self._lock:
+            os.lseek(self._read_fd, offset, os.SEEK_SET)
+            return os.read(self._read_fd, length)
+
+    def __getitem__(self, key):
+        offset, length = self._index[key]
+        return self.codec.decode(self._read(offset, length))
+
+    def __setitem__(self, key, val):
+        self._append(key, self.codec.encode(val))
+
+    def __delitem__(self, key):
+        if key not in self._index:
+            raise KeyError(key)
+        self._append(key, None)
+
+    def __contains__(self, key):
+        return key in self._index
+
+    def __iter__(self):
+        return iter(self._index)
+
+    def __len__(self):
+        return len(self._index)
+
+    @property
+    def dead_ratio(self):
+        '''
+        Fraction of the data file taken by overwritten or deleted records.
+        '''
+        return float(self.dead_bytes) / self._end if self._end else 0.0
+
+    def sync(self):
+        self._flush()
+        if self.fsync and self._writer is not None:
+            with self._lock:
+                os.fsync(self._writer.fileno())
+
+    def _write_hint(self):
+        entries = [HINT_HEADER.pack(HINT_MAGIC, self._end, self.dead_bytes, len(self._index))]
+        for key, (offset, vlen) in self._index.items():
+            key_bytes = encode_key(key)
+            entries.append(HINT_ENTRY.pack(offset, vlen, len(key_bytes)))
+            entries.append(key_bytes)
+        body = b''.join(entries)
+        hint_path = get_hint_path(self.path)
+        with open(hint_path + '.tmp', 'wb') as fhandle:
+            fhandle.write(body)
+            fhandle.write(struct.pack('<I', zlib.crc32(body) & 0xffffffff))
+        if os.name == 'nt' and os.path.exists(hint_path):
+            os.remove(hint_path)
+        os.rename(hint_path + '.tmp', hint_path)
+
+    def compact(self):
+        '''
+        Rewrites the data file with only the live records, then swaps it
+        in and saves a fresh hint. The store stays usable throughout,
+        though other calls wait on the rewrite.
+        '''
+        if self.read_only:
+            raise IOError("Log store {} is read only".format(self.path))
+        with self._lock:
+            self._flush()
+            compact_path = self.path + '.compact'
+            index = {}
+            offset = 0
+            with open(compact_path, 'wb') as fhandle:
+                for key, (voffset, vlen) in self._index.items():
+                    key_bytes = encode_key(key)
+                    record = pack_record(key_bytes, self._read(voffset, vlen))
+                    fhandle.write(record)
+                    index[key] = (offset + RECORD_HEADER.size + len(key_bytes), vlen)
+                    offset += len(record)
+                fhandle.flush()
+                if self.fsync:
+                    os.fsync(fhandle.fileno())
+            self._close_handles()
+            # The old hint would point into the replaced file
+            self._remove_hint()
+            if os.name == 'nt':
+                os.remove(self.path)
+            os.rename(compact_path, self.path)
+            self._index = index
+            self._end = self._flushed_end = offset
+            self.dead_bytes = 0
+            self._open_handles()
+            self._write_hint()
+
+    def close(self):
+        if self._read_fd is None:
+            return
+        if not self.read_only:
+            self.sync()
+            self._write_hint()
+        self._close_handles()
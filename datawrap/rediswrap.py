@@ -2,6 +2,7 @@ import collections
 from past.builtins import basestring
 
 from redis import StrictRedis
+from .cachestats import make_cache_stats
 
 DEFAULT_BATCH_SIZE = 1024
 
@@ -24,6 +25,8 @@ class RedisCacheDict(StrictRedis, collections.MutableMapping):
           previously existed at that key in cache.
         - When `sync_cache` is called, any writes to the wrapper that exist in
           cache and have yet to be pushed to Redis are pushed in batch.
+        - `prefetch` and `get_many` fetch every key missing from cache with
+          one round trip per batch instead of one per key.
 
     In addition to raw key/value storage, this wrapper facilitates accessing
     Redis hashes.  To reference a Redis hash entry, index the wrapper with a
@@ -41,11 +44,21 @@ class RedisCacheDict(StrictRedis, collections.MutableMapping):
         - `db`: an *integer* index of the database to bind to
         - `host`: host of the Redis server (defaults to `localhost`)
         - `port`: port of the Redis server (defaults to `6379`)
+
+    Like `UnorderedCachedDict`, passing `collect_stats=True` or any of the
+    `on_miss`, `on_sync_start` and `on_sync_end` hooks makes `stats` return
+    hit, miss and sync counters. The cache is never dropped, so there are
+    no evictions.
     '''
     def __init__(self, value_converter=None, *args, **kwargs):
         self._cache = {}
         self._dirty_keys = set()
         self.converter = value_converter
+        self._stats = make_cache_stats(kwargs.pop('collect_stats', False),
+                                       kwargs.pop('on_miss', None),
+                                       kwargs.pop('on_evict', None),
+                                       kwargs.pop('on_sync_start', None),
+                                       kwargs.pop('on_sync_end', None))
 
         StrictRedis.__init__(self, *args, **kwargs)
 
@@ -54,7 +67,11 @@ class RedisCacheDict(StrictRedis, collections.MutableMapping):
         try:
             val = self._cache[x_key]
             val = val.get(y_key) if y_key else val
+            if self._stats is not None:
+                self._stats.hits += 1
         except KeyError:
+            if self._stats is not None:
+                self._stats.miss(key)
             if y_key:
                 val = self.hgetall(x_key)
                 self._cache[x_key] = val
@@ -64,6 +81,74 @@ class RedisCacheDict(StrictRedis, collections.MutableMapping):
                 self._cache[x_key] = val
         return self.converter(val) if self.converter else val
 
+    def _uncached(self, keys, count_stats=False):
+        '''
+        Gets the (Redis key, is hash) pairs needed to cache keys, each
+        once, counting hits and misses as lookups with count_stats.
+        '''
+        fetches = []
+        scheduled = set()
+        for key in keys:
+            x_key, y_key = self.explode_key(key)
+            if x_key in self._cache or x_key in scheduled:
+                if count_stats and self._stats is not None:
+                    self._stats.hits += 1
+            else:
+                if count_stats and self._stats is not None:
+                    self._stats.miss(key)
+                scheduled.add(x_key)
+                fetches.append((x_key, bool(y_key)))
+        return fetches
+
+    def _fetch(self, fetches, batch_size):
+        '''
+        Caches the values of (Redis key, is hash) pairs with one round
+        trip per batch_size keys: an MGET for plain keys and an HGETALL
+        for each hash, pipelined together.
+        '''
+        for start in range(0, len(fetches), batch_size):
+            batch = fetches[start:start + batch_size]
+            plain = [x_key for x_key, is_hash in batch if not is_hash]
+            hashes = [x_key for x_key, is_hash in batch if is_hash]
+            with self.pipeline(transaction=False) as pipeline:
+                if plain:
+                    pipeline.mget(plain)
+                for x_key in hashes:
+                    pipeline.hgetall(x_key)
+                results = pipeline.execute()
+            if plain:
+                self._cache.update(zip(plain, results[0]))
+                results = results[1:]
+            self._cache.update(zip(hashes, results))
+
+    def prefetch(self, keys, batch_size=DEFAULT_BATCH_SIZE):
+        '''
+        Loads every key which isn't cached yet in one round trip per
+        batch_size keys, rather than one per key on access. Whole hashes
+        are loaded for tuple keys, as __getitem__ does, and cached values
+        are left alone so queued writes are kept.
+        '''
+        self._fetch(self._uncached(keys), batch_size)
+
+    def get_many(self, keys, default=None, batch_size=DEFAULT_BATCH_SIZE):
+        '''
+        Gets the values for all keys as a list in the same order, loading
+        those which aren't cached together (see prefetch). Keys with no
+        value in Redis get default.
+        '''
+        keys = list(keys)
+        self._fetch(self._uncached(keys, count_stats=True), batch_size)
+        vals = []
+        for key in keys:
+            x_key, y_key = self.explode_key(key)
+            val = self._cache[x_key]
+            val = val.get(y_key) if y_key else val
+            if val is None:
+                vals.append(default)
+            else:
+                vals.append(self.converter(val) if self.converter else val)
+        return vals
+
     def __setitem__(self, key, value):
         x_key, y_key = self.explode_key(key)
         if y_key:
@@ -111,20 +196,35 @@ class RedisCacheDict(StrictRedis, collections.MutableMapping):
     def num_queued_writes(self):
         return len(self._dirty_keys)
 
+    def stats(self):
+        stats = self._stats.as_dict() if self._stats is not None else {}
+        stats['cached_entries'] = len(self._cache)
+        return stats
+
     def sync_cache(self, batch_size=DEFAULT_BATCH_SIZE):
+        if self._stats is not None:
+            start = self._stats.sync_started()
+        written = []
         with self.pipeline() as pipeline:
             for i, key in enumerate(self._dirty_keys):
                 x_key, y_key = self.explode_key(key)
 
                 if y_key:
-                    pipeline.hset(x_key, y_key, self._cache[x_key][y_key])
+                    val = self._cache[x_key][y_key]
+                    pipeline.hset(x_key, y_key, val)
                 else:
-                    pipeline.set(x_key, self._cache[x_key])
+                    val = self._cache[x_key]
+                    pipeline.set(x_key, val)
+                if self._stats is not None:
+                    written.append((key, val))
 
                 if i and i % batch_size == 0:
                     pipeline.execute()
             pipeline.execute()
         self._dirty_keys = set()
+        if self._stats is not None:
+            self._stats.flush(written, lambda key, val: len(str(key)) + len(str(val)))
+            self._stats.sync_ended(start)
 
     @staticmethod
     def explode_key(key):
@@ -0,0 +1,218 @@
+import heapq
+import itertools
+import os
+import shutil
+import tempfile
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+# Elements sorted in memory before a run is spilled to disk
+DEFAULT_RUN_SIZE = 100*1024
+# Spilled runs read at once while merging
+DEFAULT_MERGE_WIDTH = 64
+# Elements handed to the target's update at a time
+DEFAULT_BATCH_SIZE = 10*1024
+
+def _read_run(path):
+    with open(path, 'rb') as fhandle:
+        while True:
+            try:
+                yield pickle.load(fhandle)
+            except EOFError:
+                return
+
+def _write_run(path, elems):
+    with open(path, 'wb') as fhandle:
+        for elem in elems:
+            pickle.dump(elem, fhandle, pickle.HIGHEST_PROTOCOL)
+
+def sorted_unique(elems, run_size=DEFAULT_RUN_SIZE, tmp_dir=None,
+                  merge_width=DEFAULT_MERGE_WIDTH):
+    '''
+    Yields elems in sorted order without duplicates while holding at
+    most run_size of them in memory. Larger inputs are sorted in runs
+    which are spilled to temporary files and merged, so elements need
+    to be orderable and picklable. At most merge_width runs are open at
+    once, so more runs are first merged in groups into longer runs.
+    '''
+    if merge_width < 2:
+        raise ValueError("merge_width must be at least 2")
+    elems = iter(elems)
+    chunk = list(itertools.islice(elems, run_size))
+    run = sorted(set(chunk))
+    if len(chunk) < run_size:
+        # Inputs which fit in one run never touch the disk
+        for elem in run:
+            yield elem
+        return
+    run_dir = tempfile.mkdtemp(prefix='setalgebra', dir=tmp_dir)
+    run_names = itertools.count()
+    try:
+        paths = []
+        while run:
+            path = os.path.join(run_dir, str(next(run_names)))
+            _write_run(path, run)
+            paths.append(path)
+            run = sorted(set(itertools.islice(elems, run_size)))
+        # Bounds the files open at once on inputs spilling many runs
+        while len(paths) > merge_width:
+            merged = []
+            for start in range(0, len(paths), merge_width):
+                group = paths[start:start + merge_width]
+                path = os.path.join(run_dir, str(next(run_names)))
+                _write_run(path, _unique(heapq.merge(*[_read_run(run_path) for run_path in group])))
+                for run_path in group:
+                    os.remove(run_path)
+                merged.append(path)
+            paths = merged
+        for elem in _unique(heapq.merge(*[_read_run(path) for path in paths])):
+            yield elem
+    finally:
+        shutil.rmtree(run_dir, ignore_errors=True)
+
+def _unique(sorted_elems):
+    first = True
+    last = None
+    for elem in sorted_elems:
+        if first or elem != last:
+            yield elem
+            first = False
+            last = elem
+
+def merge_union(*streams):
+    '''
+    Merges sorted, unique streams into their sorted union.
+    '''
+    return _unique(heapq.merge(*streams))
+
+def merge_intersection(first, second):
+    '''
+    Yields the elements of two sorted, unique streams found in both.
+    '''
+    first, second = iter(first), iter(second)
+    try:
+        left, right = next(first), next(second)
+        while True:
+            if left < right:
+                left = next(first)
+            elif right < left:
+                right = next(second)
+            else:
+                yield left
+                left, right = next(first), next(second)
+    except StopIteration:
+        return
+
+def merge_difference(first, second):
+    '''
+    Yields the elements of the sorted, unique stream first which aren't
+    in second.
+    '''
+    second = iter(second)
+    try:
+        right = next(second)
+        exhausted = False
+    except StopIteration:
+        right, exhausted = None, True
+    for left in first:
+        while not exhausted and right < left:
+            try:
+                right = next(second)
+            except StopIteration:
+                exhausted = True
+        if exhausted or left != right:
+            yield left
+
+def _partitions(sets):
+    '''
+    Groups the shards of split sets which split their elements the same
+    way, as each shard can then be combined on its own. Any other sets
+    form a single partition.
+    '''
+    try:
+        split_keys = list(sets[0].split_keys)
+        split_func = sets[0].split_func
+        if all(list(s.split_keys) == split_keys and s.split_func == split_func
+               and hasattr(s, '_keyed_db') for s in sets):
+            # Shards are looked up as each partition is reached, as split
+            # sets may only keep some of them open
+            return ([s._keyed_db[skey] for s in sets] for skey in split_keys)
+    except AttributeError:
+        pass
+    return [list(sets)]
+
+def _write(target, elems, batch_size):
+    count = 0
+    while True:
+        batch = list(itertools.islice(elems, batch_size))
+        if not batch:
+            return count
+        target.update(batch)
+        count += len(batch)
+
+def _set_operation(target, sources, combine, run_size, tmp_dir, batch_size):
+    sources = list(sources)
+    if not sources:
+        return 0
+    if any(source is target for source in sources):
+        raise ValueError("The target set can't also be a source")
+    count = 0
+    for partition in _partitions(sources):
+        streams = [sorted_unique(source, run_size, tmp_dir) for source in partition]
+        count += _write(target, combine(streams), batch_size)
+    return count
+
+def _intersect_all(streams):
+    result = streams[0]
+    for stream in streams[1:]:
+        result = merge_intersection(result, stream)
+    return result
+
+def _difference_all(streams):
+    if len(streams) == 1:
+        return streams[0]
+    return merge_difference(streams[0], merge_union(*streams[1:]))
+
+def union_into(target, sources, run_size=DEFAULT_RUN_SIZE, tmp_dir=None,
+               batch_size=DEFAULT_BATCH_SIZE):
+    '''
+    Adds every element of the sources to target, streaming each source
+    through an external sort (see sorted_unique) rather than loading
+    them, and returns how many distinct elements were written.
+    '''
+    return _set_operation(target, sources, lambda streams: merge_union(*streams),
+                          run_size, tmp_dir, batch_size)
+
+def intersection_into(target, sources, run_size=DEFAULT_RUN_SIZE, tmp_dir=None,
+                      batch_size=DEFAULT_BATCH_SIZE):
+    '''
+    Adds the elements found in every source to target, returning how
+    many were written.
+    '''
+    return _set_operation(target, sources, _intersect_all, run_size, tmp_dir, batch_size)
+
+def difference_into(target, sources, run_size=DEFAULT_RUN_SIZE, tmp_dir=None,
+                    batch_size=DEFAULT_BATCH_SIZE):
+    '''
+    Adds the elements of the first source which aren't in any of the
+    others to target, returning how many were written.
+    '''
+    return _set_operation(target, sources, _difference_all, run_size, tmp_dir, batch_size)
+
+class StreamingSetOps(object):
+    '''
+    Adds the streaming set operations to a set class, with the set itself
+    as the first source. Unlike the operators, which look up elements
+    one at a time and build their result in memory, these write straight
+    into target.
+    '''
+    def union_into(self, target, *others, **kwargs):
+        return union_into(target, (self,) + others, **kwargs)
+
+    def intersection_into(self, target, *others, **kwargs):
+        return intersection_into(target, (self,) + others, **kwargs)
+
+    def difference_into(self, target, *others, **kwargs):
+        return difference_into(target, (self,) + others, **kwargs)
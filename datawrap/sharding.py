@@ -0,0 +1,83 @@
+import hashlib
+import os
+import struct
+from .bloomfilter import key_bytes
+
+def key_hash(key):
+    '''
+    Gets a stable 64 bit hash of a key, the same across processes.
+    '''
+    return struct.unpack('<Q', hashlib.md5(key_bytes(key)).digest()[:8])[0]
+
+def jump_hash(key_hash, num_buckets):
+    '''
+    Lamping and Veach's jump consistent hash, mapping a 64 bit hash to
+    one of num_buckets. When num_buckets grows only the keys landing in
+    the new buckets move, and when it shrinks only those which were in
+    the removed buckets do.
+    '''
+    bucket, jump = -1, 0
+    while jump < num_buckets:
+        bucket = jump
+        key_hash = (key_hash * 2862933555777941757 + 1) & 0xFFFFFFFFFFFFFFFF
+        jump = int((bucket + 1) * (float(1 << 31) / float((key_hash >> 33) + 1)))
+    return bucket
+
+def get_shard_count_path(db_name):
+    return db_name + '.shards'
+
+def read_shard_count(db_name):
+    '''
+    Gets the shard count stored for a split database, or None.
+    '''
+    try:
+        with open(get_shard_count_path(db_name), 'r') as fhandle:
+            return int(fhandle.read().strip())
+    except (IOError, OSError, ValueError):
+        return None
+
+def write_shard_count(db_name, num_shards):
+    path = get_shard_count_path(db_name)
+    dir_path = os.path.dirname(os.path.abspath(path))
+    if not os.path.exists(dir_path):
+        os.makedirs(dir_path)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as fhandle:
+        fhandle.write(str(num_shards))
+    if os.name == 'nt' and os.path.exists(path):
+        os.remove(path)
+    os.rename(tmp_path, path)
+
+def remove_shard_count(db_name):
+    try: os.remove(get_shard_count_path(db_name))
+    except OSError: pass
+
+class JumpHashSplitter(object):
+    '''
+    A split_func spreading keys evenly over num_shards shards named 0 to
+    num_shards - 1 (see split_keys) by jump consistent hashing, so that
+    changing the number of shards moves as few keys as possible.
+    '''
+    def __init__(self, num_shards):
+        if num_shards < 1:
+            raise ValueError("num_shards must be at least 1")
+        self.num_shards = num_shards
+
+    @property
+    def split_keys(self):
+        return list(range(self.num_shards))
+
+    def __call__(self, key):
+        return jump_hash(key_hash(key), self.num_shards)
+
+    def __eq__(self, other):
+        return isinstance(other, JumpHashSplitter) and other.num_shards == self.num_shards
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((JumpHashSplitter, self.num_shards))
+
+    def __repr__(self):
+        return 'JumpHashSplitter({})'.format(self.num_shards)
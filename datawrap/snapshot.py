@@ -0,0 +1,154 @@
+import collections
+import mmap
+import os
+import struct
+from .logstore import encode_key
+from .valuecodec import get_value_codec
+
+SNAPSHOT_MAGIC = b'DWSNAP01'
+# Header: magic, entry count and offset of the index
+SNAPSHOT_HEADER = struct.Struct('<8sQQ')
+
+def _pack_lengths(lengths):
+    return struct.pack('<{}I'.format(len(lengths)), *lengths)
+
+def write_snapshot(path, records):
+    '''
+    Writes (key, encoded value) pairs to a snapshot file: the values back
+    to back, then the key lengths, value lengths and keys. The file is
+    written next to path and renamed into place once complete.
+    '''
+    keys = []
+    key_lengths = []
+    val_lengths = []
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as fhandle:
+        fhandle.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, 0, 0))
+        offset = SNAPSHOT_HEADER.size
+        for key, data in records:
+            key = encode_key(key)
+            fhandle.write(data)
+            keys.append(key)
+            key_lengths.append(len(key))
+            val_lengths.append(len(data))
+            offset += len(data)
+        fhandle.write(_pack_lengths(key_lengths))
+        fhandle.write(_pack_lengths(val_lengths))
+        fhandle.write(b''.join(keys))
+        fhandle.seek(0)
+        fhandle.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, len(keys), offset))
+    if os.name == 'nt' and os.path.exists(path):
+        os.remove(path)
+    os.rename(tmp_path, path)
+
+class LazyValue(object):
+    '''
+    Location of a value in a snapshot which hasn't been decoded yet.
+    '''
+    __slots__ = ('offset', 'length')
+
+    def __init__(self, offset, length):
+        self.offset = offset
+        self.length = length
+
+class SnapshotDict(collections.MutableMapping):
+    '''
+    A dictionary loaded from a snapshot file through mmap. Opening only
+    reads the index at the end of the file, while each value is decoded
+    with codec (see valuecodec) the first time it's accessed, so values
+    which are never used are never unpickled.
+
+    The snapshot itself is never changed; new values are held in memory.
+    '''
+    def __init__(self, filename, codec=None):
+        self.path = filename
+        self.codec = get_value_codec(codec)
+        self._data = {}
+        with open(filename, 'rb') as fhandle:
+            self._mmap = mmap.mmap(fhandle.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            self._view = memoryview(self._mmap)
+        except TypeError:
+            # Python 2 mmaps don't export buffers, so slices are copied
+            self._view = self._mmap
+        try:
+            self._load_index()
+        except (ValueError, struct.error):
+            self.close()
+            raise ValueError("Invalid snapshot file: {}".format(filename))
+
+    def _load_index(self):
+        magic, count, index_offset = SNAPSHOT_HEADER.unpack_from(self._mmap)
+        if magic != SNAPSHOT_MAGIC:
+            raise ValueError(magic)
+        lengths_format = '<{}I'.format(count)
+        key_lengths = struct.unpack_from(lengths_format, self._mmap, index_offset)
+        val_lengths = struct.unpack_from(lengths_format, self._mmap, index_offset + 4 * count)
+        keys = self._mmap[index_offset + 8 * count:]
+        data = self._data
+        key_offset = 0
+        val_offset = SNAPSHOT_HEADER.size
+        for key_len, val_len in zip(key_lengths, val_lengths):
+            data[keys[key_offset:key_offset + key_len].decode('utf-8')] = LazyValue(
+                val_offset, val_len)
+            key_offset += key_len
+            val_offset += val_len
+        if key_offset != len(keys) or val_offset != index_offset:
+            raise ValueError(index_offset)
+
+    def _decode(self, lazy):
+        return self.codec.decode(self._view[lazy.offset:lazy.offset + lazy.length])
+
+    def __getitem__(self, key):
+        val = self._data[key]
+        if val.__class__ is LazyValue:
+            # Replacing the value keeps iterations over the keys valid
+            val = self._data[key] = self._decode(val)
+        return val
+
+    def __setitem__(self, key, val):
+        self._data[key] = val
+
+    def __delitem__(self, key):
+        del self._data[key]
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __iter__(self):
+        return iter(self._data)
+
+    def __len__(self):
+        return len(self._data)
+
+    def encoded_items(self, codec=None):
+        '''
+        Yields each key with its value encoded by codec, copying values
+        which haven't been decoded straight from the snapshot.
+        '''
+        codec = get_value_codec(codec)
+        for key, val in self._data.items():
+            if val.__class__ is LazyValue:
+                yield key, bytes(self._view[val.offset:val.offset + val.length])
+            else:
+                yield key, codec.encode(val)
+
+    def load_all(self):
+        '''
+        Decodes every value still in the snapshot, after which the file
+        is no longer needed.
+        '''
+        for key in self._data:
+            self[key]
+
+    def close(self):
+        self._data = {}
+        if self._mmap is not None:
+            if self._view is not self._mmap:
+                self._view.release()
+            try:
+                self._mmap.close()
+            except BufferError:
+                # A caller still holds a view, so leave it to be collected
+                pass
+            self._mmap = None
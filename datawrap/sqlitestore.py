@@ -0,0 +1,157 @@
+import collections
+import os
+import sqlite3
+import threading
+from .valuecodec import get_value_codec
+
+# Files sqlite keeps next to the database in WAL mode
+WAL_SUFFIXES = ('-wal', '-shm')
+
+class SqliteStore(collections.MutableMapping):
+    '''
+    A database file backed by sqlite in WAL mode, storing each value
+    encoded with codec (see valuecodec) in a table keyed by its string key.
+
+    Single writes are committed as they happen, while set_many and
+    delete_many (which cached wrappers use to write back their caches)
+    run as one executemany transaction. Each thread reads through its
+    own connection, so reads run concurrently with each other and with
+    writes, and contains and len are index lookups rather than scans.
+    The index also keeps keys sorted, so iter_range scans them in order.
+    '''
+    def __init__(self, filename, flag='c', codec=None):
+        self.path = filename
+        self.read_only = flag == 'r'
+        self.codec = get_value_codec(codec)
+        self.concurrent_reads = True
+
+        if flag == 'n':
+            for path in (self.path,) + tuple(self.path + suffix for suffix in WAL_SUFFIXES):
+                try: os.remove(path)
+                except OSError: pass
+        elif self.read_only and not os.path.exists(self.path):
+            raise IOError("No sqlite database at {}".format(self.path))
+
+        self._lock = threading.RLock()
+        self._local = threading.local()
+        self._readers = []
+        self._conn = self._connect()
+        if not self.read_only:
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            # WAL stays consistent through crashes without syncing every commit
+            self._conn.execute('PRAGMA synchronous=NORMAL')
+            self._conn.execute('CREATE TABLE IF NOT EXISTS data '
+                               '(key TEXT PRIMARY KEY, value BLOB NOT NULL)')
+
+    def _connect(self):
+        # Autocommit, with batches wrapped in explicit transactions
+        return sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+
+    def _reader(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+            with self._lock:
+                self._readers.append(conn)
+        return conn
+
+    def _check_writable(self):
+        if self.read_only:
+            raise IOError("Sqlite database {} is read only".format(self.path))
+
+    def __getitem__(self, key):
+        row = self._reader().execute('SELECT value FROM data WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            raise KeyError(key)
+        return self.codec.decode(bytes(row[0]))
+
+    def __setitem__(self, key, val):
+        self._check_writable()
+        data = sqlite3.Binary(self.codec.encode(val))
+        with self._lock:
+            self._conn.execute('INSERT OR REPLACE INTO data (key, value) VALUES (?, ?)',
+                               (key, data))
+
+    def __delitem__(self, key):
+        self._check_writable()
+        with self._lock:
+            cursor = self._conn.execute('DELETE FROM data WHERE key = ?', (key,))
+        if cursor.rowcount == 0:
+            raise KeyError(key)
+
+    def _transaction(self, statement, rows):
+        self._check_writable()
+        with self._lock:
+            self._conn.execute('BEGIN')
+            try:
+                self._conn.executemany(statement, rows)
+            except:
+                self._conn.execute('ROLLBACK')
+                raise
+            self._conn.execute('COMMIT')
+
+    def set_many(self, items):
+        '''
+        Writes every (key, value) pair in a single transaction.
+        '''
+        encode = self.codec.encode
+        self._transaction('INSERT OR REPLACE INTO data (key, value) VALUES (?, ?)',
+                          ((key, sqlite3.Binary(encode(val))) for key, val in items))
+
+    def delete_many(self, keys):
+        '''
+        Deletes every key in a single transaction, ignoring missing keys.
+        '''
+        self._transaction('DELETE FROM data WHERE key = ?', ((key,) for key in keys))
+
+    def __contains__(self, key):
+        return self._reader().execute('SELECT 1 FROM data WHERE key = ?',
+                                      (key,)).fetchone() is not None
+
+    def __iter__(self):
+        return (row[0] for row in self._reader().execute('SELECT key FROM data'))
+
+    def __len__(self):
+        return self._reader().execute('SELECT COUNT(*) FROM data').fetchone()[0]
+
+    def iter_range(self, start=None, stop=None, reverse=False):
+        '''
+        Iterates the keys from start (inclusive) to stop (exclusive) in
+        sorted order using the primary key index. Either bound can be
+        None to leave that end open.
+        '''
+        clauses = []
+        params = []
+        if start is not None:
+            clauses.append('key >= ?')
+            params.append(start)
+        if stop is not None:
+            clauses.append('key < ?')
+            params.append(stop)
+        query = 'SELECT key FROM data'
+        if clauses:
+            query += ' WHERE ' + ' AND '.join(clauses)
+        query += ' ORDER BY key DESC' if reverse else ' ORDER BY key'
+        return (row[0] for row in self._reader().execute(query, params))
+
+    def sync(self):
+        pass # Every write is already committed
+
+    def compact(self):
+        '''
+        Checkpoints the write ahead log and rebuilds the database file.
+        '''
+        self._check_writable()
+        with self._lock:
+            self._conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+            self._conn.execute('VACUUM')
+
+    def close(self):
+        with self._lock:
+            for conn in self._readers:
+                conn.close()
+            self._readers = []
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+        self._local = threading.local()
@@ -0,0 +1,146 @@
+import marshal
+import shelve
+import struct
+import zlib
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+try:
+    import lzma
+except ImportError:
+    lzma = None
+
+# Records starting with a byte in this range carry a codec tag. No pickle
+# starts with one, so untagged records are read as plain (shelve) pickles.
+TAG_BASE = 0xD0
+TAG_MASK = 0xF0
+
+SERIALIZERS = ('pickle', 'marshal')
+COMPRESSIONS = (None, 'zlib', 'lzma')
+
+class ValueCodec(object):
+    '''
+    Encodes database values as bytes. Values are serialized with pickle
+    (at protocol, or the shelve default) or marshal, and serialized values
+    of at least compress_threshold bytes are compressed with zlib or lzma.
+
+    Marshal is faster than pickle but only handles builtin types. Pickled
+    values which weren't compressed are stored untagged, exactly as
+    shelve stores them. Every other record starts with a one byte tag
+    naming its serializer and compression, so any codec can read any
+    record and reopening with a different codec only changes new writes.
+    '''
+    def __init__(self, serializer='pickle', protocol=None, compression=None,
+                 compress_level=None, compress_threshold=1024):
+        if serializer not in SERIALIZERS:
+            raise ValueError("Unknown serializer: {}".format(serializer))
+        if compression not in COMPRESSIONS:
+            raise ValueError("Unknown compression: {}".format(compression))
+        if compression == 'lzma' and lzma is None:
+            raise ValueError("lzma compression isn't available")
+        self.serializer = serializer
+        self.protocol = protocol
+        self.compression = compression
+        self.compress_level = compress_level
+        self.compress_threshold = compress_threshold
+        self._protocol = protocol if protocol is not None else getattr(
+            shelve, 'DEFAULT_PROTOCOL', pickle.HIGHEST_PROTOCOL)
+
+    def __repr__(self):
+        return 'ValueCodec({!r}, protocol={!r}, compression={!r})'.format(
+            self.serializer, self.protocol, self.compression)
+
+    def _compress(self, data):
+        if self.compression == 'zlib':
+            if self.compress_level is None:
+                return zlib.compress(data)
+            return zlib.compress(data, self.compress_level)
+        return lzma.compress(data, preset=self.compress_level)
+
+    def encode(self, val):
+        if self.serializer == 'pickle':
+            data = pickle.dumps(val, self._protocol)
+        else:
+            data = marshal.dumps(val)
+        compression = None
+        if self.compression and len(data) >= self.compress_threshold:
+            compressed = self._compress(data)
+            # Incompressible values are kept as they are
+            if len(compressed) < len(data):
+                data = compressed
+                compression = self.compression
+        if self.serializer == 'pickle' and compression is None:
+            return data
+        tag = (TAG_BASE | COMPRESSIONS.index(compression) << 1 |
+               SERIALIZERS.index(self.serializer))
+        return struct.pack('B', tag) + data
+
+    def decode(self, data):
+        tag = bytearray(data[:1])[0] if data else 0
+        if tag & TAG_MASK != TAG_BASE:
+            return pickle.loads(data)
+        return decode_tagged(tag, bytes(data[1:]))
+
+def decode_tagged(tag, data):
+    compression = COMPRESSIONS[(tag >> 1) & 0x07]
+    if compression == 'zlib':
+        data = zlib.decompress(data)
+    elif compression == 'lzma':
+        if lzma is None:
+            raise ValueError("lzma compression isn't available")
+        data = lzma.decompress(data)
+    if SERIALIZERS[tag & 0x01] == 'marshal':
+        return marshal.loads(data)
+    return pickle.loads(data)
+
+# Named codecs accepted wherever a codec can be given
+NAMED_CODECS = {
+    'pickle': {},
+    'pickle-highest': {'protocol': pickle.HIGHEST_PROTOCOL},
+    'marshal': {'serializer': 'marshal'},
+    'zlib': {'protocol': pickle.HIGHEST_PROTOCOL, 'compression': 'zlib'},
+    'lzma': {'protocol': pickle.HIGHEST_PROTOCOL, 'compression': 'lzma'},
+    'marshal-zlib': {'serializer': 'marshal', 'compression': 'zlib'}
+}
+
+def get_value_codec(codec):
+    '''
+    Builds a ValueCodec from either a name in NAMED_CODECS, a ValueCodec
+    or None for the shelve compatible default.
+    '''
+    if codec is None:
+        return ValueCodec()
+    if isinstance(codec, ValueCodec):
+        return codec
+    try:
+        return ValueCodec(**NAMED_CODECS[codec.lower()])
+    except (KeyError, AttributeError):
+        raise ValueError("Unknown value codec: {}".format(codec))
+
+class CodecShelf(shelve.DbfilenameShelf):
+    '''
+    A dbm backed shelf which stores its values with a ValueCodec. The
+    underlying dbm modules aren't safe for concurrent reads, so cached
+    wrappers serialize their read pools on it.
+    '''
+    concurrent_reads = False
+
+    def __init__(self, filename, flag='c', codec=None):
+        shelve.DbfilenameShelf.__init__(self, filename, flag)
+        self.codec = get_value_codec(codec)
+
+    def _encode_key(self, key):
+        keyencoding = getattr(self, 'keyencoding', None)
+        return key.encode(keyencoding) if keyencoding else key
+
+    def __getitem__(self, key):
+        return self.codec.decode(self.dict[self._encode_key(key)])
+
+    def __setitem__(self, key, val):
+        self.dict[self._encode_key(key)] = self.codec.encode(val)
+
+    def compact(self):
+        # Only gdbm can give back the space of deleted values
+        if hasattr(self.dict, 'reorganize'):
+            self.dict.reorganize()
@@ -0,0 +1,158 @@
+import threading
+import time
+import weakref
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+# Marks the end of the batches for the writer thread
+_STOP = object()
+
+class NullLock(object):
+    '''
+    Stands in for a lock when there are no background threads to guard
+    against, so the locked sections cost next to nothing.
+    '''
+    def __enter__(self):
+        return self
+
+    def __exit__(self, etype, value, traceback):
+        return False
+
+NULL_LOCK = NullLock()
+
+def weak_method(obj, name):
+    '''
+    Wraps a method without keeping its object alive. Calls return None
+    once the object has been collected.
+    '''
+    ref = weakref.ref(obj)
+    def call(*args, **kwargs):
+        target = ref()
+        if target is None:
+            return None
+        return getattr(target, name)(*args, **kwargs)
+    return call
+
+class WriteBehindWriter(object):
+    '''
+    Background thread which writes batches of dirty cache entries to a
+    database so that the thread handing them off doesn't wait on the I/O.
+
+    Handed off entries stay in pending until they're written, so reads
+    can still find them. At most max_batches batches are queued before
+    hand_off blocks, which bounds both the memory held in pending and how
+    far the database can fall behind. Every interval seconds the writer
+    also calls stage_func, which should move any other dirty entries into
+    pending and return their keys, so idle caches still get flushed.
+
+    Each batch is written with the database's set_many when it has one.
+    lock guards pending (and whatever the owner stages with it), while
+    database_lock serializes database access with the owner's thread.
+    The first error raised while writing is re-raised by flush or stop.
+    '''
+    def __init__(self, database, interval=1.0, max_batches=4, stage_func=None):
+        self.lock = threading.RLock()
+        self.database_lock = threading.RLock()
+        self.pending = {}
+        self.interval = interval
+        self.error = None
+
+        self._database = database
+        self._stage_func = stage_func
+        self._batches = queue.Queue(max_batches)
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name='WriteBehindWriter')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        last_stage = time.time()
+        while not self._stopped:
+            try:
+                keys = self._batches.get(timeout=self.interval)
+            except queue.Empty:
+                pass
+            else:
+                try:
+                    if keys is _STOP:
+                        return
+                    self._write(keys)
+                finally:
+                    self._batches.task_done()
+            if self._stage_func and time.time() - last_stage >= self.interval:
+                last_stage = time.time()
+                self._write(self._stage_func() or ())
+
+    def _write(self, keys):
+        try:
+            with self.database_lock:
+                # Deletes and newer hand offs replace what's pending
+                with self.lock:
+                    items = [(key, self.pending[key]) for key in keys
+                             if self.pending.get(key) is not None]
+                if hasattr(self._database, 'set_many'):
+                    self._database.set_many(items)
+                else:
+                    for key, val in items:
+                        self._database[key] = val
+                self._database.sync()
+            with self.lock:
+                for key, val in items:
+                    if self.pending.get(key) is val:
+                        del self.pending[key]
+        except Exception as e:
+            # Entries stay pending, so reads remain correct until this is raised
+            if self.error is None:
+                self.error = e
+
+    def _raise_error(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def hand_off(self, items):
+        '''
+        Queues (key, value) pairs to be written. Blocks while the queue
+        of batches is full, so it must not be called holding lock.
+        '''
+        items = list(items)
+        if items:
+            with self.lock:
+                self.pending.update(items)
+            self._batches.put([key for key, _ in items])
+
+    def flush(self):
+        '''
+        Waits for every queued batch to be written and synced.
+        '''
+        self._batches.join()
+        with self.database_lock:
+            self._database.sync()
+        self._raise_error()
+
+    def _drain(self):
+        while True:
+            try:
+                keys = self._batches.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                if keys is not _STOP:
+                    self._write(keys)
+            finally:
+                self._batches.task_done()
+
+    def stop(self):
+        '''
+        Writes everything still queued and stops the thread.
+        '''
+        if threading.current_thread() is self._thread:
+            # The owner was collected from our own thread, so we can't join
+            self._drain()
+            self._stopped = True
+        else:
+            self._batches.put(_STOP)
+            self._thread.join()
+        self._raise_error()
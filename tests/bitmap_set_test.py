@@ -0,0 +1,153 @@
+# This import fixes sys.path issues
+from . import parentpath
+
+from datawrap import filedbwrap, bitmapset
+from datawrap.bitmapset import RoaringBitmap
+import unittest
+import os
+import shutil
+from os.path import dirname
+
+class RoaringBitmapTest(unittest.TestCase):
+    def setUp(self):
+        self.data_dir = os.path.join(dirname(__file__), 'bitmap_set')
+        if not os.path.exists(self.data_dir):
+            os.makedirs(self.data_dir)
+        self.path = os.path.join(self.data_dir, 'bitmap.fdbm')
+
+    def tearDown(self):
+        shutil.rmtree(self.data_dir)
+
+    def test_add_and_contains(self):
+        bitmap = RoaringBitmap([5, 1 << 40, 70000])
+        bitmap.add(3)
+        bitmap.add(3)
+        self.assertEqual(len(bitmap), 4)
+        self.assertEqual(list(bitmap), [3, 5, 70000, 1 << 40])
+        self.assertIn(70000, bitmap)
+        self.assertNotIn(4, bitmap)
+        self.assertNotIn(-1, bitmap)
+        self.assertNotIn('a', bitmap)
+        self.assertRaises(ValueError, bitmap.add, -1)
+        bitmap.discard(5)
+        bitmap.discard(6)
+        self.assertEqual(list(bitmap), [3, 70000, 1 << 40])
+
+    def test_containers_convert(self):
+        bitmap = RoaringBitmap()
+        bitmap.update(range(0, 20000, 2))
+        self.assertIsInstance(bitmap._containers[0], bitmapset.BitmapContainer)
+        self.assertEqual(len(bitmap), 10000)
+        for value in range(0, 20000, 2):
+            bitmap.discard(value)
+            if len(bitmap) == bitmapset.ARRAY_MAX:
+                self.assertIsInstance(bitmap._containers[0], bitmapset.ArrayContainer)
+        self.assertEqual(len(bitmap), 0)
+        self.assertEqual(bitmap._containers, {})
+
+        bitmap = RoaringBitmap()
+        for value in range(bitmapset.ARRAY_MAX + 1):
+            bitmap.add(value)
+        self.assertIsInstance(bitmap._containers[0], bitmapset.BitmapContainer)
+        self.assertEqual(list(bitmap), list(range(bitmapset.ARRAY_MAX + 1)))
+
+    def test_chunked_update(self):
+        chunk_size = bitmapset.UPDATE_CHUNK_SIZE
+        bitmapset.UPDATE_CHUNK_SIZE = 100
+        try:
+            bitmap = RoaringBitmap(iter(range(0, 30000, 3)))
+            bitmap.update((value for value in range(1, 150000, 5)), [7])
+        finally:
+            bitmapset.UPDATE_CHUNK_SIZE = chunk_size
+        self.assertEqual(set(bitmap),
+                         set(range(0, 30000, 3)) | set(range(1, 150000, 5)) | set([7]))
+        self.assertIsInstance(bitmap._containers[0], bitmapset.BitmapContainer)
+
+    def test_set_algebra(self):
+        evens = set(range(0, 200000, 2))
+        sparse = set(range(0, 300000, 7))
+        first, second = RoaringBitmap(evens), RoaringBitmap(sparse)
+        self.assertEqual(set(first & second), evens & sparse)
+        self.assertEqual(set(first | second), evens | sparse)
+        self.assertEqual(set(first - second), evens - sparse)
+        self.assertEqual(set(first ^ second), evens ^ sparse)
+        self.assertEqual(set(first & [2, 3, 4]), set([2, 4]))
+        self.assertEqual(set(set([1, 2]) - RoaringBitmap([2])), set([1]))
+        self.assertEqual(set(first.intersection(second, [0, 14, 15])), set([0, 14]))
+        first -= second
+        self.assertEqual(len(first), len(evens - sparse))
+        # Results don't share containers with their inputs
+        union = second | RoaringBitmap()
+        union.add(1)
+        self.assertNotIn(1, second)
+
+    def test_save_and_load(self):
+        values = set(range(0, 100000, 3)) | set([1 << 33, 5])
+        RoaringBitmap(values).save(self.path)
+        bitmap = RoaringBitmap.load(self.path)
+        self.assertEqual(set(bitmap), values)
+        self.assertIn(99999, bitmap)
+        self.assertNotIn(1, bitmap)
+        bitmap.add(1)
+        bitmap.discard(99999)
+        bitmap.save(self.path)
+        bitmap.close()
+        self.assertEqual(set(bitmap), (values | set([1])) - set([99999]))
+        reloaded = RoaringBitmap.load(self.path)
+        self.assertEqual(set(reloaded), set(bitmap))
+        reloaded.close()
+
+        with open(self.path, 'r+b') as fhandle:
+            fhandle.write(b'corrupt!')
+        self.assertRaises(ValueError, RoaringBitmap.load, self.path)
+
+class BitmapFileSetTest(unittest.TestCase):
+    def setUp(self):
+        self.data_dir = os.path.join(dirname(__file__), 'bitmap_file')
+        self.db_name = os.path.join(self.data_dir, 'ids')
+
+    def tearDown(self):
+        shutil.rmtree(self.data_dir)
+
+    def test_persists(self):
+        fset = filedbwrap.BitmapFileSet(self.db_name, clear=True)
+        fset.update(range(50000), ['70000'])
+        fset.add('123456')
+        self.assertIn('123456', fset)
+        self.assertIn(70000, fset)
+        self.assertNotIn('abc', fset)
+        # Numbers are only members when they're integral
+        self.assertNotIn(1.7, fset)
+        self.assertIn(2.0, fset)
+        self.assertRaises(ValueError, fset.add, 1.5)
+        fset.reopen()
+        self.assertEqual(len(fset), 50002)
+        self.assertIn(123456, fset)
+        fset.discard(0)
+        fset.reopen(read_only=True)
+        self.assertNotIn(0, fset)
+        self.assertRaises(AttributeError, fset.add, 1)
+        self.assertRaises(AttributeError, fset.discard, 1)
+        fset.clear(read_only=False)
+        self.assertEqual(len(fset), 0)
+        fset.close(delete_file=True)
+        self.assertFalse(os.path.exists(self.db_name + '.fdbm'))
+
+    def test_set_algebra(self):
+        to_int = lambda elem: int(elem.split('-')[1]) if isinstance(elem, str) else elem
+        first = filedbwrap.BitmapFileSet(self.db_name, clear=True, int_func=to_int)
+        second = filedbwrap.BitmapFileSet(self.db_name + '2', clear=True)
+        first.update(['id-1', 'id-2', 'id-3'])
+        second.update([2, 3, 4])
+        self.assertIn('id-2', first)
+        self.assertEqual(set(first & second), set([2, 3]))
+        self.assertEqual(set(first | second), set([1, 2, 3, 4]))
+        self.assertEqual(set(first - ['id-1']), set([2, 3]))
+        first -= second
+        first.reopen()
+        self.assertEqual(set(first), set([1]))
+        first.close(delete_file=True)
+        second.close(delete_file=True)
+
+if __name__ == '__main__':
+    unittest.main()
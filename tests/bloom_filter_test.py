@@ -0,0 +1,108 @@
+# This import fixes sys.path issues
+from . import parentpath
+
+from datawrap import bloomfilter, filedbwrap
+import unittest
+import os
+import shutil
+from os.path import dirname
+
+class BloomFilterTest(unittest.TestCase):
+    def setUp(self):
+        self.data_dir = os.path.join(dirname(__file__), 'bloom_filter')
+        if not os.path.exists(self.data_dir):
+            os.makedirs(self.data_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.data_dir)
+
+    def test_no_false_negatives(self):
+        bloom = bloomfilter.BloomFilter(1000, 0.01)
+        bloom.update(str(i) for i in range(1000))
+        for i in range(1000):
+            self.assertIn(str(i), bloom)
+        self.assertFalse(bloom.saturated)
+
+    def test_repeated_keys_not_counted(self):
+        bloom = bloomfilter.BloomFilter(100, 0.01)
+        for _ in range(5):
+            bloom.update(str(i) for i in range(80))
+        self.assertLessEqual(len(bloom), 80)
+        self.assertGreater(len(bloom), 70)
+        self.assertFalse(bloom.saturated)
+
+    def test_false_positive_rate(self):
+        bloom = bloomfilter.BloomFilter(1000, 0.01)
+        bloom.update(range(1000))
+        false_positives = sum(1 for i in range(1000, 11000) if i in bloom)
+        self.assertLess(false_positives, 300)
+
+    def test_save_load(self):
+        path = os.path.join(self.data_dir, 'keys.bloom')
+        bloom = bloomfilter.BloomFilter(100)
+        bloom.update(['a', u'b', b'c', 4])
+        bloom.save(path)
+        loaded = bloomfilter.BloomFilter.load(path)
+        self.assertEqual(loaded.num_bits, bloom.num_bits)
+        self.assertEqual(len(loaded), 4)
+        for key in ['a', u'b', b'c', 4]:
+            self.assertIn(key, loaded)
+
+    def test_load_invalid(self):
+        path = os.path.join(self.data_dir, 'bad.bloom')
+        with open(path, 'wb') as fhandle:
+            fhandle.write(b'not a bloom filter')
+        self.assertRaises(ValueError, bloomfilter.BloomFilter.load, path)
+
+class FileBloomFilterTest(unittest.TestCase):
+    def setUp(self):
+        self.data_dir = os.path.join(dirname(__file__), 'file_bloom')
+        if not os.path.exists(self.data_dir):
+            os.makedirs(self.data_dir)
+        self.db_path = os.path.join(self.data_dir, 'bloom')
+
+    def tearDown(self):
+        shutil.rmtree(self.data_dir)
+
+    def test_misses_skip_database(self):
+        fdict = filedbwrap.FileDict(self.db_path, clear=True, use_bloom_filter=True)
+        fdict['a'] = 1
+        self.assertNotIn('missing', fdict)
+        self.assertIsNone(fdict.get('missing'))
+        # Rejected misses aren't cached
+        self.assertNotIn('missing', fdict.get_cache())
+        self.assertEqual(fdict['a'], 1)
+        fdict.close(delete_file=True)
+        self.assertFalse(os.path.exists(filedbwrap.get_bloom_path(fdict._db_full_path)))
+
+    def test_persists_across_reopen(self):
+        fdict = filedbwrap.FileDict(self.db_path, clear=True, use_bloom_filter=True)
+        fdict.update((str(i), i) for i in range(50))
+        bloom_path = filedbwrap.get_bloom_path(fdict._db_full_path)
+        # Writable databases only save the filter on close
+        self.assertFalse(os.path.exists(bloom_path))
+        fdict.close()
+        self.assertTrue(os.path.exists(bloom_path))
+
+        fdict = filedbwrap.FileDict(self.db_path, read_only=True, use_bloom_filter=True)
+        self.assertEqual(len(fdict._bloom), 50)
+        self.assertEqual(fdict['49'], 49)
+        self.assertNotIn('50', fdict)
+        fdict.close()
+
+    def test_rebuilds_stale_filter(self):
+        fdict = filedbwrap.FileDict(self.db_path, clear=True, use_bloom_filter=True)
+        fdict['a'] = 1
+        fdict.close()
+        # Writing without the filter discards the saved one
+        fdict = filedbwrap.FileDict(self.db_path)
+        fdict['b'] = 2
+        fdict.close()
+        fdict = filedbwrap.FileDict(self.db_path, use_bloom_filter=True)
+        self.assertEqual(fdict['b'], 2)
+        fdict.clear()
+        self.assertNotIn('b', fdict._bloom)
+        fdict.close(delete_file=True)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,229 @@
+# This import fixes sys.path issues
+from . import parentpath
+
+from datawrap import cachepolicy, filedbwrap
+import unittest
+import os
+import shutil
+from os.path import dirname
+
+class LRUPolicyTest(unittest.TestCase):
+    def test_victims_least_recent(self):
+        policy = cachepolicy.LRUPolicy(3)
+        for key in 'abc':
+            policy.insert(key)
+        policy.access('a')
+        self.assertEqual(policy.victims(2), ['b', 'c'])
+        self.assertEqual(len(policy), 1)
+
+    def test_remove(self):
+        policy = cachepolicy.LRUPolicy(3)
+        policy.insert('a')
+        policy.remove('a')
+        policy.remove('missing')
+        self.assertEqual(policy.victims(1), [])
+
+class ClockPolicyTest(unittest.TestCase):
+    def test_second_chance(self):
+        policy = cachepolicy.ClockPolicy(3)
+        for key in 'abc':
+            policy.insert(key)
+        policy.access('a')
+        policy.access('b')
+        self.assertEqual(policy.victims(1), ['c'])
+        # All remaining keys were referenced, so the hand clears them and comes around
+        self.assertEqual(policy.victims(1), ['a'])
+
+    def test_victims_bounded(self):
+        policy = cachepolicy.ClockPolicy(2)
+        policy.insert('a')
+        policy.access('a')
+        self.assertEqual(policy.victims(5), ['a'])
+
+class SegmentedLRUPolicyTest(unittest.TestCase):
+    def test_probation_evicted_first(self):
+        policy = cachepolicy.SegmentedLRUPolicy(4)
+        for key in 'abcd':
+            policy.insert(key)
+        policy.access('a')
+        self.assertEqual(policy.victims(3), ['b', 'c', 'd'])
+        self.assertEqual(policy.victims(1), ['a'])
+
+    def test_protected_demotion(self):
+        policy = cachepolicy.SegmentedLRUPolicy(2, protected_ratio=0.5)
+        policy.insert('a')
+        policy.insert('b')
+        policy.access('a')
+        policy.access('b')
+        # 'a' was demoted when 'b' was promoted past the protected capacity
+        self.assertEqual(policy.victims(1), ['a'])
+
+class EvictionPolicyLookupTest(unittest.TestCase):
+    def test_names(self):
+        self.assertIsNone(cachepolicy.get_eviction_policy(None, 10))
+        self.assertIsInstance(cachepolicy.get_eviction_policy('CLOCK', 10),
+                              cachepolicy.ClockPolicy)
+        self.assertIsInstance(cachepolicy.get_eviction_policy(cachepolicy.LRUPolicy, 10),
+                              cachepolicy.LRUPolicy)
+        self.assertRaises(ValueError, cachepolicy.get_eviction_policy, 'random', 10)
+
+class FileDictEvictionTest(unittest.TestCase):
+    def setUp(self):
+        self.data_dir = os.path.join(dirname(__file__), 'cache_policy')
+        if not os.path.exists(self.data_dir):
+            os.makedirs(self.data_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.data_dir)
+
+    def test_hot_keys_survive_overflow(self):
+        for policy in ('lru', 'clock', 'slru'):
+            fdict = filedbwrap.FileDict(os.path.join(self.data_dir, policy), clear=True,
+                                        cache_size=8, eviction_policy=policy,
+                                        eviction_batch=2)
+            fdict['hot'] = 'value'
+            for i in range(20):
+                fdict['hot']
+                fdict[str(i)] = i
+            self.assertIn('hot', fdict.get_cache())
+            self.assertLessEqual(len(fdict.get_cache()), 8)
+            self.assertEqual(len(fdict), 21)
+            fdict.reopen()
+            self.assertEqual(fdict['hot'], 'value')
+            self.assertEqual(fdict['19'], 19)
+            fdict.close(delete_file=True)
+
+    def test_delete_updates_size(self):
+        fdict = filedbwrap.FileDict(os.path.join(self.data_dir, 'delete'), clear=True,
+                                    cache_size=4, cache_misses=False, eviction_policy='lru')
+        for i in range(4):
+            fdict[str(i)] = i
+        del fdict['0']
+        self.assertEqual(fdict._cur_size, 3)
+        fdict.close(delete_file=True)
+
+class CacheBytesTest(unittest.TestCase):
+    def setUp(self):
+        self.data_dir = os.path.join(dirname(__file__), 'cache_bytes')
+        if not os.path.exists(self.data_dir):
+            os.makedirs(self.data_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.data_dir)
+
+    def test_estimate_size(self):
+        small = cachepolicy.estimate_size('key', 'v')
+        self.assertGreater(cachepolicy.estimate_size('key', 'v' * 1000), small + 900)
+        self.assertGreater(cachepolicy.estimate_size('key', ['v' * 1000]), small + 900)
+
+    def test_block_sync_on_bytes(self):
+        fdict = filedbwrap.FileDict(os.path.join(self.data_dir, 'block'), clear=True,
+                                    cache_bytes=100, size_estimator=lambda key, val: len(val))
+        fdict['a'] = 'x' * 60
+        self.assertEqual(fdict._cur_bytes, 60)
+        fdict['b'] = 'x' * 60
+        # Block rejection syncs and drops everything once over budget
+        self.assertEqual(fdict._cur_bytes, 0)
+        self.assertEqual(len(fdict.get_cache()), 0)
+        self.assertEqual(fdict['a'], 'x' * 60)
+        self.assertNotIn('missing', fdict)
+        self.assertEqual(fdict._cur_bytes, 60)
+        fdict.close(delete_file=True)
+
+    def test_policy_evicts_on_bytes(self):
+        fdict = filedbwrap.FileDict(os.path.join(self.data_dir, 'policy'), clear=True,
+                                    cache_bytes=100, eviction_policy='lru', eviction_batch=1,
+                                    size_estimator=lambda key, val: len(val))
+        for key in 'abcde':
+            fdict[key] = 'x' * 30
+        self.assertEqual(sorted(fdict.get_cache()), ['c', 'd', 'e'])
+        self.assertEqual(fdict._cur_bytes, 90)
+        fdict['e'] = 'x' * 10
+        self.assertEqual(fdict._cur_bytes, 70)
+        self.assertEqual(len(fdict), 5)
+        fdict.close(delete_file=True)
+
+    def test_split_divides_bytes(self):
+        split = filedbwrap.SplitFileDict(os.path.join(self.data_dir, 'split'), ('a', 'b'),
+                                         lambda key: key[0], clear=True, cache_bytes=1000)
+        self.assertEqual(split._keyed_db['a'].cache_bytes, 500)
+        split.close(delete_file=True)
+
+class AdaptiveBudgetTest(unittest.TestCase):
+    def setUp(self):
+        self.data_dir = os.path.join(dirname(__file__), 'cache_budget')
+        if not os.path.exists(self.data_dir):
+            os.makedirs(self.data_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.data_dir)
+
+    def test_allocate_budgets(self):
+        budgets = {'hot': 100, 'cold': 100, 'idle': 100}
+        allocated = cachepolicy.allocate_budgets(300, budgets, {'hot': 1000, 'idle': 1000},
+                                                 {'hot': 1.0, 'cold': 1.0, 'idle': 0.0})
+        self.assertGreater(allocated['hot'], 100)
+        # Misses with room to spare don't earn more budget
+        self.assertLess(allocated['idle'], 100)
+        self.assertLessEqual(sum(allocated.values()), 300)
+        for _ in range(20):
+            allocated = cachepolicy.allocate_budgets(300, allocated, {'hot': 1000},
+                                                     {'hot': 1.0})
+        self.assertEqual(allocated['cold'], 25)
+        self.assertLessEqual(sum(allocated.values()), 300)
+        # Budgets over the total are brought back under it
+        allocated = cachepolicy.allocate_budgets(10, {'a': 50, 'b': 50}, {}, {}, damping=0)
+        self.assertLessEqual(sum(allocated.values()), 10)
+        self.assertEqual(cachepolicy.allocate_budgets(10, {}, {}, {}), {})
+
+    def test_set_cache_size(self):
+        fdict = filedbwrap.FileDict(os.path.join(self.data_dir, 'resize'), clear=True,
+                                    cache_size=8, eviction_policy='lru', eviction_batch=1)
+        for i in range(8):
+            fdict[str(i)] = i
+        fdict.set_cache_size(4)
+        self.assertEqual(sorted(fdict.get_cache()), ['4', '5', '6', '7'])
+        self.assertEqual(fdict._policy.capacity, 4)
+        self.assertEqual(fdict['0'], 0)
+        fdict.reopen()
+        self.assertEqual(fdict.cache_size, 4)
+        fdict.close(delete_file=True)
+
+    def test_split_rebalances(self):
+        split = filedbwrap.SplitFileDict(os.path.join(self.data_dir, 'split'), ('h', 'c'),
+                                         lambda key: key[0], clear=True, cache_size=200,
+                                         eviction_policy='lru', adaptive_cache=True,
+                                         rebalance_every=100)
+        for i in range(300):
+            split['h' + str(i)] = i
+        split['c0'] = 0
+        split.sync_cache()
+        for _ in range(3):
+            for i in range(300):
+                split['h' + str(i)]
+            split['c0']
+        hot, cold = split._keyed_db['h'], split._keyed_db['c']
+        self.assertGreater(hot.cache_size, cold.cache_size)
+        self.assertGreaterEqual(cold.cache_size, 25)
+        self.assertLessEqual(hot.cache_size + cold.cache_size, 200)
+        self.assertEqual(split['h5'], 5)
+        split.set_cache_size(100)
+        self.assertEqual(hot.cache_size, 50)
+        self.assertEqual(split.cache_size, 100)
+        split.close(delete_file=True)
+
+    def test_split_counts_deletes(self):
+        split = filedbwrap.SplitFileDict(os.path.join(self.data_dir, 'split'), ('h', 'c'),
+                                         lambda key: key[0], clear=True, cache_size=200,
+                                         adaptive_cache=True, rebalance_every=1000)
+        split.update(('h' + str(i), i) for i in range(10))
+        split['c0'] = 0
+        ops = split._ops_since_rebalance
+        del split['h1']
+        split.delete_many(['h2', 'h3', 'c0'])
+        self.assertEqual(split._ops_since_rebalance, ops + 4)
+        self.assertEqual(len(split), 7)
+        split.close(delete_file=True)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,132 @@
+# This import fixes sys.path issues
+from . import parentpath
+
+from datawrap import basewrap, cachestats, filedbwrap
+from .redis_wrap_test import FakeRedisCacheDict
+import unittest
+import os
+import shutil
+from os.path import dirname
+
+class SyncDict(dict):
+    def sync(self):
+        pass
+
+class CacheStatsTest(unittest.TestCase):
+    def test_disabled_by_default(self):
+        cached = basewrap.UnorderedCachedDict(SyncDict(), 10)
+        self.assertIsNone(cached._stats)
+        cached['a'] = 1
+        self.assertEqual(cached.stats(), {'cached_entries': 1})
+
+    def test_counters(self):
+        cached = basewrap.UnorderedCachedDict(SyncDict({'a': 1}), 10, collect_stats=True,
+                                              immutable_vals=True)
+        cached['a']
+        cached['a']
+        self.assertNotIn('b', cached)
+        cached['c'] = 3
+        cached.sync_cache()
+        stats = cached.stats()
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['misses'], 2)
+        self.assertEqual(stats['dirty_flushes'], 1)
+        self.assertGreater(stats['bytes_written'], 0)
+        self.assertEqual(stats['syncs'], 1)
+        self.assertAlmostEqual(stats['hit_ratio'], 1.0 / 3)
+
+    def test_hooks(self):
+        events = []
+        cached = basewrap.UnorderedCachedDict(SyncDict(), 2, database_default_func=lambda: 0,
+                                              on_miss=lambda key: events.append(('miss', key)),
+                                              on_evict=lambda keys: events.append(('evict', len(keys))),
+                                              on_sync_start=lambda: events.append(('start',)),
+                                              on_sync_end=lambda secs: events.append(('end',)))
+        cached['a']
+        for key in 'bcd':
+            cached[key] = 1
+        self.assertEqual(events, [('miss', 'a'), ('evict', 3), ('start',), ('end',)])
+        self.assertEqual(cached.stats()['evictions'], 3)
+
+    def test_policy_evictions(self):
+        evicted = []
+        cached = basewrap.UnorderedCachedDict(SyncDict(), 4, eviction_policy='lru',
+                                              eviction_batch=1, on_evict=evicted.extend)
+        for key in 'abcdef':
+            cached[key] = 1
+        self.assertEqual(evicted, ['a', 'b'])
+        self.assertEqual(cached.stats()['dirty_flushes'], 2)
+
+    def test_aggregate(self):
+        totals = cachestats.aggregate_stats([{'hits': 3, 'misses': 1, 'hit_ratio': 0.75},
+                                             {'hits': 1, 'misses': 3, 'hit_ratio': 0.25},
+                                             {'cached_entries': 2}])
+        self.assertEqual(totals['hits'], 4)
+        self.assertEqual(totals['hit_ratio'], 0.5)
+        self.assertEqual(totals['cached_entries'], 2)
+
+class FileStatsTest(unittest.TestCase):
+    def setUp(self):
+        self.data_dir = os.path.join(dirname(__file__), 'cache_stats')
+        if not os.path.exists(self.data_dir):
+            os.makedirs(self.data_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.data_dir)
+
+    def test_enabled_after_reopen(self):
+        fdict = filedbwrap.FileDict(os.path.join(self.data_dir, 'file'), clear=True,
+                                    collect_stats=True)
+        fdict['a'] = 1
+        fdict.reopen()
+        self.assertEqual(fdict['a'], 1)
+        self.assertEqual(fdict.stats()['misses'], 1)
+        fdict.close(delete_file=True)
+
+    def test_split_aggregates(self):
+        split = filedbwrap.SplitFileDict(os.path.join(self.data_dir, 'split'), ('a', 'b'),
+                                         lambda key: key[0], clear=True, collect_stats=True)
+        split['a1'] = 1
+        split['b1'] = 2
+        split['a1']
+        split['b2'] = 3
+        self.assertNotIn('b3', split)
+        stats = split.stats()
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['misses'], 1)
+        self.assertEqual(stats['cached_entries'], 4)
+        self.assertEqual(stats['shards']['b']['cached_entries'], 3)
+        split.close(delete_file=True)
+
+class RedisStatsTest(unittest.TestCase):
+    def test_disabled_by_default(self):
+        redis = FakeRedisCacheDict({'a': '1'})
+        redis['a']
+        self.assertEqual(redis.stats(), {'cached_entries': 1})
+
+    def test_counters_and_hooks(self):
+        events = []
+        redis = FakeRedisCacheDict({'a': '1', 'h': {'x': '2'}},
+                                   on_miss=lambda key: events.append(('miss', key)),
+                                   on_sync_start=lambda: events.append(('start',)),
+                                   on_sync_end=lambda secs: events.append(('end',)))
+        redis['a']
+        redis['a']
+        redis.get_many([('h', 'x'), 'a', 'b'])
+        redis['c'] = '3'
+        redis[('h', 'y')] = '4'
+        redis.sync_cache()
+        stats = redis.stats()
+        self.assertEqual(stats['hits'], 2)
+        self.assertEqual(stats['misses'], 3)
+        self.assertAlmostEqual(stats['hit_ratio'], 0.4)
+        self.assertEqual(stats['dirty_flushes'], 2)
+        self.assertGreater(stats['bytes_written'], 0)
+        self.assertEqual(stats['syncs'], 1)
+        self.assertEqual(stats['evictions'], 0)
+        self.assertEqual(stats['cached_entries'], 4)
+        self.assertEqual(events, [('miss', 'a'), ('miss', ('h', 'x')), ('miss', 'b'),
+                                  ('start',), ('end',)])
+
+if __name__ == '__main__':
+    unittest.main()
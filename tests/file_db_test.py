@@ -7,11 +7,13 @@ changes could disrupt these.
 # This import fixes sys.path issues
 from . import parentpath
 
-from datawrap import filedbwrap
+from datawrap import filedbwrap, basewrap, valuecodec
 import unittest
 import os
 import string
 import shutil
+import threading
+import time
 from os.path import dirname
 from builtins import str as text
 
@@ -33,6 +35,13 @@ def first_alpha_char(word):
     # Default to z if necessary
     return "z"
 
+def last_digit_char(word):
+    '''
+    Gets the last character of a string if it's a digit
+    '''
+    # Default to z if necessary
+    return word[-1] if word[-1:].isdigit() else "z"
+
 class DBWrapTest(object):
     '''
     Base class used to define DBWrap tests.
@@ -164,6 +173,25 @@ class DBWrapTest(object):
         self.assertEqual(len(self.test_dict), result)
         self.test_dict._sync_writes()
 
+    def test_get_many(self):
+        vals = self.test_dict.get_many([text(i) for i in range(self.size)] + ['50'])
+        self.assertEqual(vals, list(range(self.size)) + [None])
+        self.assertEqual(self.test_dict.get_many([3, 1, 3]), [3, 1, 3])
+
+    def test_set_many(self):
+        self.test_dict.set_many((text(i), i * 3) for i in range(self.size))
+        self.test_dict.update_many({'100': 'a'}, b101='b')
+        self.assertEqual(self.test_dict.get_many(['100', 'b101']), ['a', 'b'])
+        for i in range(self.size):
+            self.assertEqual(self.test_dict[text(i)], i * 3)
+        self.test_dict._sync_writes()
+
+    def test_delete_many(self):
+        self.test_dict.delete_many([text(i) for i in range(0, self.size, 2)] + ['missing'])
+        for i in range(self.size):
+            self.assertEqual(text(i) in self.test_dict, i % 2 == 1)
+        self.assertEqual(len(self.test_dict), self.size // 2)
+
     def test_write_to_read_only(self):
         # Attempt to write to read only
         self.test_dict.reopen(read_only=True)
@@ -256,5 +284,931 @@ class SplitFileTestCacheZero(DBWrapTest, unittest.TestCase):
         return False
 
 
+class FileTestClockEviction(DBWrapTest, unittest.TestCase):
+    '''
+    Tests FileDict with a small cache and CLOCK eviction.
+    '''
+    def create_dictionary(self):
+        return filedbwrap.FileDict(os.path.join(self.data_dir, '07'),
+                                   read_only=False,
+                                   clear=True,
+                                   stringify_keys=True,
+                                   cache_size=4,
+                                   eviction_policy='clock',
+                                   database_default_func=lambda: None)
+    def clear_cache(self):
+        return False
+
+class SplitFileTestSegmentedLRUEviction(DBWrapTest, unittest.TestCase):
+    '''
+    Tests SplitFileDict with segmented LRU eviction on each shard.
+    '''
+    def create_dictionary(self):
+        return filedbwrap.SplitFileDict(os.path.join(self.data_dir, '08'),
+                                        split_keys=tuple(string.ascii_lowercase),
+                                        split_func = first_alpha_char,
+                                        read_only=False,
+                                        stringify_keys=True,
+                                        clear=True,
+                                        cache_size=26*2,
+                                        eviction_policy='slru',
+                                        database_default_func=lambda: None)
+    def clear_cache(self):
+        return False
+
+class SetWrapTest(object):
+    '''
+    Base class used to define file set tests.
+    '''
+    def setUp(self):
+        self.data_dir = os.path.join(dirname(__file__), 'file_db')
+        if not os.path.exists(self.data_dir):
+            os.makedirs(self.data_dir)
+
+        self.test_set = self.create_set()
+        self.size = 20
+        self.test_set.update(range(self.size))
+
+    def tearDown(self):
+        self.test_set.close()
+        shutil.rmtree(self.data_dir)
+
+    def test_contains(self):
+        for i in range(self.size):
+            self.assertTrue(i in self.test_set)
+        self.assertFalse(self.size in self.test_set)
+        self.assertEqual(len(self.test_set), self.size)
+
+    def test_update_preprocess(self):
+        self.test_set.update(['a1', 'b2'], preprocess=lambda e: e.upper())
+        self.assertTrue('A1' in self.test_set)
+        self.assertFalse('a1' in self.test_set)
+        self.assertEqual(len(self.test_set), self.size + 2)
+
+    def test_discard(self):
+        self.test_set.discard(0)
+        self.test_set.delete_many([1, 2, 'missing'])
+        self.assertFalse(0 in self.test_set)
+        self.assertFalse(2 in self.test_set)
+        self.assertEqual(len(self.test_set), self.size - 3)
+
+    def test_reopen(self):
+        self.test_set.reopen(read_only=True)
+        self.assertEqual(sorted(self.test_set), sorted(text(i) for i in range(self.size)))
+        self.assertRaises(AttributeError, self.test_set.add, 'new')
+
+class FileSetTest(SetWrapTest, unittest.TestCase):
+    '''
+    Tests FileSet basic functionality.
+    '''
+    def create_set(self):
+        return filedbwrap.FileSet(os.path.join(self.data_dir, 's01'),
+                                  clear=True,
+                                  stringify_keys=True,
+                                  cache_size=8)
+
+class FileSetTestBloomFilter(SetWrapTest, unittest.TestCase):
+    '''
+    Tests FileSet with a bloom filter answering misses.
+    '''
+    def create_set(self):
+        return filedbwrap.FileSet(os.path.join(self.data_dir, 's03'),
+                                  clear=True,
+                                  stringify_keys=True,
+                                  cache_size=8,
+                                  use_bloom_filter=True)
+
+class SplitFileSetTest(SetWrapTest, unittest.TestCase):
+    '''
+    Tests SplitFileSet basic functionality.
+    '''
+    def create_set(self):
+        return filedbwrap.SplitFileSet(os.path.join(self.data_dir, 's02'),
+                                       split_keys=tuple('0123456789z'),
+                                       split_func=last_digit_char,
+                                       clear=True,
+                                       stringify_keys=True,
+                                       cache_size=24)
+
+class SplitFileSetTestLogBackend(SetWrapTest, unittest.TestCase):
+    '''
+    Tests SplitFileSet stored in append only log files.
+    '''
+    def create_set(self):
+        return filedbwrap.SplitFileSet(os.path.join(self.data_dir, 's04'),
+                                       split_keys=tuple('0123456789z'),
+                                       split_func=last_digit_char,
+                                       clear=True,
+                                       stringify_keys=True,
+                                       cache_size=24,
+                                       backend='log')
+
+class FileSetTestSqliteBackend(SetWrapTest, unittest.TestCase):
+    '''
+    Tests FileSet stored in sqlite.
+    '''
+    def create_set(self):
+        return filedbwrap.FileSet(os.path.join(self.data_dir, 's05'),
+                                  clear=True,
+                                  stringify_keys=True,
+                                  cache_size=8,
+                                  backend='sqlite')
+
+class FileTestWriteBehind(DBWrapTest, unittest.TestCase):
+    '''
+    Tests FileDict with a small cache flushed by a background writer.
+    '''
+    def create_dictionary(self):
+        return filedbwrap.FileDict(os.path.join(self.data_dir, '09'),
+                                   read_only=False,
+                                   clear=True,
+                                   stringify_keys=True,
+                                   cache_size=4,
+                                   write_behind=True,
+                                   database_default_func=lambda: None)
+    def clear_cache(self):
+        return False
+
+class SlowWriteDatabase(dict):
+    '''
+    In memory database with slow writes, optionally failing them.
+    '''
+    def __init__(self, delay=0.01, fail=False):
+        dict.__init__(self)
+        self.delay = delay
+        self.fail = fail
+
+    def __setitem__(self, key, val):
+        time.sleep(self.delay)
+        if self.fail:
+            raise IOError("write failed")
+        dict.__setitem__(self, key, val)
+
+    def sync(self):
+        pass
+
+class ClosingDatabase(SlowWriteDatabase):
+    '''
+    SlowWriteDatabase which records being closed.
+    '''
+    closed = False
+
+    def close(self):
+        self.closed = True
+
+class WriteBehindTest(unittest.TestCase):
+    '''
+    Tests the background writer of UnorderedCachedDict.
+    '''
+    def test_pending_reads(self):
+        database = SlowWriteDatabase()
+        cached = basewrap.UnorderedCachedDict(database, 4, write_behind=True)
+        for i in range(10):
+            cached[text(i)] = i
+        # Overflowing hands writes off without waiting for them
+        self.assertLess(len(database), 10)
+        for i in range(10):
+            self.assertEqual(cached[text(i)], i)
+        self.assertEqual(len(cached), 10)
+        self.assertEqual(len(database), 10)
+        cached.close()
+
+    def test_idle_flush(self):
+        database = SlowWriteDatabase(delay=0)
+        cached = basewrap.UnorderedCachedDict(database, 100, write_behind=True,
+                                              write_behind_interval=0.01)
+        cached['a'] = 1
+        for _ in range(100):
+            if 'a' in database:
+                break
+            time.sleep(0.01)
+        self.assertEqual(database.get('a'), 1)
+        cached.close()
+
+    def test_delete_pending(self):
+        database = SlowWriteDatabase(delay=0.05)
+        cached = basewrap.UnorderedCachedDict(database, 0, write_behind=True,
+                                              cache_misses=False)
+        cached['a'] = 1
+        cached['b'] = 2
+        del cached['a']
+        cached.sync_cache()
+        self.assertEqual(dict(database), {'b': 2})
+        cached.close()
+
+    def test_error_raised_on_sync(self):
+        database = SlowWriteDatabase(delay=0, fail=True)
+        cached = basewrap.UnorderedCachedDict(database, 0, write_behind=True)
+        cached['a'] = 1
+        self.assertRaises(IOError, cached.sync_cache)
+        # The failed write is still readable
+        self.assertEqual(cached['a'], 1)
+        database.fail = False
+        cached.close()
+        self.assertEqual(dict(database), {'a': 1})
+
+    def test_close_after_error(self):
+        database = ClosingDatabase(delay=0, fail=True)
+        cached = basewrap.UnorderedCachedDict(database, 0, write_behind=True,
+                                              read_pool_size=2)
+        cached.get_many(['x', 'y'])
+        cached['a'] = 1
+        self.assertRaises(IOError, cached.close)
+        # Everything is still torn down
+        self.assertTrue(database.closed)
+        self.assertTrue(cached.closed)
+        self.assertIsNone(cached._read_pool)
+        self.assertIsNone(cached._writer)
+
+class FileTestFingerprint(DBWrapTest, unittest.TestCase):
+    '''
+    Tests FileDict only writing back values whose fingerprint changed.
+    '''
+    def create_dictionary(self):
+        return filedbwrap.FileDict(os.path.join(self.data_dir, '10'),
+                                   read_only=False,
+                                   clear=True,
+                                   stringify_keys=True,
+                                   cache_size=4,
+                                   fingerprint_vals=True,
+                                   database_default_func=lambda: None)
+    def clear_cache(self):
+        return False
+
+class FileTestBloomFilter(DBWrapTest, unittest.TestCase):
+    '''
+    Tests FileDict with a bloom filter answering misses.
+    '''
+    def create_dictionary(self):
+        return filedbwrap.FileDict(os.path.join(self.data_dir, '11'),
+                                   read_only=False,
+                                   clear=True,
+                                   stringify_keys=True,
+                                   cache_size=4,
+                                   use_bloom_filter=True,
+                                   database_default_func=lambda: None)
+    def clear_cache(self):
+        return False
+
+class SplitFileTestKeepClean(DBWrapTest, unittest.TestCase):
+    '''
+    Tests SplitFileDict keeping clean entries cached across syncs.
+    '''
+    def create_dictionary(self):
+        return filedbwrap.SplitFileDict(os.path.join(self.data_dir, '12'),
+                                        split_keys=tuple(string.ascii_lowercase),
+                                        split_func=first_alpha_char,
+                                        read_only=False,
+                                        clear=True,
+                                        stringify_keys=True,
+                                        cache_size=4*26,
+                                        keep_clean=True,
+                                        database_default_func=lambda: None)
+    def clear_cache(self):
+        return False
+
+class FileTestZlibCodec(DBWrapTest, unittest.TestCase):
+    '''
+    Tests FileDict storing compressed values.
+    '''
+    def create_dictionary(self):
+        return filedbwrap.FileDict(os.path.join(self.data_dir, '13'),
+                                   read_only=False,
+                                   clear=True,
+                                   stringify_keys=True,
+                                   cache_size=4,
+                                   codec=valuecodec.ValueCodec(compression='zlib',
+                                                                compress_threshold=0),
+                                   database_default_func=lambda: None)
+    def clear_cache(self):
+        return False
+
+class SplitFileTestLogBackend(DBWrapTest, unittest.TestCase):
+    '''
+    Tests SplitFileDict stored in append only log files.
+    '''
+    def create_dictionary(self):
+        return filedbwrap.SplitFileDict(os.path.join(self.data_dir, '14'),
+                                        split_keys=tuple(string.ascii_lowercase),
+                                        split_func=first_alpha_char,
+                                        read_only=False,
+                                        clear=True,
+                                        stringify_keys=True,
+                                        cache_size=4*26,
+                                        backend='log',
+                                        database_default_func=lambda: None)
+    def clear_cache(self):
+        return False
+
+class FileTestSqliteBackend(DBWrapTest, unittest.TestCase):
+    '''
+    Tests FileDict stored in sqlite with a background writer.
+    '''
+    def create_dictionary(self):
+        return filedbwrap.FileDict(os.path.join(self.data_dir, '15'),
+                                   read_only=False,
+                                   clear=True,
+                                   stringify_keys=True,
+                                   cache_size=4,
+                                   backend='sqlite',
+                                   write_behind=True,
+                                   read_pool_size=2,
+                                   database_default_func=lambda: None)
+    def clear_cache(self):
+        return False
+
+class OrderedFileTestWriteBehind(DBWrapTest, unittest.TestCase):
+    '''
+    Tests OrderedFileDict with a small cache flushed by a background writer.
+    '''
+    def create_dictionary(self):
+        return filedbwrap.OrderedFileDict(os.path.join(self.data_dir, '16'),
+                                          read_only=False,
+                                          clear=True,
+                                          stringify_keys=True,
+                                          cache_size=4,
+                                          write_behind=True,
+                                          database_default_func=lambda: None)
+    def clear_cache(self):
+        return False
+
+    def test_iter_sorted(self):
+        self.assertEqual(list(self.test_dict), sorted(text(i) for i in range(self.size)))
+
+class SplitFileTestShardWorkers(DBWrapTest, unittest.TestCase):
+    '''
+    Tests SplitFileDict syncing and closing its shards on a thread pool.
+    '''
+    def create_dictionary(self):
+        return filedbwrap.SplitFileDict(os.path.join(self.data_dir, '17'),
+                                        split_keys=tuple(string.digits) + ('z',),
+                                        split_func=last_digit_char,
+                                        read_only=False,
+                                        stringify_keys=True,
+                                        clear=True,
+                                        cache_size=44,
+                                        shard_workers=4,
+                                        database_default_func=lambda: None)
+    def clear_cache(self):
+        return False
+
+class SplitFileTestMaxOpen(DBWrapTest, unittest.TestCase):
+    '''
+    Tests SplitFileDict with only a few shards open at a time.
+    '''
+    def create_dictionary(self):
+        return filedbwrap.SplitFileDict(os.path.join(self.data_dir, '18'),
+                                        split_keys=tuple(string.digits) + ('z',),
+                                        split_func=last_digit_char,
+                                        read_only=False,
+                                        stringify_keys=True,
+                                        clear=True,
+                                        cache_size=44,
+                                        max_open=3,
+                                        database_default_func=lambda: None)
+    def clear_cache(self):
+        return False
+
+class LazyShardTest(unittest.TestCase):
+    '''
+    Tests opening split database shards on first use.
+    '''
+    def setUp(self):
+        self.data_dir = os.path.join(dirname(__file__), 'file_db')
+        if not os.path.exists(self.data_dir):
+            os.makedirs(self.data_dir)
+        self.db_name = os.path.join(self.data_dir, 'lazy')
+
+    def tearDown(self):
+        shutil.rmtree(self.data_dir)
+
+    def open_split(self, **kwargs):
+        return filedbwrap.SplitFileDict(self.db_name, split_keys=tuple(string.digits) + ('z',),
+                                        split_func=last_digit_char, stringify_keys=True,
+                                        cache_size=30, **kwargs)
+
+    def test_bounded_open(self):
+        split = self.open_split(clear=True, max_open=2)
+        self.assertEqual(split._keyed_db.open_items(), [])
+        for i in range(100):
+            split[i] = i
+            self.assertLessEqual(len(split._keyed_db.open_items()), 2)
+        # Closed shards synced their caches first
+        self.assertEqual(split[3], 3)
+        self.assertEqual(len(split), 100)
+        self.assertEqual(sorted(split, key=int), [text(i) for i in range(100)])
+        self.assertEqual(split._keyed_db['1'].cache_size, 15)
+        self.assertRaises(KeyError, split._keyed_db.__getitem__, 'x')
+        split.close()
+
+        split = self.open_split(lazy_open=True)
+        self.assertEqual(split[98], 98)
+        self.assertEqual([skey for skey, _ in split._keyed_db.open_items()], ['8'])
+        self.assertEqual(split.stats()['shards'].keys(), set(['8']))
+        split.close(delete_file=True)
+        self.assertEqual(os.listdir(self.data_dir), [])
+
+    def test_clear_unopened(self):
+        split = self.open_split(clear=True)
+        split.update((i, i) for i in range(20))
+        split.close()
+        # Shards opened with clear=True are cleared even if never used
+        split = self.open_split(clear=True, max_open=2)
+        split[1] = 'one'
+        split.close()
+        split = self.open_split(max_open=2)
+        self.assertEqual(len(split), 1)
+        split.update((i, i) for i in range(20))
+        split.clear()
+        self.assertEqual(len(split), 0)
+        split.reopen(read_only=True)
+        self.assertRaises(AttributeError, split.__setitem__, 5, 5)
+        self.assertRaises(AttributeError, split.bulk_load, [(5, 5)])
+        split.close()
+
+    def test_bulk_load(self):
+        split = self.open_split(clear=True, max_open=3)
+        split[5] = 'stale'
+        report = split.bulk_load(((i, i) for i in range(200)), batch_size=4)
+        self.assertEqual(report['items'], 200)
+        self.assertEqual(len(split), 200)
+        self.assertEqual(split[5], 5)
+        split.close()
+
+class SlowSyncDict(basewrap.MemDict):
+    '''
+    In memory database which takes a while to sync and can be made to fail.
+    '''
+    def sync_cache(self, **kwargs):
+        time.sleep(0.05)
+        if self._db_name.endswith('bad'):
+            raise IOError("Sync failed")
+
+class ShardExecutorTest(unittest.TestCase):
+    '''
+    Tests running split database operations across shards.
+    '''
+    def create_split(self, shard_workers):
+        return basewrap.SplitDbDict('shards', SlowSyncDict, ['a', 'b', 'c', 'd'],
+                                    lambda key: key[0], shard_workers=shard_workers)
+
+    def test_parallel_sync(self):
+        split = self.create_split(4)
+        split['a1'] = 1
+        start = time.time()
+        split.sync_cache()
+        self.assertLess(time.time() - start, 0.15)
+        self.assertEqual(sorted(split.shard_timings['sync_cache']), ['a', 'b', 'c', 'd'])
+        self.assertGreaterEqual(split.shard_timings['sync_cache']['a'], 0.04)
+        self.assertEqual(len(split), 1)
+        self.assertIn('len', split.shard_timings)
+        split.close()
+        self.assertIsNone(split._shard_pool)
+
+    def test_errors_aggregated(self):
+        for shard_workers in (0, 2):
+            split = self.create_split(shard_workers)
+            split._keyed_db['b']._db_name = 'shards_bad'
+            split._keyed_db['d']._db_name = 'shards_bad'
+            try:
+                split.sync_cache()
+                self.fail("Expected a ShardError")
+            except basewrap.ShardError as e:
+                self.assertEqual(e.operation, 'sync_cache')
+                self.assertEqual(sorted(e.errors), ['b', 'd'])
+                self.assertIsInstance(e.errors['b'], IOError)
+            # The other shards still synced
+            self.assertEqual(len(split.shard_timings['sync_cache']), 4)
+            split.close()
+
+class WriteCountingDatabase(dict):
+    '''
+    In memory database which counts writes by key.
+    '''
+    def __init__(self, *args, **kwargs):
+        dict.__init__(self, *args, **kwargs)
+        self.writes = {}
+
+    def __setitem__(self, key, val):
+        self.writes[key] = self.writes.get(key, 0) + 1
+        dict.__setitem__(self, key, val)
+
+    def sync(self):
+        pass
+
+class FingerprintTest(unittest.TestCase):
+    '''
+    Tests dirty detection of mutable values read from the database.
+    '''
+    def test_reads_not_written(self):
+        database = WriteCountingDatabase(a=[1], b=[2])
+        cached = basewrap.UnorderedCachedDict(database, 10, fingerprint_vals=True)
+        self.assertEqual(cached['a'], [1])
+        cached['b'].append(3)
+        cached.sync_cache()
+        self.assertEqual(database.writes, {'b': 1})
+        self.assertEqual(database['b'], [2, 3])
+        cached.close()
+
+    def test_unfingerprinted_reads_written(self):
+        database = WriteCountingDatabase(a=[1])
+        cached = basewrap.UnorderedCachedDict(database, 10)
+        cached['a']
+        cached.sync_cache()
+        self.assertEqual(database.writes, {'a': 1})
+        cached.close()
+
+    def test_evicted_changes_written(self):
+        database = WriteCountingDatabase(a=[1], b=[2], c=[3])
+        cached = basewrap.UnorderedCachedDict(database, 1, fingerprint_vals=True,
+                                              eviction_policy='lru', eviction_batch=1)
+        cached['a'].append(4)
+        cached['b']
+        cached['c']
+        self.assertEqual(database.writes, {'a': 1})
+        self.assertEqual(database['a'], [1, 4])
+        cached.close()
+
+class KeepCleanTest(unittest.TestCase):
+    '''
+    Tests syncing without dropping the clean working set.
+    '''
+    def test_sync_keeps_cache(self):
+        database = WriteCountingDatabase({'a': 1})
+        cached = basewrap.UnorderedCachedDict(database, 10, immutable_vals=True,
+                                              keep_clean=True)
+        cached['a']
+        cached['b'] = 2
+        cached.sync_cache()
+        self.assertEqual(database.writes, {'b': 1})
+        self.assertEqual(sorted(cached.get_cache()), ['a', 'b'])
+        cached.sync_cache(keep_clean=False)
+        self.assertEqual(cached.get_cache(), {})
+
+    def test_overflow_evicts_batch(self):
+        database = WriteCountingDatabase()
+        cached = basewrap.UnorderedCachedDict(database, 8, keep_clean=True,
+                                              eviction_batch=2)
+        for i in range(10):
+            cached[i] = i
+        # Only the evicted entries were written, whichever they were
+        evicted = list(database.writes)
+        self.assertEqual(len(evicted), 2)
+        self.assertEqual(sorted(evicted + list(cached.get_cache())), list(range(10)))
+        self.assertEqual(cached._cur_size, 8)
+        for key in evicted:
+            self.assertEqual(database[key], key)
+            self.assertEqual(cached[key], key)
+
+class ThreadTrackingDatabase(dict):
+    '''
+    Slow in memory database which records the threads reading it.
+    '''
+    def __init__(self, *args, **kwargs):
+        dict.__init__(self, *args, **kwargs)
+        self.reader_threads = set()
+
+    def __getitem__(self, key):
+        self.reader_threads.add(threading.current_thread().ident)
+        time.sleep(0.01)
+        return dict.__getitem__(self, key)
+
+    def sync(self):
+        pass
+
+class ReadPoolTest(unittest.TestCase):
+    '''
+    Tests batched reads through the read pool.
+    '''
+    def setUp(self):
+        self.data_dir = os.path.join(dirname(__file__), 'file_db')
+        if not os.path.exists(self.data_dir):
+            os.makedirs(self.data_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.data_dir)
+
+    def test_pool_reads_concurrently(self):
+        database = ThreadTrackingDatabase((text(i), i) for i in range(8))
+        cached = basewrap.UnorderedCachedDict(database, 100, read_pool_size=4)
+        self.assertEqual(cached.get_many([text(i) for i in range(8)]), list(range(8)))
+        self.assertNotIn(threading.current_thread().ident, database.reader_threads)
+        self.assertGreater(len(database.reader_threads), 1)
+        cached.close()
+
+    def test_file_get_many(self):
+        fdict = filedbwrap.FileDict(os.path.join(self.data_dir, 'pool'), clear=True,
+                                    stringify_keys=True, read_pool_size=4)
+        for i in range(20):
+            fdict[i] = i * 2
+        fdict.sync_cache()
+        self.assertEqual(fdict.get_many([3, 1, 'missing', 3], default=-1), [6, 2, -1, 6])
+        fdict.prefetch(range(10))
+        self.assertEqual(sorted(fdict.get_cache()), sorted(['missing'] + [text(i) for i in range(10)]))
+        fdict.close(delete_file=True)
+
+class BulkLoadTest(unittest.TestCase):
+    '''
+    Tests loading straight into the database without the cache.
+    '''
+    def setUp(self):
+        self.data_dir = os.path.join(dirname(__file__), 'file_db')
+        if not os.path.exists(self.data_dir):
+            os.makedirs(self.data_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.data_dir)
+
+    def test_batches_bypass_cache(self):
+        database = WriteCountingDatabase({'old': 1})
+        cached = basewrap.UnorderedCachedDict(database, 10, stringify_keys=True)
+        cached['a'] = 'cached'
+        report = cached.bulk_load(((i, i) for i in range(25)), clear=False, batch_size=10)
+        self.assertEqual(report['items'], 25)
+        self.assertGreater(report['items_per_second'], 0)
+        self.assertEqual(cached.get_cache(), {})
+        self.assertEqual(database['a'], 'cached')
+        self.assertEqual(database['24'], 24)
+        self.assertEqual(database['old'], 1)
+        self.assertRaises(AttributeError, cached.bulk_load, [('b', None)], clear=False)
+
+    def test_file_dict(self):
+        fdict = filedbwrap.FileDict(os.path.join(self.data_dir, 'bulk'), clear=True,
+                                    stringify_keys=True, use_bloom_filter=True)
+        fdict['stale'] = 1
+        fdict.bulk_load(dict((i, [i]) for i in range(100)), batch_size=16)
+        self.assertNotIn('stale', fdict)
+        self.assertEqual(len(fdict), 100)
+        self.assertEqual(fdict[42], [42])
+        fdict.reopen(read_only=True)
+        self.assertEqual(fdict[99], [99])
+        self.assertRaises(AttributeError, fdict.bulk_load, [])
+        fdict.close(delete_file=True)
+
+    def test_split_sets(self):
+        fset = filedbwrap.SplitFileSet(os.path.join(self.data_dir, 'bulk'),
+                                       split_keys=tuple(string.digits) + ('z',),
+                                       split_func=last_digit_char, clear=True)
+        report = fset.bulk_load((text(i) for i in range(200)), batch_size=8)
+        self.assertEqual(report['items'], 200)
+        self.assertEqual(len(fset), 200)
+        self.assertEqual(len(fset._keyed_db['7']), 20)
+        self.assertIn('199', fset)
+        fset.bulk_load(['a'], clear=False)
+        self.assertEqual(len(fset), 201)
+        fset.close(delete_file=True)
+
+class FailingFileDict(filedbwrap.FileDict):
+    '''
+    File dictionary which fails to write keys starting with 'bad'.
+    '''
+    def _bulk_write(self, items):
+        if any(key.startswith('bad') for key, _ in items):
+            raise IOError("Write failed")
+        filedbwrap.FileDict._bulk_write(self, items)
+
+class ParallelIngestTest(unittest.TestCase):
+    '''
+    Tests loading split databases from worker processes.
+    '''
+    def setUp(self):
+        self.data_dir = os.path.join(dirname(__file__), 'file_db')
+        if not os.path.exists(self.data_dir):
+            os.makedirs(self.data_dir)
+        self.db_name = os.path.join(self.data_dir, 'ingest')
+
+    def tearDown(self):
+        shutil.rmtree(self.data_dir)
+
+    def check_ingest(self, **kwargs):
+        split = filedbwrap.SplitFileDict(self.db_name, num_shards=5, clear=True,
+                                         stringify_keys=True, **kwargs)
+        split['stale'] = 1
+        split[3] = 'cached'
+        report = split.parallel_ingest(((i, [i]) for i in range(500)), workers=2,
+                                       batch_size=16)
+        self.assertEqual(report['items'], 500)
+        self.assertNotIn('stale', split)
+        self.assertEqual(len(split), 500)
+        self.assertEqual(split[3], [3])
+        split.parallel_ingest({'extra': 'value'}, workers=3, clear=False)
+        self.assertEqual(len(split), 501)
+        split.close()
+        split = filedbwrap.SplitFileDict(self.db_name, num_shards=5, **kwargs)
+        self.assertEqual(split['499'], [499])
+        self.assertEqual(split['extra'], 'value')
+        split.close()
+
+    def test_ingest(self):
+        self.check_ingest()
+
+    def test_ingest_max_open(self):
+        self.check_ingest(max_open=2)
+
+    def test_sets_and_errors(self):
+        fset = filedbwrap.SplitFileSet(self.db_name, split_keys=tuple(string.digits) + ('z',),
+                                       split_func=last_digit_char, clear=True)
+        fset.parallel_ingest((text(i) for i in range(100)), workers=4)
+        self.assertEqual(len(fset), 100)
+        self.assertIn('42', fset)
+        fset.reopen(read_only=True)
+        self.assertRaises(AttributeError, fset.parallel_ingest, ['1'])
+        fset.close()
+
+        split = basewrap.SplitDbDict(self.db_name, FailingFileDict, ['a', 'b'],
+                                     lambda key: 'b' if key.startswith('bad') else 'a',
+                                     clear=True)
+        try:
+            split.parallel_ingest([('good', 1), ('bad', 2)], workers=2)
+            self.fail("Expected a ShardError")
+        except basewrap.ShardError as e:
+            self.assertEqual(list(e.errors), ['b'])
+            self.assertIn('Write failed', str(e.errors['b']))
+        self.assertEqual(split['good'], 1)
+        split.close()
+
+class MemFromFileJournalTest(unittest.TestCase):
+    '''
+    Tests journaled syncs and compaction of MemFromFileDict.
+    '''
+    def setUp(self):
+        self.data_dir = os.path.join(dirname(__file__), 'file_db')
+        if not os.path.exists(self.data_dir):
+            os.makedirs(self.data_dir)
+        self.db_name = os.path.join(self.data_dir, 'journal')
+        self.journal_path = filedbwrap.get_journal_path(self.db_name + '.fd')
+
+    def tearDown(self):
+        shutil.rmtree(self.data_dir)
+
+    def test_sync_appends_changes(self):
+        mdict = filedbwrap.MemFromFileDict(self.db_name, clear=True, stringify_keys=True)
+        for i in range(10):
+            mdict[i] = [i]
+        mdict.compact()
+        self.assertFalse(os.path.exists(self.journal_path))
+        mdict[3] = 'changed'
+        del mdict[4]
+        mdict[11] = [11]
+        mdict[11].append('more')
+        mdict.sync_cache()
+        journal_size = os.path.getsize(self.journal_path)
+        mdict.sync_cache()
+        # Nothing changed since the last sync
+        self.assertEqual(os.path.getsize(self.journal_path), journal_size)
+        mdict.reopen()
+        self.assertEqual(mdict[3], 'changed')
+        self.assertNotIn(4, mdict)
+        self.assertEqual(mdict[11], [11, 'more'])
+        self.assertEqual(len(mdict), 10)
+        mdict.close(delete_file=True)
+        self.assertFalse(os.path.exists(self.journal_path))
+
+    def test_immutable_reads_not_journaled(self):
+        mdict = filedbwrap.MemFromFileDict(self.db_name, clear=True, immutable_vals=True)
+        mdict['a'] = 1
+        mdict.sync_cache()
+        journal_size = os.path.getsize(self.journal_path)
+        self.assertEqual(mdict['a'], 1)
+        self.assertEqual(mdict.get_many(['a', 'b']), [1, None])
+        mdict.reopen()
+        self.assertEqual(os.path.getsize(self.journal_path), journal_size)
+        mdict.close(delete_file=True)
+
+    def test_unchanged_reads_not_journaled(self):
+        mdict = filedbwrap.MemFromFileDict(self.db_name, clear=True)
+        mdict.update((text(i), [i]) for i in range(3000))
+        mdict.compact()
+        for i in range(3000):
+            mdict[text(i)]
+        mdict.get_many(['1', '2', 'missing'])
+        mdict.sync_cache()
+        self.assertFalse(os.path.exists(self.journal_path))
+        mdict['5'].append('more')
+        mdict.get_many(['6'])[0].append('more')
+        mdict.sync_cache()
+        journal_size = os.path.getsize(self.journal_path)
+        self.assertLess(journal_size, 200)
+        mdict.reopen()
+        self.assertEqual(mdict['5'], [5, 'more'])
+        self.assertEqual(mdict['6'], [6, 'more'])
+        mdict.close(delete_file=True)
+
+    def test_changes_after_sync_journaled(self):
+        mdict = filedbwrap.MemFromFileDict(self.db_name, clear=True)
+        mdict['x'] = [1]
+        mdict.sync_cache()
+        val = mdict['x']
+        mdict.sync_cache()
+        val.append(2)
+        mdict.sync_cache()
+        written = [3]
+        mdict['y'] = written
+        mdict.sync_cache()
+        written.append(4)
+        mdict.reopen()
+        self.assertEqual(mdict['x'], [1, 2])
+        self.assertEqual(mdict['y'], [3, 4])
+        mdict.close(delete_file=True)
+
+    def test_torn_journal_tail(self):
+        mdict = filedbwrap.MemFromFileDict(self.db_name, clear=True)
+        mdict['a'] = 1
+        mdict.close()
+        with open(self.journal_path, 'ab') as fhandle:
+            fhandle.write(b'\x00partial')
+        mdict = filedbwrap.MemFromFileDict(self.db_name)
+        self.assertEqual(dict(mdict.items()), {'a': 1})
+        mdict['b'] = 2
+        mdict.reopen()
+        self.assertEqual(dict(mdict.items()), {'a': 1, 'b': 2})
+        mdict.close(delete_file=True)
+
+    def test_journal_compacts(self):
+        mdict = filedbwrap.MemFromFileDict(self.db_name, clear=True, immutable_vals=True)
+        for i in range(100):
+            mdict[text(i)] = 'x' * 1024
+        mdict.sync_cache()
+        # The journal outgrew the empty file it started from
+        self.assertFalse(os.path.exists(self.journal_path))
+        mdict['extra'] = 'y'
+        mdict.reopen(read_only=True)
+        self.assertEqual(len(mdict), 101)
+        self.assertRaises(AttributeError, mdict.compact)
+        mdict.close(delete_file=True)
+
+    def check_interrupted_compact(self, fails):
+        mdict = filedbwrap.MemFromFileDict(self.db_name, clear=True, immutable_vals=True)
+        mdict.update((text(i), i) for i in range(50))
+        mdict.compact()
+        mdict.update((text(i), -i) for i in range(25))
+        mdict.sync_cache()
+        rename = os.rename
+        failures = []
+        def failing_rename(src, dest):
+            name = os.path.basename(dest.decode('utf-8') if isinstance(dest, bytes) else dest)
+            if not failures and fails(name):
+                failures.append(name)
+                raise OSError("Interrupted")
+            rename(src, dest)
+        os.rename = failing_rename
+        try:
+            self.assertRaises(OSError, mdict.compact)
+        finally:
+            os.rename = rename
+        reloaded = filedbwrap.MemFromFileDict(self.db_name, immutable_vals=True)
+        self.assertEqual(dict(reloaded.items()),
+                         dict((text(i), -i if i < 25 else i) for i in range(50)))
+        reloaded.compact()
+        reloaded.reopen()
+        self.assertEqual(len(reloaded), 50)
+        self.assertEqual(reloaded['7'], -7)
+        reloaded.close(delete_file=True)
+        mdict.close()
+        self.assertEqual(os.listdir(self.data_dir), [])
+
+    def test_interrupted_switch(self):
+        # The new shelve is fully written but never switched to
+        self.check_interrupted_compact(lambda name: name.endswith('.gen'))
+
+    def test_shelve_files_never_renamed(self):
+        # Only the generation file is renamed into place, so no crash can
+        # pair one shelve's data file with another's index
+        mdict = filedbwrap.MemFromFileDict(self.db_name, clear=True, immutable_vals=True)
+        mdict['a'] = 1
+        mdict.compact()
+        current = os.path.basename(filedbwrap.get_shelve_path(self.db_name + '.fd'))
+        rename = os.rename
+        renamed = []
+        def recording_rename(src, dest):
+            name = os.path.basename(dest.decode('utf-8') if isinstance(dest, bytes) else dest)
+            renamed.append(name)
+            rename(src, dest)
+        os.rename = recording_rename
+        try:
+            mdict['b'] = 2
+            mdict.compact()
+        finally:
+            os.rename = rename
+        self.assertIn('journal.fd.gen', renamed)
+        self.assertFalse([name for name in renamed if name.startswith(current + '.')])
+        mdict.close(delete_file=True)
+
+    def test_compacts_to_new_generation(self):
+        mdict = filedbwrap.MemFromFileDict(self.db_name, clear=True, immutable_vals=True)
+        mdict['a'] = 1
+        mdict.compact()
+        first = filedbwrap.get_shelve_path(self.db_name + '.fd')
+        mdict['b'] = 2
+        mdict.compact()
+        second = filedbwrap.get_shelve_path(self.db_name + '.fd')
+        self.assertNotEqual(first, second)
+        self.assertFalse(filedbwrap.dbm_exists(first))
+        mdict.reopen()
+        self.assertEqual(dict(mdict.items()), {'a': 1, 'b': 2})
+        mdict.clear()
+        self.assertEqual(filedbwrap.get_shelve_path(self.db_name + '.fd'), self.db_name + '.fd')
+        mdict.close(delete_file=True)
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,87 @@
+# This import fixes sys.path issues
+from . import parentpath
+
+from datawrap import filedbwrap, frozenstore
+import unittest
+import os
+import shutil
+from os.path import dirname
+
+class FrozenStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.data_dir = os.path.join(dirname(__file__), 'frozen_store')
+        if not os.path.exists(self.data_dir):
+            os.makedirs(self.data_dir)
+        self.path = os.path.join(self.data_dir, 'store.fdz')
+
+    def tearDown(self):
+        shutil.rmtree(self.data_dir)
+
+    def test_lookups(self):
+        items = [(str(i), {'val': i}) for i in range(100, 0, -1)]
+        frozenstore.write_frozen(self.path, items + [('50', 'last')], codec='zlib')
+        store = frozenstore.FrozenStore(self.path)
+        self.assertEqual(len(store), 100)
+        self.assertEqual(store['1'], {'val': 1})
+        self.assertEqual(store['50'], 'last')
+        self.assertNotIn('0', store)
+        self.assertNotIn('999', store)
+        self.assertRaises(KeyError, store.__getitem__, u'\xe9')
+        self.assertEqual(list(store), sorted(str(i) for i in range(1, 101)))
+        store.close()
+
+    def test_empty_and_invalid(self):
+        frozenstore.write_frozen(self.path, [])
+        store = frozenstore.FrozenStore(self.path)
+        self.assertEqual(len(store), 0)
+        self.assertNotIn('a', store)
+        store.close()
+        with open(self.path, 'r+b') as fhandle:
+            fhandle.write(b'corrupt!')
+        self.assertRaises(ValueError, frozenstore.FrozenStore, self.path)
+        self.assertRaises(IOError, frozenstore.FrozenStore, self.path, 'c')
+
+class FrozenFileDictTest(unittest.TestCase):
+    def setUp(self):
+        self.data_dir = os.path.join(dirname(__file__), 'frozen_file')
+        if not os.path.exists(self.data_dir):
+            os.makedirs(self.data_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.data_dir)
+
+    def test_freeze(self):
+        db_name = os.path.join(self.data_dir, 'data')
+        fdict = filedbwrap.FileDict(db_name, clear=True, cache_size=8, stringify_keys=True)
+        for i in range(20):
+            fdict[i] = [i]
+        frozen_path = fdict.freeze()
+        fdict.close(delete_file=True)
+        self.assertTrue(frozen_path.endswith('data.fdz'))
+
+        frozen = filedbwrap.FrozenFileDict(db_name, stringify_keys=True,
+                                           database_default_func=lambda: None)
+        self.assertEqual(frozen[19], [19])
+        self.assertIn(0, frozen)
+        self.assertIsNone(frozen[20])
+        self.assertEqual(frozen.get_many([1, 2]), [[1], [2]])
+        self.assertEqual(len(frozen), 20)
+        frozen.reopen(database_default_func=None)
+        self.assertRaises(KeyError, frozen.__getitem__, 20)
+        frozen.close(delete_file=True)
+        self.assertFalse(os.path.exists(frozen_path))
+
+    def test_split_freeze(self):
+        db_name = os.path.join(self.data_dir, 'split')
+        split = filedbwrap.SplitFileDict(db_name, ('a', 'b'), lambda key: key[0], clear=True,
+                                         backend='log')
+        split.update({'a1': 1, 'b1': 2, 'b2': 3})
+        self.assertEqual(len(split.freeze()), 2)
+        split.close(delete_file=True)
+
+        frozen = filedbwrap.SplitFrozenFileDict(db_name, ('a', 'b'), lambda key: key[0])
+        self.assertEqual(dict(frozen.items()), {'a1': 1, 'b1': 2, 'b2': 3})
+        frozen.close(delete_file=True)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,116 @@
+# This import fixes sys.path issues
+from . import parentpath
+
+from datawrap import filedbwrap, logstore
+import unittest
+import os
+import shutil
+from os.path import dirname
+
+class LogStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.data_dir = os.path.join(dirname(__file__), 'log_store')
+        if not os.path.exists(self.data_dir):
+            os.makedirs(self.data_dir)
+        self.path = os.path.join(self.data_dir, 'store.log')
+
+    def tearDown(self):
+        shutil.rmtree(self.data_dir)
+
+    def test_read_write(self):
+        store = logstore.LogStore(self.path, 'n')
+        store['a'] = [1, 2]
+        store[u'bé'] = 'text'
+        store['a'] = [3]
+        del store[u'bé']
+        self.assertEqual(store['a'], [3])
+        self.assertNotIn(u'bé', store)
+        self.assertRaises(KeyError, store.__delitem__, 'missing')
+        self.assertEqual(len(store), 1)
+        self.assertGreater(store.dead_ratio, 0.5)
+        store.close()
+
+    def test_reopen_from_hint(self):
+        store = logstore.LogStore(self.path, 'n')
+        for i in range(10):
+            store[str(i)] = i
+        del store['0']
+        store.close()
+        self.assertTrue(os.path.exists(logstore.get_hint_path(self.path)))
+
+        store = logstore.LogStore(self.path, 'c')
+        self.assertEqual(sorted(store), [str(i) for i in range(1, 10)])
+        # Records appended after the hint are replayed from the data file
+        store['10'] = 10
+        store.sync()
+        store._close_handles()
+
+        store = logstore.LogStore(self.path, 'r')
+        self.assertEqual(store['10'], 10)
+        self.assertEqual(len(store), 10)
+        store.close()
+
+    def test_drops_torn_write(self):
+        store = logstore.LogStore(self.path, 'n')
+        store['a'] = 1
+        store.close()
+        with open(self.path, 'ab') as fhandle:
+            fhandle.write(logstore.pack_record(b'b', b'partial')[:-3])
+        store = logstore.LogStore(self.path)
+        self.assertNotIn('b', store)
+        store['c'] = 3
+        store.close()
+        store = logstore.LogStore(self.path, 'r')
+        self.assertEqual(sorted(store), ['a', 'c'])
+        store.close()
+
+    def test_compact(self):
+        store = logstore.LogStore(self.path, 'n')
+        for i in range(20):
+            store[str(i % 5)] = i
+        store.sync()
+        size = os.path.getsize(self.path)
+        store.compact()
+        self.assertLess(os.path.getsize(self.path), size)
+        self.assertEqual(store.dead_bytes, 0)
+        self.assertEqual(store['4'], 19)
+        store['5'] = 5
+        store.close()
+        store = logstore.LogStore(self.path, 'r')
+        self.assertEqual(dict((key, store[key]) for key in store),
+                         {'0': 15, '1': 16, '2': 17, '3': 18, '4': 19, '5': 5})
+        store.close()
+
+class FileLogBackendTest(unittest.TestCase):
+    def setUp(self):
+        self.data_dir = os.path.join(dirname(__file__), 'log_backend')
+        if not os.path.exists(self.data_dir):
+            os.makedirs(self.data_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.data_dir)
+
+    def test_compact_and_delete(self):
+        fdict = filedbwrap.FileDict(os.path.join(self.data_dir, 'log'), clear=True,
+                                    backend='log', cache_size=4)
+        for i in range(40):
+            fdict[str(i % 8)] = i
+        fdict.compact()
+        self.assertEqual(fdict._database.dead_bytes, 0)
+        fdict.reopen()
+        self.assertIsInstance(fdict._database, logstore.LogStore)
+        self.assertEqual(fdict['7'], 39)
+        fdict.close(delete_file=True)
+        self.assertEqual(os.listdir(self.data_dir), [])
+
+    def test_unknown_backend(self):
+        for cls in (filedbwrap.FileDict, filedbwrap.FileSet):
+            # __del__ closes the half built wrapper the same way
+            fdict = cls.__new__(cls)
+            self.assertRaises(ValueError, fdict.__init__, os.path.join(self.data_dir, 'x'),
+                              backend='btree')
+            fdict.close()
+            self.assertTrue(fdict.closed)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+# This import fixes sys.path issues
+from . import parentpath
+
+from datawrap import filedbwrap
+import unittest
+import os
+import shutil
+from os.path import dirname
+
+class OrderedFileDictTest(unittest.TestCase):
+    def setUp(self):
+        self.data_dir = os.path.join(dirname(__file__), 'ordered_file')
+        if not os.path.exists(self.data_dir):
+            os.makedirs(self.data_dir)
+        self.ordered = filedbwrap.OrderedFileDict(os.path.join(self.data_dir, 'ordered'),
+                                                  clear=True, cache_size=8)
+        for word in ('pear', 'apple', 'peach', 'plum', 'banana', 'apricot'):
+            self.ordered[word] = len(word)
+        self.ordered.sync_cache()
+
+    def tearDown(self):
+        self.ordered.close(delete_file=True)
+        shutil.rmtree(self.data_dir)
+
+    def test_iteration_order(self):
+        self.assertEqual(list(self.ordered),
+                         ['apple', 'apricot', 'banana', 'peach', 'pear', 'plum'])
+        self.assertEqual(list(reversed(self.ordered))[:2], ['plum', 'pear'])
+
+    def test_range(self):
+        self.assertEqual(list(self.ordered.range('apricot', 'peach')), ['apricot', 'banana'])
+        self.assertEqual(list(self.ordered.range(stop='b', reverse=True)), ['apricot', 'apple'])
+        self.assertEqual(dict(self.ordered.range_items('pe')),
+                         {'peach': 5, 'pear': 4, 'plum': 4})
+
+    def test_prefix(self):
+        self.assertEqual(list(self.ordered.prefix('pe')), ['peach', 'pear'])
+        self.assertEqual(list(self.ordered.prefix('ap', reverse=True)), ['apricot', 'apple'])
+        self.assertEqual(list(self.ordered.prefix('z')), [])
+        self.assertEqual(len(list(self.ordered.prefix(''))), 6)
+
+    def test_merges_unsynced_keys(self):
+        self.ordered['pea'] = 3
+        del self.ordered['pear']
+        self.ordered['peach']
+        self.assertIn('pea', self.ordered.get_cache())
+        self.assertEqual(list(self.ordered.prefix('pe')), ['pea', 'peach'])
+        self.assertEqual(list(self.ordered.prefix('pe', reverse=True)), ['peach', 'pea'])
+
+    def test_requires_ordered_backend(self):
+        self.assertRaises(ValueError, filedbwrap.OrderedFileDict,
+                          os.path.join(self.data_dir, 'log'), backend='log')
+
+    def test_prefix_upper_bound(self):
+        self.assertEqual(filedbwrap.prefix_upper_bound('ab'), 'ac')
+        self.assertIsNone(filedbwrap.prefix_upper_bound(''))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,4 +1,121 @@
-# TODO Test the RedisDictCache class
-
 # This import fixes sys.path issues
 from . import parentpath
+
+from datawrap import rediswrap
+import unittest
+
+class FakePipeline(object):
+    '''
+    Queues commands for a FakeRedisCacheDict, running them together on
+    execute as a single round trip.
+    '''
+    def __init__(self, client):
+        self.client = client
+        self.commands = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, etype, value, traceback):
+        self.commands = []
+
+    def __getattr__(self, name):
+        if name not in ('get', 'mget', 'hgetall', 'set', 'hset'):
+            raise AttributeError(name)
+        return lambda *args: self.commands.append((name, args))
+
+    def execute(self):
+        commands, self.commands = self.commands, []
+        self.client.round_trips.append([(name, args) for name, args in commands])
+        return [getattr(self.client, '_' + name)(*args) for name, args in commands]
+
+class FakeRedisCacheDict(rediswrap.RedisCacheDict):
+    '''
+    A RedisCacheDict backed by a dictionary instead of a server, which
+    records each round trip made as a list of (command, args).
+    '''
+    def __init__(self, data=None, **kwargs):
+        self.data = dict(data or {})
+        self.round_trips = []
+        rediswrap.RedisCacheDict.__init__(self, **kwargs)
+
+    def pipeline(self, transaction=True, shard_hint=None):
+        return FakePipeline(self)
+
+    def _get(self, key):
+        return self.data.get(key)
+
+    def _mget(self, keys):
+        return [self.data.get(key) for key in keys]
+
+    def _hgetall(self, key):
+        return dict(self.data.get(key, {}))
+
+    def _set(self, key, val):
+        self.data[key] = val
+
+    def _hset(self, key, field, val):
+        self.data.setdefault(key, {})[field] = val
+
+    def get(self, key):
+        self.round_trips.append([('get', (key,))])
+        return self._get(key)
+
+    def hgetall(self, key):
+        self.round_trips.append([('hgetall', (key,))])
+        return self._hgetall(key)
+
+    def hdel(self, key, field):
+        self.round_trips.append([('hdel', (key, field))])
+        self.data.get(key, {}).pop(field, None)
+
+    def delete(self, key):
+        self.round_trips.append([('delete', (key,))])
+        self.data.pop(key, None)
+
+class RedisCacheDictTest(unittest.TestCase):
+    def setUp(self):
+        self.redis = FakeRedisCacheDict({'a': '1', 'b': '2', 'h': {'x': '10', 'y': '20'}})
+
+    def test_get_many_one_round_trip(self):
+        vals = self.redis.get_many(['a', 'missing', ('h', 'x'), ('h', 'z'), 'a'], default='-')
+        self.assertEqual(vals, ['1', '-', '10', '-', '1'])
+        self.assertEqual(self.redis.round_trips,
+                         [[('mget', (['a', 'missing'],)), ('hgetall', ('h',))]])
+        # Everything fetched is cached, including whole hashes and misses
+        self.assertEqual(self.redis[('h', 'y')], '20')
+        self.assertIsNone(self.redis['missing'])
+        self.assertEqual(len(self.redis.round_trips), 1)
+        self.assertRaises(KeyError, self.redis.get_many, [1])
+
+    def test_prefetch_batches(self):
+        keys = ['k{}'.format(i) for i in range(rediswrap.DEFAULT_BATCH_SIZE * 2 + 10)]
+        self.redis.prefetch(keys + [('h', 'x')])
+        self.assertEqual(len(self.redis.round_trips), 3)
+        self.assertEqual([len(trip[0][1][0]) for trip in self.redis.round_trips],
+                         [rediswrap.DEFAULT_BATCH_SIZE, rediswrap.DEFAULT_BATCH_SIZE, 10])
+        self.assertEqual(self.redis.round_trips[-1][-1], ('hgetall', ('h',)))
+        self.redis.prefetch(keys, batch_size=5)
+        self.assertEqual(len(self.redis.round_trips), 3)
+        self.redis.prefetch(['a', 'b', 'c'], batch_size=2)
+        self.assertEqual(len(self.redis.round_trips), 5)
+        self.assertEqual(self.redis['b'], '2')
+        self.assertEqual(len(self.redis.round_trips), 5)
+
+    def test_queued_writes_kept(self):
+        self.redis['a'] = 'new'
+        self.redis[('h', 'x')] = 'new'
+        self.redis.prefetch(['a', ('h', 'x')])
+        self.assertEqual(self.redis.round_trips, [])
+        self.assertEqual(self.redis.get_many(['a', ('h', 'x')]), ['new', 'new'])
+        self.redis.sync_cache()
+        self.assertEqual(self.redis.data['a'], 'new')
+        self.assertEqual(self.redis.data['h']['x'], 'new')
+
+    def test_converter(self):
+        redis = FakeRedisCacheDict({'a': '1'}, value_converter=int)
+        self.assertEqual(redis.get_many(['a', 'b'], default=0), [1, 0])
+        self.assertEqual(redis['a'], 1)
+
+if __name__ == '__main__':
+    unittest.main()
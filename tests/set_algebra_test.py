@@ -0,0 +1,121 @@
+# This import fixes sys.path issues
+from . import parentpath
+
+from datawrap import filedbwrap, setalgebra
+import unittest
+import os
+import shutil
+from os.path import dirname
+
+def split_by_digit(key):
+    return 'a' if key < '5' else 'b'
+
+class SortedUniqueTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = os.path.join(dirname(__file__), 'set_algebra_runs')
+        os.makedirs(self.tmp_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_spills_runs(self):
+        elems = [i % 37 for i in range(1000)] + list(range(500, 0, -3))
+        result = list(setalgebra.sorted_unique(elems, run_size=50, tmp_dir=self.tmp_dir))
+        self.assertEqual(result, sorted(set(elems)))
+        # Runs are removed once merged
+        self.assertEqual(os.listdir(self.tmp_dir), [])
+        self.assertEqual(list(setalgebra.sorted_unique([3, 1, 3])), [1, 3])
+        self.assertEqual(list(setalgebra.sorted_unique([])), [])
+
+    def test_bounded_merge(self):
+        read_run = setalgebra._read_run
+        open_runs = [0, 0]
+
+        def counting_read_run(path):
+            open_runs[0] += 1
+            open_runs[1] = max(open_runs)
+            try:
+                for elem in read_run(path):
+                    yield elem
+            finally:
+                open_runs[0] -= 1
+
+        elems = [(i * 7919) % 1000 for i in range(2000)]
+        setalgebra._read_run = counting_read_run
+        try:
+            result = list(setalgebra.sorted_unique(elems, run_size=10, tmp_dir=self.tmp_dir,
+                                                   merge_width=3))
+        finally:
+            setalgebra._read_run = read_run
+        self.assertEqual(result, list(range(1000)))
+        self.assertLessEqual(open_runs[1], 3)
+        self.assertEqual(os.listdir(self.tmp_dir), [])
+        self.assertRaises(ValueError, list, setalgebra.sorted_unique(elems, merge_width=1))
+
+    def test_merges(self):
+        first, second = [1, 3, 5, 7], [2, 3, 7, 9]
+        self.assertEqual(list(setalgebra.merge_union(first, second, [0])),
+                         [0, 1, 2, 3, 5, 7, 9])
+        self.assertEqual(list(setalgebra.merge_intersection(first, second)), [3, 7])
+        self.assertEqual(list(setalgebra.merge_difference(first, second)), [1, 5])
+        self.assertEqual(list(setalgebra.merge_difference(first, [])), first)
+        self.assertEqual(list(setalgebra.merge_intersection([], second)), [])
+
+class StreamingSetOpsTest(unittest.TestCase):
+    def setUp(self):
+        self.data_dir = os.path.join(dirname(__file__), 'set_algebra')
+        if not os.path.exists(self.data_dir):
+            os.makedirs(self.data_dir)
+        self.sets = []
+
+    def tearDown(self):
+        for fset in self.sets:
+            fset.close(delete_file=True)
+        shutil.rmtree(self.data_dir)
+
+    def open_set(self, name, elems=(), split=False):
+        db_name = os.path.join(self.data_dir, name)
+        if split:
+            fset = filedbwrap.SplitFileSet(db_name, ['a', 'b'], split_by_digit, clear=True,
+                                           cache_size=16)
+        else:
+            fset = filedbwrap.FileSet(db_name, clear=True, cache_size=16)
+        fset.update(elems)
+        self.sets.append(fset)
+        return fset
+
+    def check_operations(self, split):
+        evens = set(str(i) for i in range(0, 300, 2))
+        threes = set(str(i) for i in range(0, 300, 3))
+        first = self.open_set('first', evens, split)
+        second = self.open_set('second', threes, split)
+
+        target = self.open_set('union')
+        self.assertEqual(first.union_into(target, second, run_size=20), len(evens | threes))
+        self.assertEqual(set(target), evens | threes)
+
+        target = self.open_set('intersection', split=split)
+        first.intersection_into(target, second, run_size=20, batch_size=7)
+        self.assertEqual(set(target), evens & threes)
+
+        target = self.open_set('difference')
+        setalgebra.difference_into(target, [first, second, ['10']], run_size=20)
+        self.assertEqual(set(target), evens - threes - set(['10']))
+
+        self.assertRaises(ValueError, first.union_into, first, second)
+
+    def test_file_sets(self):
+        self.check_operations(split=False)
+
+    def test_split_file_sets(self):
+        self.check_operations(split=True)
+
+    def test_matching_shards_partition(self):
+        first = self.open_set('first', ['1', '7'], split=True)
+        second = self.open_set('second', ['1', '8'], split=True)
+        partitions = list(setalgebra._partitions([first, second]))
+        self.assertEqual(len(partitions), 2)
+        self.assertEqual(len(setalgebra._partitions([first, ['1']])), 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,152 @@
+# This import fixes sys.path issues
+from . import parentpath
+
+from datawrap import basewrap, filedbwrap
+from datawrap.sharding import JumpHashSplitter, jump_hash, key_hash
+import unittest
+import os
+import shutil
+from os.path import dirname
+
+class JumpHashTest(unittest.TestCase):
+    def test_spread(self):
+        counts = [0] * 8
+        for i in range(8000):
+            counts[jump_hash(key_hash(str(i)), 8)] += 1
+        for count in counts:
+            self.assertGreater(count, 800)
+            self.assertLess(count, 1200)
+
+    def test_minimal_moves(self):
+        keys = [str(i) for i in range(5000)]
+        before = dict((key, JumpHashSplitter(10)(key)) for key in keys)
+        after = dict((key, JumpHashSplitter(13)(key)) for key in keys)
+        for key in keys:
+            # Keys only ever move to the new shards
+            if before[key] != after[key]:
+                self.assertGreaterEqual(after[key], 10)
+        moved = sum(1 for key in keys if before[key] != after[key])
+        self.assertLess(moved, 5000 * 0.3)
+
+    def test_splitter(self):
+        splitter = JumpHashSplitter(4)
+        self.assertEqual(splitter.split_keys, [0, 1, 2, 3])
+        self.assertEqual(splitter, JumpHashSplitter(4))
+        self.assertNotEqual(splitter, JumpHashSplitter(5))
+        self.assertEqual(splitter('abc'), splitter(u'abc'))
+        self.assertEqual(JumpHashSplitter(1)('abc'), 0)
+        self.assertRaises(ValueError, JumpHashSplitter, 0)
+
+class ReshardTest(unittest.TestCase):
+    def setUp(self):
+        self.data_dir = os.path.join(dirname(__file__), 'sharding')
+        if not os.path.exists(self.data_dir):
+            os.makedirs(self.data_dir)
+        self.db_name = os.path.join(self.data_dir, 'hashed')
+
+    def tearDown(self):
+        shutil.rmtree(self.data_dir)
+
+    def check_reshard(self, **kwargs):
+        split = filedbwrap.SplitFileDict(self.db_name, num_shards=3, clear=True,
+                                         stringify_keys=True, cache_size=60, **kwargs)
+        split.update((i, i) for i in range(300))
+        owners = dict((str(i), split.split_func(str(i))) for i in range(300))
+        moved = split.reshard(7, batch_size=16)
+        self.assertEqual(moved, sum(1 for key, owner in owners.items()
+                                    if JumpHashSplitter(7)(key) != owner))
+        self.assertEqual(split.split_keys, list(range(7)))
+        self.assertEqual(split.cache_size, 60)
+        self.assertEqual(len(split), 300)
+        self.assertEqual(split[123], 123)
+        split.close()
+
+        split = filedbwrap.SplitFileDict(self.db_name, num_shards=7, stringify_keys=True,
+                                         **kwargs)
+        self.assertEqual(sorted(split, key=int), [str(i) for i in range(300)])
+        for skey in range(7):
+            for key in split._keyed_db[skey]:
+                self.assertEqual(split.split_func(key), skey)
+        split.reshard(2)
+        self.assertEqual(len(split), 300)
+        self.assertEqual(split[299], 299)
+        split.close()
+        self.assertFalse(any(name.startswith('hashed_5') for name in os.listdir(self.data_dir)))
+
+    def test_reshard(self):
+        self.check_reshard()
+
+    def test_reshard_shard_workers(self):
+        self.check_reshard(shard_workers=3)
+
+    def test_reshard_max_open(self):
+        self.check_reshard(max_open=2)
+
+    def test_split_set(self):
+        fset = filedbwrap.SplitFileSet(self.db_name, num_shards=2, clear=True)
+        fset.update(str(i) for i in range(100))
+        fset.reshard(5)
+        self.assertEqual(len(fset), 100)
+        self.assertIn('42', fset)
+        self.assertNotIn('100', fset)
+        fset.close(delete_file=True)
+
+    def test_stored_count(self):
+        split = filedbwrap.SplitFileDict(self.db_name, num_shards=3, clear=True,
+                                         stringify_keys=True)
+        split.update((i, i) for i in range(200))
+        split.reshard(5)
+        split.close()
+        self.assertRaises(ValueError, filedbwrap.SplitFileDict, self.db_name, num_shards=3)
+        split = filedbwrap.SplitFileDict(self.db_name, stringify_keys=True)
+        self.assertEqual(split.split_func, JumpHashSplitter(5))
+        self.assertEqual(len(split), 200)
+        self.assertTrue(all(text in split for text in map(str, range(200))))
+        split.close()
+        # Clearing starts over with any count
+        split = filedbwrap.SplitFileDict(self.db_name, num_shards=2, clear=True)
+        split.close(delete_file=True)
+        self.assertEqual(os.listdir(self.data_dir), [])
+        self.assertRaises(ValueError, filedbwrap.SplitFileDict, self.db_name)
+
+    def check_interrupted(self, fail_switch, num_shards):
+        split = filedbwrap.SplitFileDict(self.db_name, num_shards=3, clear=True,
+                                         stringify_keys=True)
+        split.update((i, i) for i in range(200))
+        write_shard_count = basewrap.write_shard_count
+
+        def interrupt(db_name, count):
+            if not fail_switch:
+                write_shard_count(db_name, count)
+            raise IOError("interrupted")
+
+        basewrap.write_shard_count = interrupt
+        try:
+            self.assertRaises(IOError, split.reshard, num_shards)
+        finally:
+            basewrap.write_shard_count = write_shard_count
+        split.close()
+        split = filedbwrap.SplitFileDict(self.db_name, stringify_keys=True)
+        self.assertEqual(split.split_func, JumpHashSplitter(3 if fail_switch else num_shards))
+        self.assertEqual([split[i] for i in range(200)], list(range(200)))
+        split.close()
+
+    def test_interrupted_grow(self):
+        self.check_interrupted(True, 5)
+        self.check_interrupted(False, 5)
+
+    def test_interrupted_shrink(self):
+        self.check_interrupted(True, 2)
+        self.check_interrupted(False, 2)
+
+    def test_invalid(self):
+        split = filedbwrap.SplitFileDict(self.db_name, ['a'], lambda key: 'a', clear=True)
+        self.assertRaises(ValueError, split.reshard, 2)
+        split.close()
+        filedbwrap.SplitFileDict(self.db_name, num_shards=2, clear=True).close()
+        split = filedbwrap.SplitFileDict(self.db_name, num_shards=2, read_only=True)
+        self.assertRaises(AttributeError, split.reshard, 3)
+        split.close()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,105 @@
+# This import fixes sys.path issues
+from . import parentpath
+
+from datawrap import filedbwrap, snapshot
+import unittest
+import os
+import shutil
+from os.path import dirname
+
+class SnapshotDictTest(unittest.TestCase):
+    def setUp(self):
+        self.data_dir = os.path.join(dirname(__file__), 'snapshot')
+        if not os.path.exists(self.data_dir):
+            os.makedirs(self.data_dir)
+        self.path = os.path.join(self.data_dir, 'data.snap')
+
+    def tearDown(self):
+        shutil.rmtree(self.data_dir)
+
+    def test_lazy_values(self):
+        codec = filedbwrap.get_value_codec('zlib')
+        records = [(u'k\xe9y{}'.format(i), codec.encode([i] * 500)) for i in range(50)]
+        snapshot.write_snapshot(self.path, records)
+        sdict = snapshot.SnapshotDict(self.path)
+        self.assertEqual(len(sdict), 50)
+        # Values which were never decoded are copied as they were
+        self.assertEqual(dict(sdict.encoded_items()), dict(records))
+        self.assertIsInstance(sdict._data[u'k\xe9y7'], snapshot.LazyValue)
+        self.assertEqual(sdict[u'k\xe9y7'], [7] * 500)
+        self.assertEqual(sdict._data[u'k\xe9y7'], [7] * 500)
+        # Decoding while iterating doesn't change the keys
+        self.assertEqual(sum(len(val) for val in sdict.values()), 50 * 500)
+        sdict['new'] = 1
+        del sdict[u'k\xe9y0']
+        encoded = dict(sdict.encoded_items(codec))
+        self.assertEqual(encoded[u'k\xe9y1'], codec.encode([1] * 500))
+        self.assertEqual(sorted(encoded), sorted(sdict))
+        sdict.close()
+        self.assertEqual(len(sdict), 0)
+
+    def test_empty_and_invalid(self):
+        snapshot.write_snapshot(self.path, [])
+        sdict = snapshot.SnapshotDict(self.path)
+        self.assertEqual(dict(sdict), {})
+        sdict.close()
+        with open(self.path, 'r+b') as fhandle:
+            fhandle.write(b'corrupt!')
+        self.assertRaises(ValueError, snapshot.SnapshotDict, self.path)
+        with open(self.path, 'wb') as fhandle:
+            fhandle.write(snapshot.SNAPSHOT_HEADER.pack(snapshot.SNAPSHOT_MAGIC, 5, 1000))
+        self.assertRaises(ValueError, snapshot.SnapshotDict, self.path)
+
+class MemFromFileSnapshotTest(unittest.TestCase):
+    def setUp(self):
+        self.data_dir = os.path.join(dirname(__file__), 'snapshot_file')
+        self.db_name = os.path.join(self.data_dir, 'data')
+        self.snapshot_path = filedbwrap.get_snapshot_path(self.db_name + '.fd')
+
+    def tearDown(self):
+        shutil.rmtree(self.data_dir)
+
+    def test_snapshot_round_trip(self):
+        mdict = filedbwrap.MemFromFileDict(self.db_name, clear=True, snapshot=True,
+                                           stringify_keys=True)
+        for i in range(20):
+            mdict[i] = {'val': i}
+        mdict.compact()
+        self.assertTrue(os.path.exists(self.snapshot_path))
+        self.assertFalse(os.path.exists(self.db_name + '.fd'))
+        mdict.reopen()
+        self.assertIsInstance(mdict.get_cache(), snapshot.SnapshotDict)
+        self.assertEqual(mdict[3], {'val': 3})
+        mdict[3]['val'] = 'changed'
+        del mdict[4]
+        # Journaled on top of the snapshot
+        mdict.reopen()
+        self.assertEqual(mdict[3], {'val': 'changed'})
+        self.assertNotIn(4, mdict)
+        mdict.compact()
+        mdict.reopen(read_only=True)
+        self.assertEqual(len(mdict), 19)
+        self.assertEqual(mdict[19], {'val': 19})
+        mdict.close(delete_file=True)
+        self.assertFalse(os.path.exists(self.snapshot_path))
+
+    def test_converts_formats(self):
+        mdict = filedbwrap.MemFromFileDict(self.db_name, clear=True)
+        mdict['a'] = 1
+        mdict.compact()
+        mdict.reopen(snapshot=True)
+        self.assertEqual(mdict['a'], 1)
+        mdict.compact()
+        self.assertTrue(os.path.exists(self.snapshot_path))
+        mdict.reopen(snapshot=False)
+        self.assertEqual(mdict['a'], 1)
+        mdict.compact()
+        self.assertFalse(os.path.exists(self.snapshot_path))
+        mdict.reopen()
+        self.assertEqual(dict(mdict.items()), {'a': 1})
+        mdict.clear(snapshot=True)
+        self.assertEqual(len(mdict), 0)
+        mdict.close(delete_file=True)
+
+if __name__ == '__main__':
+    unittest.main()
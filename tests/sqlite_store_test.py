@@ -0,0 +1,90 @@
+# This import fixes sys.path issues
+from . import parentpath
+
+from datawrap import filedbwrap, sqlitestore
+import unittest
+import os
+import shutil
+import threading
+from os.path import dirname
+
+class SqliteStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.data_dir = os.path.join(dirname(__file__), 'sqlite_store')
+        if not os.path.exists(self.data_dir):
+            os.makedirs(self.data_dir)
+        self.path = os.path.join(self.data_dir, 'store.db')
+
+    def tearDown(self):
+        shutil.rmtree(self.data_dir)
+
+    def test_read_write(self):
+        store = sqlitestore.SqliteStore(self.path, 'n')
+        store['a'] = {'b': [1, 2]}
+        store.set_many([('c', 3), ('d', 4)])
+        store['c'] = 5
+        del store['d']
+        self.assertRaises(KeyError, store.__delitem__, 'd')
+        store.delete_many(['missing', 'a'])
+        self.assertEqual(store['c'], 5)
+        self.assertNotIn('a', store)
+        self.assertEqual(len(store), 1)
+        self.assertEqual(list(store), ['c'])
+        store.close()
+
+        store = sqlitestore.SqliteStore(self.path, 'r')
+        self.assertEqual(store['c'], 5)
+        self.assertRaises(IOError, store.__setitem__, 'e', 1)
+        store.close()
+
+    def test_failed_batch_rolls_back(self):
+        store = sqlitestore.SqliteStore(self.path, 'n', codec='marshal')
+        # marshal can't encode objects, which fails part way through the batch
+        self.assertRaises(ValueError, store.set_many, [('a', 1), ('b', object())])
+        self.assertNotIn('a', store)
+        store.close()
+
+    def test_concurrent_readers(self):
+        store = sqlitestore.SqliteStore(self.path, 'n')
+        store.set_many((str(i), i) for i in range(100))
+        results = []
+        def read():
+            results.append(sum(store[str(i)] for i in range(100)))
+        threads = [threading.Thread(target=read) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        store['100'] = 100
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, [4950] * 4)
+        self.assertEqual(len(store._readers), 4)
+        store.close()
+
+class FileSqliteBackendTest(unittest.TestCase):
+    def setUp(self):
+        self.data_dir = os.path.join(dirname(__file__), 'sqlite_backend')
+        if not os.path.exists(self.data_dir):
+            os.makedirs(self.data_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.data_dir)
+
+    def test_sync_uses_batches(self):
+        fdict = filedbwrap.FileDict(os.path.join(self.data_dir, 'sqlite'), clear=True,
+                                    backend='sqlite', cache_size=100)
+        batches = []
+        set_many = fdict._database.set_many
+        fdict._database.set_many = lambda items: batches.append(len(items)) or set_many(items)
+        fdict.update((str(i), i) for i in range(50))
+        fdict.sync_cache()
+        self.assertEqual(batches, [50])
+        fdict.delete_many(['1', '2'])
+        fdict.compact()
+        fdict.reopen(read_only=True)
+        self.assertEqual(len(fdict), 48)
+        self.assertEqual(fdict['49'], 49)
+        fdict.close(delete_file=True)
+        self.assertEqual(os.listdir(self.data_dir), [])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+# This import fixes sys.path issues
+from . import parentpath
+
+from datawrap import filedbwrap, valuecodec
+import unittest
+import os
+import pickle
+import shutil
+from os.path import dirname
+
+class ValueCodecTest(unittest.TestCase):
+    def test_round_trip(self):
+        val = {'text': u'lorem ipsum ' * 200, 'nums': [1, 2.5, None]}
+        for name in valuecodec.NAMED_CODECS:
+            if name == 'lzma' and valuecodec.lzma is None:
+                continue
+            codec = valuecodec.get_value_codec(name)
+            self.assertEqual(codec.decode(codec.encode(val)), val)
+
+    def test_compress_threshold(self):
+        codec = valuecodec.ValueCodec(compression='zlib', compress_threshold=100)
+        small = codec.encode(u'x' * 10)
+        # Small pickles are stored untagged, just as shelve would
+        self.assertEqual(pickle.loads(small), u'x' * 10)
+        large = codec.encode(u'x' * 1000)
+        self.assertEqual(bytearray(large)[0] & valuecodec.TAG_MASK, valuecodec.TAG_BASE)
+        self.assertLess(len(large), 100)
+
+    def test_decode_any_codec(self):
+        val = [u'abc' * 500]
+        plain = valuecodec.get_value_codec(None)
+        for name in ('marshal', 'zlib', 'marshal-zlib'):
+            self.assertEqual(plain.decode(valuecodec.get_value_codec(name).encode(val)), val)
+        self.assertEqual(plain.decode(pickle.dumps(val, 0)), val)
+
+    def test_unknown_codec(self):
+        self.assertRaises(ValueError, valuecodec.get_value_codec, 'snappy')
+        self.assertRaises(ValueError, valuecodec.ValueCodec, serializer='json')
+
+class FileCodecTest(unittest.TestCase):
+    def setUp(self):
+        self.data_dir = os.path.join(dirname(__file__), 'value_codec')
+        if not os.path.exists(self.data_dir):
+            os.makedirs(self.data_dir)
+        self.db_path = os.path.join(self.data_dir, 'codec')
+
+    def tearDown(self):
+        shutil.rmtree(self.data_dir)
+
+    def test_reopen_with_other_codec(self):
+        fdict = filedbwrap.FileDict(self.db_path, clear=True, codec='zlib')
+        fdict['text'] = u'lorem ipsum ' * 200
+        fdict.reopen()
+        self.assertEqual(fdict._database.codec.compression, 'zlib')
+        fdict.close()
+
+        fdict = filedbwrap.FileDict(self.db_path, codec='marshal')
+        self.assertEqual(fdict['text'], u'lorem ipsum ' * 200)
+        fdict['more'] = [1, 2]
+        fdict.close()
+
+        mem = filedbwrap.MemFromFileDict(self.db_path, read_only=True)
+        self.assertEqual(mem['more'], [1, 2])
+        self.assertEqual(mem['text'], u'lorem ipsum ' * 200)
+        mem.close()
+
+    def test_file_set(self):
+        fset = filedbwrap.FileSet(self.db_path, clear=True, codec='marshal')
+        fset.update(['a', 'b'])
+        fset.reopen()
+        self.assertIn('a', fset)
+        self.assertEqual(len(fset), 2)
+        fset.close(delete_file=True)
+
+if __name__ == '__main__':
+    unittest.main()